@@ -0,0 +1,17 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# Keep the database, index and embedding cache of the tests out of the checked-out tree.
+# Set before any test module imports the app, which reads them at import time; a file
+# database, because every connection to an in-memory SQLite database is a new one.
+TEST_DATA_DIRECTORY = tempfile.mkdtemp(prefix="rag-test-")
+atexit.register(shutil.rmtree, TEST_DATA_DIRECTORY, True)
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(TEST_DATA_DIRECTORY, "metadata.db"))
+os.environ.setdefault("VECTOR_DB_DIRECTORY", os.path.join(TEST_DATA_DIRECTORY, "faiss_index"))
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(TEST_DATA_DIRECTORY, "embedding_cache.sqlite3"))
+# No network or API key: answers come from the fake chat model
+os.environ.setdefault("LLM_PROVIDER", "fake")
+# Ingest jobs queued by the tests are picked up without waiting a full poll interval
+os.environ.setdefault("INGEST_POLL_INTERVAL_SECONDS", "0.05")
@@ -0,0 +1,37 @@
+# app/gunicorn_conf.py
+#
+# Multi-worker serving: gunicorn -c app/gunicorn_conf.py app.main:app
+#
+# The app is imported and its models loaded once in the master process, then forked, so
+# the workers share the model weights copy-on-write instead of each loading its own.
+# The FAISS segments are memory-mapped (INDEX_MMAP) and shared through the page cache.
+# Each worker serves queries; exactly one of them runs ingestion (see app/services/jobs.py).
+
+import os
+
+# Tokenizer thread pools do not survive a fork
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+
+
+def when_ready(server):
+    # Loads the weights only: running a model before the fork would start thread pools
+    # (OpenMP, tokenizers) in the master that the forked workers cannot use. Each worker
+    # still runs its own warm-up embedding in the startup event.
+    from app.services.model_registry import MODEL_WARMUP, chat_model, embedding_model
+
+    if MODEL_WARMUP:
+        embedding_model.get()
+        chat_model.get()
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,18 +1,31 @@
 # app/main.py
 
-from fastapi import FastAPI, HTTPException, status
-from .routes import upload, query, documents
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import CONTENT_TYPE_LATEST
+from .routes import upload, query, documents, index
+import logging
 import os
-from datetime import datetime
 
-# --- Crucial Imports for the /query/ask endpoint ---
-from app.routes.query import QueryRequest, QueryResponse
-from app.services.retriever import get_faiss_vector_store
-from app.services.llm import llm # Import the global llm instance
+from app.services.retriever import collections, index_manager
+from app.services.jobs import ingest_queue
+from app.services.pdf_chunking import shutdown_parse_pool
+from app.services.metrics import SERVER_TIMING_ENABLED, latest_metrics, server_timing, start_request
+from app.services.model_registry import MODEL_WARMUP, record_startup, startup_report, warm_up
 # --- NEW: Imports for database schema creation ---
-from app.models.metadata import Base, engine # Import Base and engine
+from app.models.metadata import Base, engine, add_missing_columns # Import Base and engine
 # --- End NEW Imports ---
 
+# Configuration
+# DEBUG also logs the text of every retrieved chunk
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+logging.basicConfig(level=LOG_LEVEL, format="[%(asctime)s] %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -25,6 +38,34 @@ app = FastAPI(
 app.include_router(upload.router, prefix="/upload", tags=["Upload"])
 app.include_router(query.router, prefix="/query", tags=["Query"])
 app.include_router(documents.router, prefix="/documents", tags=["Documents"])
+app.include_router(index.router, prefix="/index", tags=["Index"])
+
+# Everything the app imports is loaded by now; models are not (see model_registry)
+record_startup("import", time.perf_counter() - _import_started)
+
+@app.middleware("http")
+async def stage_timings(request: Request, call_next):
+    """Collects the stage timings of each request and reports them in a Server-Timing header."""
+    started = time.perf_counter()
+    timings = start_request()
+    response = await call_next(request)
+    # A streamed response reports only the stages that ran before its first byte
+    if SERVER_TIMING_ENABLED and timings:
+        response.headers["Server-Timing"] = server_timing(timings, time.perf_counter() - started)
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics, including the per-stage latency histograms."""
+    return Response(latest_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/startup", summary="View start-up timings")
+async def get_startup_report():
+    """
+    Reports how long importing the app, start-up and model warm-up took, which models
+    are loaded, the worker's resident memory and whether it is the ingest writer.
+    """
+    return {**startup_report(), "worker": ingest_queue.stats()}
 
 @app.get("/")
 async def root():
@@ -37,99 +78,48 @@ async def root():
 # In a Docker environment, these are usually handled by docker-compose's env_file
 @app.on_event("startup")
 async def startup_event():
+    started = time.perf_counter()
     # Load environment variables (if .env exists)
     if os.path.exists(".env"):
         from dotenv import load_dotenv
         load_dotenv()
-        print("Environment variables loaded from .env file.")
+        logger.info("Environment variables loaded from .env file.")
 
     # --- NEW: Create database tables on startup ---
-    print(f"[{datetime.utcnow()}] Attempting to create database tables...")
+    logger.info("Attempting to create database tables...")
     try:
         Base.metadata.create_all(bind=engine)
-        print(f"[{datetime.utcnow()}] Database tables created successfully (if they didn't exist).")
+        add_missing_columns()
+        logger.info("Database tables created successfully (if they didn't exist).")
     except Exception as e:
-        print(f"[{datetime.utcnow()}] ERROR: Failed to create database tables: {e}", flush=True)
+        logger.error("Failed to create database tables: %s", e)
         # It's critical to raise an exception here if table creation fails,
         # as the app cannot function without the database.
         raise RuntimeError(f"Database table creation failed: {e}")
     # --- End NEW ---
 
+    # Load the FAISS segments once so the first query does not pay for it
+    try:
+        index_manager.refresh()
+    except FileNotFoundError:
+        logger.info("No FAISS index on disk yet; it will be created on first ingestion.")
+    except Exception as e:
+        logger.warning("Failed to preload FAISS index: %s", e)
 
-# The /query/ask endpoint is placed here for debugging purposes as discussed.
-# For better project structure, it should ideally be in app/routes/query.py
-# If you have this endpoint already defined in app/routes/query.py,
-# this definition here in main.py will override it.
-@app.post("/query/ask", response_model=QueryResponse)
-async def ask_query(query_request: QueryRequest):
-    """
-    Accepts a user query and retrieves relevant document chunks from the vector database.
-    These chunks are then passed to the LLM to generate a contextual response.
-    """
-    if not query_request.query:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Query cannot be empty.")
-
-    current_query = query_request.query
-    top_k = query_request.top_k
+    # Runs in every worker process; one of them becomes the ingest writer
+    ingest_queue.start()
 
-    # Ensure LLM instance is initialized
-    if llm is None:
-        print(f"[{datetime.utcnow()}] LLM instance is None. This indicates an issue during LLM initialization in app/services/llm.py (e.g., missing/invalid API key, network issue).")
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="LLM service not initialized. Please check server logs for details.")
+    # Load the embedding model and LLM client now rather than on the first request
+    if MODEL_WARMUP:
+        await run_in_threadpool(warm_up)
+    record_startup("startup", time.perf_counter() - started)
+    report = startup_report()
+    logger.info("Start-up finished: %s, RSS %s bytes.", report["seconds"], report["rss_bytes"])
 
-    print(f"[{datetime.utcnow()}] Received query: '{current_query}' with top_k: {top_k}")
 
-    try:
-        # Retrieve chunks from the vector store
-        faiss_store = get_faiss_vector_store()
-        print(f"[{datetime.utcnow()}] FAISS store loaded for query.")
-
-        # Perform similarity search to get relevant documents
-        retrieved_docs = faiss_store.similarity_search(current_query, k=top_k)
-        print(f"[{datetime.utcnow()}] Retrieved {len(retrieved_docs)} documents from FAISS.")
-
-        # Log the content of the retrieved documents for debugging
-        if not retrieved_docs:
-            print(f"[{datetime.utcnow()}] No relevant documents retrieved for query: '{current_query}'")
-            return {"query": current_query, "response": "I could not find any relevant information for your query in the uploaded documents."}
-
-        for i, doc in enumerate(retrieved_docs):
-            print(f"[{datetime.utcnow()}] Retrieved Document {i+1} (Source: {doc.metadata.get('source', 'N/A')}, Page: {doc.metadata.get('page_number', 'N/A')}, Chunk Index: {doc.metadata.get('chunk_index', 'N/A')}):")
-            print(f"Chunk content: {doc.page_content[:500]}...") # Print first 500 chars for better visibility
-
-        # Prepare context for LLM from the retrieved chunks
-        context = "\n\n".join([doc.page_content for doc in retrieved_docs])
-        print(f"[{datetime.utcnow()}] Context prepared for LLM with {len(context)} characters.")
-
-        # Define the RAG prompt template
-        prompt_template = f"""
-        Use the following pieces of context to answer the user's question.
-        If you don't know the answer, just say that you don't know, don't try to make up an answer.
-
-        Context:
-        {context}
-
-        Question: {current_query}
-
-        Answer:
-        """
-        print(f"[{datetime.utcnow()}] Sending prompt to LLM. Prompt length: {len(prompt_template)} characters.")
-
-        # Invoke the LLM to generate the response
-        try:
-            response = llm.invoke(prompt_template)
-            print(f"[{datetime.utcnow()}] LLM response received. Response length: {len(response.content)} characters.")
-            return {"query": current_query, "response": response.content}
-        except Exception as llm_error:
-            print(f"[{datetime.utcnow()}] ERROR: LLM invocation failed: {llm_error}", flush=True)
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"LLM API error: {str(llm_error)}")
-
-    except FileNotFoundError as e:
-        print(f"[{datetime.utcnow()}] FileNotFoundError during query: {e}", flush=True)
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Vector database not found. Please ingest documents first: {str(e)}")
-    except ValueError as e:
-        print(f"[{datetime.utcnow()}] ValueError during query: {e}", flush=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Configuration error: {str(e)}")
-    except Exception as e:
-        print(f"[{datetime.utcnow()}] General Error during query processing: {e}", flush=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred while processing the query: {str(e)}")
\ No newline at end of file
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Stop taking ingestion work; jobs that have not started stay queued for the next writer.
+    ingest_queue.shutdown()
+    shutdown_parse_pool()
+    collections.shutdown()
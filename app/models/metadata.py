@@ -1,11 +1,14 @@
 #/app/models/metadata.py
 
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, ForeignKey
+from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, ForeignKey, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 # Database URL from environment variable
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
@@ -22,8 +25,11 @@ class Document(Base):
     id = Column(String, primary_key=True, index=True)
     filename = Column(String, nullable=False)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=True) # when the latest version finished ingesting
     num_pages = Column(Integer)
     status = Column(String, default="processing") # e.g., 'processing', 'completed', 'failed'
+    content_hash = Column(String(64), index=True, nullable=True) # SHA-256 of the uploaded file
+    collection = Column(String, index=True, nullable=True) # vector collection; NULL is the default collection
 
     chunks = relationship("Chunk", back_populates="document")
 
@@ -36,12 +42,55 @@ class Chunk(Base):
     page_number = Column(Integer)
     chunk_index = Column(Integer)
     vector_id = Column(String, unique=True, nullable=True) # ID from vector DB
+    content_hash = Column(String(64), index=True, nullable=True) # SHA-256 of chunk_text
 
     document = relationship("Document", back_populates="chunks")
 
+class IngestJobRecord(Base):
+    __tablename__ = "ingest_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    document_id = Column(String, nullable=False)
+    filename = Column(String, nullable=False)
+    collection = Column(String, nullable=True)
+    status = Column(String, default="queued", index=True) # 'queued', 'processing', 'completed', 'failed', 'duplicate'
+    stage = Column(String, nullable=True) # 'parsing', 'embedding', 'persisting'
+    pages_parsed = Column(Integer, default=0)
+    chunks_total = Column(Integer, nullable=True)
+    chunks_embedded = Column(Integer, default=0)
+    chunks_persisted = Column(Integer, default=0)
+    detail = Column(Text, nullable=True)
+    spool_path = Column(String, nullable=True) # uploaded bytes waiting for the ingest writer
+    source_format = Column(String, nullable=True) # 'pdf', 'text' or 'pages'; NULL means sniffed at ingestion
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+def add_missing_columns():
+    """
+    Adds columns that were introduced after a table was first created. create_all()
+    never alters existing tables, so databases created by older versions of the app
+    would otherwise be missing them. Only nullable, additive changes are handled.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                if column.index:
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table.name}_{column.name} ON {table.name} ({column.name})"))
+                logger.info("Added missing column %s.%s", table.name, column.name)
+
 # Create tables (call this from a startup script or main.py if needed, or migration tool)
 def init_db():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
 
 # Pydantic models for API request/response validation (optional, but good practice)
 from pydantic import BaseModel
@@ -51,8 +100,11 @@ class DocumentMetadata(BaseModel):
     id: str
     filename: str
     uploaded_at: datetime
+    updated_at: Optional[datetime] = None
     num_pages: Optional[int]
     status: str
+    content_hash: Optional[str] = None
+    collection: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -64,6 +116,7 @@ class ChunkMetadata(BaseModel):
     chunk_index: Optional[int]
     chunk_text: str # Usually not exposed via API, but good for internal use
     vector_id: Optional[str]
+    content_hash: Optional[str] = None
 
     class Config:
         from_attributes = True
\ No newline at end of file
@@ -0,0 +1,23 @@
+# app/rebuild_index.py
+
+import argparse
+import sys
+
+from app.services.ann import INDEX_TYPE, INDEX_TYPES
+from app.services.retriever import collections
+from app.services.sharding import DEFAULT_COLLECTION
+
+def rebuild(index_type: str, collection: str = DEFAULT_COLLECTION) -> dict:
+    index = collections.get(collection)
+    print(f"[Rebuild] Migrating collection '{index.name}' ({index.num_shards} shard(s)) to a '{index_type}' index...")
+    result = index.rebuild(index_type)
+    print(f"[Rebuild] Done: {result['num_vectors']} vectors, {result['previous_index_type']} -> {result['index_type']} in {result['seconds']:.2f}s.")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the FAISS index as another index type without re-embedding.")
+    parser.add_argument("--type", choices=INDEX_TYPES, default=INDEX_TYPE, help="target index type (default: INDEX_TYPE)")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="collection to rebuild (default: the default collection)")
+    args = parser.parse_args()
+    rebuild(args.type, args.collection)
+    sys.exit(0)
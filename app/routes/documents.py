@@ -2,7 +2,10 @@
 
 from fastapi import APIRouter, HTTPException, status
 from typing import List, Optional
-from app.models.metadata import SessionLocal, Document, DocumentMetadata
+from fastapi.concurrency import run_in_threadpool
+from app.models.metadata import SessionLocal, Document, Chunk, DocumentMetadata
+from app.services.retriever import collections
+from app.services.metadata_filter import in_collection
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 
@@ -12,17 +15,20 @@ router = APIRouter()
 async def get_document_metadata(
     skip: int = 0,
     limit: int = 100,
-    status_filter: Optional[str] = None
+    status_filter: Optional[str] = None,
+    collection: Optional[str] = None
 ):
     """
     Retrieves metadata for all processed documents stored in the system.
-    Allows for pagination and filtering by processing status.
+    Allows for pagination and filtering by processing status and collection.
     """
     db: Session = SessionLocal()
     try:
         query = db.query(Document)
         if status_filter:
             query = query.filter(Document.status == status_filter)
+        if collection:
+            query = query.filter(in_collection(collection))
 
         documents = query.order_by(desc(Document.uploaded_at)).offset(skip).limit(limit).all()
         return [DocumentMetadata.model_validate(doc) for doc in documents]
@@ -32,4 +38,45 @@ async def get_document_metadata(
             detail=f"An error occurred while fetching document metadata: {str(e)}"
         )
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def _delete_document(document_id: str) -> dict:
+    db: Session = SessionLocal()
+    try:
+        document = db.get(Document, document_id)
+        if document is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Document '{document_id}' not found."
+            )
+        if document.status in ("queued", "processing"):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Document '{document_id}' is still being ingested; try again once it has finished."
+            )
+
+        vector_ids = [vector_id for (vector_id,) in db.query(Chunk.vector_id).filter(Chunk.document_id == document_id)]
+        # Hide the vectors from search first, then drop the rows
+        collections.get(document.collection).remove(vector_ids)
+        deleted_chunks = db.query(Chunk).filter(Chunk.document_id == document_id).delete(synchronize_session=False)
+        db.delete(document)
+        db.commit()
+        return {"document_id": document_id, "deleted_chunks": deleted_chunks, "status": "deleted"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while deleting document '{document_id}': {str(e)}"
+        )
+    finally:
+        db.close()
+
+@router.delete("/{document_id}", response_model=dict, summary="Delete a document and its vectors")
+async def delete_document(document_id: str):
+    """
+    Removes a document, its chunk rows and its vectors. Vectors are tombstoned in the
+    live index immediately and physically removed when their segments are next merged.
+    """
+    return await run_in_threadpool(_delete_document, document_id)
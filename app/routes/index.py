@@ -0,0 +1,183 @@
+#/app/routes/index.py
+
+from fastapi import APIRouter, HTTPException, status
+from pydantic import BaseModel
+from typing import List, Optional
+from fastapi.concurrency import run_in_threadpool
+from datetime import datetime
+from app.services.retriever import collections, index_manager, filter_cache
+from app.services.sharding import CollectionNotFoundError
+from app.services.embedding_cache import get_embedding_cache
+from app.services.answer_cache import get_answer_cache
+
+router = APIRouter()
+
+class CompactionResult(BaseModel):
+    finished_at: datetime
+    removed_vectors: int
+    seconds: float
+
+class SegmentMergeResult(BaseModel):
+    finished_at: datetime
+    merged_segments: int
+    num_vectors: int
+    removed_vectors: int
+    index_type: str
+    seconds: float
+
+class SegmentStats(BaseModel):
+    name: str
+    num_vectors: int
+    index_type: str
+    size_bytes: int
+
+class IndexStats(BaseModel):
+    directory: str
+    loaded: bool
+    generation: Optional[int]
+    published_generation: int
+    index_type: Optional[str]
+    num_vectors: int
+    num_tombstones: int
+    num_segments: int
+    segments: List[SegmentStats]
+    index_size_bytes: int
+    load_time_seconds: Optional[float]
+    loaded_at: Optional[datetime]
+    last_compaction: Optional[CompactionResult]
+    last_merge: Optional[SegmentMergeResult]
+
+@router.get("/stats", response_model=IndexStats, summary="View the resident vector index")
+async def get_index_stats():
+    """
+    Reports the generation, segments, size and load time of the FAISS index held in memory.
+    """
+    try:
+        return IndexStats(**index_manager.stats())
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while reading index stats: {str(e)}"
+        )
+
+@router.post("/compact", response_model=CompactionResult, summary="Drop deleted vectors from the index")
+async def compact_index(collection: Optional[str] = None):
+    """
+    Rewrites the segments holding tombstoned vectors without them, in every shard of the
+    collection (the default one if none is named). This normally happens in the background
+    once deleted vectors pass COMPACTION_TOMBSTONE_RATIO; this endpoint forces it.
+    """
+    try:
+        return CompactionResult(**(await run_in_threadpool(collections.get(collection).compact)))
+    except CollectionNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while compacting the index: {str(e)}"
+        )
+
+class CollectionStats(BaseModel):
+    name: str
+    num_shards: int
+    shard_processes: bool
+    num_vectors: int
+    index_size_bytes: int
+    shards: List[IndexStats]
+
+class CollectionRequest(BaseModel):
+    name: str
+    num_shards: Optional[int] = None  # Defaults to COLLECTION_NUM_SHARDS; fixed once created
+
+@router.get("/collections", response_model=List[CollectionStats], summary="List the vector collections")
+async def list_collections():
+    """
+    Lists every collection with its shards. Shards of a collection this worker has not
+    searched yet are reported as not loaded.
+    """
+    try:
+        return [CollectionStats(**collections.get(name).stats()) for name in collections.names()]
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while listing collections: {str(e)}"
+        )
+
+@router.post("/collections", response_model=CollectionStats, status_code=status.HTTP_201_CREATED, summary="Create a sharded vector collection")
+async def create_collection(request: CollectionRequest):
+    """
+    Creates an empty collection split into `num_shards` shards. Documents are assigned
+    to shards by a hash of their ID. Uploading to a collection that does not exist also
+    creates it, with the default number of shards.
+    """
+    try:
+        collection, created = await run_in_threadpool(collections.create, request.name, request.num_shards)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if not created:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Collection '{request.name}' already exists with {collection.num_shards} shard(s)."
+        )
+    return CollectionStats(**collection.stats())
+
+class EmbeddingCacheStats(BaseModel):
+    enabled: bool
+    path: Optional[str] = None
+    entries: int = 0
+    max_entries: Optional[int] = None
+    hits: int = 0
+    misses: int = 0
+    hit_rate: Optional[float] = None
+    evictions: int = 0
+
+@router.get("/embedding-cache", response_model=EmbeddingCacheStats, summary="View embedding cache counters")
+async def get_embedding_cache_stats():
+    """
+    Reports size and hit/miss counters of the persistent embedding cache.
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return EmbeddingCacheStats(enabled=False)
+    return EmbeddingCacheStats(enabled=True, **cache.stats())
+
+class AnswerCacheStats(BaseModel):
+    enabled: bool
+    entries: int = 0
+    max_entries: Optional[int] = None
+    ttl_seconds: Optional[float] = None
+    semantic_threshold: Optional[float] = None
+    generation: Optional[int] = None
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    hit_rate: Optional[float] = None
+    evictions: int = 0
+    invalidations: int = 0
+
+@router.get("/answer-cache", response_model=AnswerCacheStats, summary="View answer cache counters")
+async def get_answer_cache_stats():
+    """
+    Reports size and exact/semantic hit counters of the in-memory answer cache.
+    """
+    cache = get_answer_cache()
+    if cache is None:
+        return AnswerCacheStats(enabled=False)
+    return AnswerCacheStats(enabled=True, **cache.stats())
+
+class FilterCacheStats(BaseModel):
+    entries: int
+    max_entries: int
+    ttl_seconds: float
+    hits: int
+    misses: int
+    hit_rate: Optional[float]
+    invalidations: int
+
+@router.get("/filter-cache", response_model=FilterCacheStats, summary="View metadata filter cache counters")
+async def get_filter_cache_stats():
+    """
+    Reports how often a query's metadata filter reused a cached allow-list instead of
+    querying the database.
+    """
+    return FilterCacheStats(**filter_cache.stats())
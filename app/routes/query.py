@@ -1,48 +1,125 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.services.retriever import retrieve_chunks
-from app.services.llm import generate_response
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from langchain_core.documents import Document as LangchainDocument
+from app.services.retriever import collections, retrieve_chunks, retrieve_chunks_batch, query_batcher
+from app.services.sharding import DEFAULT_COLLECTION, CollectionNotFoundError
+from app.services.llm import generate_response, stream_response
+from app.services.answer_cache import get_answer_cache, normalize_query
+from app.services.metadata_filter import filter_key
+from app.services.context_builder import build_context
+from app.services.metrics import span
+from app.services.llm_gate import llm_gate, LLMQueueTimeout, SingleFlight, LLM_MAX_CONCURRENCY
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# POST /query/batch limits
+BATCH_QUERY_MAX_ITEMS = int(os.getenv("BATCH_QUERY_MAX_ITEMS", "1000"))
+BATCH_QUERY_CONCURRENCY = int(os.getenv("BATCH_QUERY_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+
+# Identical questions asked while one is being answered share its retrieval and LLM call
+ask_flight = SingleFlight()
+
+class QueryFilters(BaseModel):
+    document_ids: Optional[List[str]] = None
+    sources: Optional[List[str]] = None  # Original filenames
+    page_from: Optional[int] = None  # Inclusive, same numbering as page_number in results
+    page_to: Optional[int] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
 
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 20  # Number of top relevant chunks to retrieve
+    nprobe: Optional[int] = None  # IVF indexes: inverted lists to visit (higher = better recall, slower)
+    ef_search: Optional[int] = None  # HNSW indexes: search breadth (higher = better recall, slower)
+    filters: Optional[QueryFilters] = None  # Only chunks matching every given field are searched
+    collection: Optional[str] = None  # Collection to search (default: the default collection)
+
+    def filter_dict(self) -> Optional[dict]:
+        if self.filters is None:
+            return None
+        return self.filters.model_dump(exclude_none=True) or None
+
+    def cache_scope(self) -> str:
+        """Cached answers are only reused between requests that search the same chunks."""
+        scope = filter_key(self.filter_dict()) or ""
+        if self.collection and self.collection != DEFAULT_COLLECTION:
+            return f"{self.collection}:{scope}"
+        return scope
+
+def collection_exists(name: Optional[str]) -> bool:
+    try:
+        collections.get(name)
+        return True
+    except CollectionNotFoundError:
+        return False
+
+def require_collection(name: Optional[str]) -> None:
+    if not collection_exists(name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Collection '{name}' not found."
+        )
 
 class QueryResponse(BaseModel):
     query: str
     response: str
+    context: Optional[Dict] = None  # How the chunks were packed into the prompt (tokens, tokens_saved, ...)
 
 @router.post("/ask", response_model=QueryResponse, summary="Query the RAG system")
 async def ask_question(request: QueryRequest):
     """
     Accepts a user query and retrieves relevant document chunks from the vector database.
-    These chunks are then passed to the LLM to generate a contextual response.
+    These chunks are then passed to the LLM to generate a contextual response. `context`
+    reports how the chunks were packed into the prompt, as in the /stream context event.
     """
     if not request.query.strip():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Query cannot be empty."
         )
+    require_collection(request.collection)
 
-    try:
+    filters = request.filter_dict()
+    scope = request.cache_scope()
+
+    async def answer() -> Tuple[str, Dict]:
         # 1. Retrieve relevant chunks
-        retrieved_chunks = await retrieve_chunks(request.query, request.top_k)
+        retrieved_chunks = await retrieve_chunks(request.query, request.top_k, nprobe=request.nprobe, ef_search=request.ef_search, filters=filters, collection=request.collection)
+        with span("prompt_build"):
+            context = build_context(retrieved_chunks)
 
         if not retrieved_chunks:
-            return QueryResponse(
-                query=request.query,
-                response="I could not find any relevant information for your query in the uploaded documents."
-            )
+            return "I could not find any relevant information for your query in the uploaded documents.", context.stats()
 
         # 2. Generate response using LLM
-        llm_response = await generate_response(request.query, retrieved_chunks)
+        return await generate_response(request.query, retrieved_chunks, cache_scope=scope, context=context), context.stats()
+
+    try:
+        key = (normalize_query(request.query), request.top_k, request.nprobe, request.ef_search, scope)
+        llm_response, context_stats = await ask_flight.do(key, answer)
 
         return QueryResponse(
             query=request.query,
-            response=llm_response
+            response=llm_response,
+            context=context_stats
         )
 
+    except LLMQueueTimeout as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, int(llm_gate.max_queue_wait)))}
+        )
     except FileNotFoundError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -57,4 +134,243 @@ async def ask_question(request: QueryRequest):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred while processing your query: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _chunk_summary(chunk: LangchainDocument, content: bool = False) -> dict:
+    summary = {
+        "document_id": chunk.metadata.get("document_id"),
+        "source": chunk.metadata.get("source"),
+        "page_number": chunk.metadata.get("page_number"),
+        "chunk_index": chunk.metadata.get("chunk_index"),
+    }
+    if content:
+        summary["content"] = chunk.page_content
+    return summary
+
+@router.post("/stream", summary="Query the RAG system and stream the answer")
+async def stream_question(request: QueryRequest):
+    """
+    Same as /ask, but the answer is sent as Server-Sent Events while the LLM produces it:
+    - `context`: the chunks the answer is based on, the retrieval time, and how the
+      chunks were packed into the prompt (`tokens`, `tokens_saved`, ...);
+    - `token`: the next piece of the answer (`{"text": ...}`), repeated;
+    - `done`: time to first token and total time in milliseconds, and which answer
+      cache tier served the answer (`exact`, `semantic` or null);
+    - `error`: sent instead of `done` if generation fails part-way.
+    """
+    if not request.query.strip():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Query cannot be empty."
+        )
+    require_collection(request.collection)
+
+    started = time.perf_counter()
+    filters = request.filter_dict()
+    scope = request.cache_scope()
+    try:
+        retrieved_chunks = await retrieve_chunks(request.query, request.top_k, nprobe=request.nprobe, ef_search=request.ef_search, filters=filters, collection=request.collection)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while processing your query: {str(e)}"
+        )
+    retrieval_ms = (time.perf_counter() - started) * 1000
+    with span("prompt_build"):
+        context = build_context(retrieved_chunks)
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse_event("context", {
+            "query": request.query,
+            "retrieval_ms": round(retrieval_ms, 2),
+            "chunks": [_chunk_summary(chunk) for chunk in retrieved_chunks],
+            "context": context.stats(),
+        })
+        if not retrieved_chunks:
+            yield _sse_event("token", {"text": "I could not find any relevant information for your query in the uploaded documents."})
+            yield _sse_event("done", {"ttft_ms": None, "total_ms": round((time.perf_counter() - started) * 1000, 2), "tokens": 1, "cached": None})
+            return
+
+        answer_cache = get_answer_cache()
+        cached = await answer_cache.aget(request.query, retrieved_chunks, scope) if answer_cache is not None else None
+        if cached is not None:
+            # A cached answer is sent whole, as a single token
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+            yield _sse_event("token", {"text": cached[0]})
+            yield _sse_event("done", {"ttft_ms": elapsed_ms, "total_ms": elapsed_ms, "tokens": 1, "cached": cached[1]})
+            return
+
+        ttft_ms = None
+        tokens = 0
+        answer = []
+        try:
+            async for token in stream_response(request.query, retrieved_chunks, context=context):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                tokens += 1
+                answer.append(token)
+                yield _sse_event("token", {"text": token})
+            if answer_cache is not None:
+                await answer_cache.aput(request.query, retrieved_chunks, "".join(answer), scope)
+        except LLMQueueTimeout as e:
+            yield _sse_event("error", {"detail": str(e), "status": status.HTTP_503_SERVICE_UNAVAILABLE})
+            return
+        except Exception as e:
+            logger.error("Streaming generation failed: %s", e)
+            yield _sse_event("error", {"detail": f"LLM API error: {str(e)}", "status": status.HTTP_502_BAD_GATEWAY})
+            return
+        total_ms = (time.perf_counter() - started) * 1000
+        logger.debug("Streamed %s tokens; time to first token %.1fms, total %.1fms.", tokens, ttft_ms or 0, total_ms)
+        yield _sse_event("done", {
+            "ttft_ms": round(ttft_ms, 2) if ttft_ms is not None else None,
+            "total_ms": round(total_ms, 2),
+            "tokens": tokens,
+            "cached": None,
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+    retrieval_only: bool = False  # Return the retrieved chunks (with their text) and skip the LLM
+    concurrency: Optional[int] = None  # LLM generations in flight for this batch (capped by BATCH_QUERY_CONCURRENCY)
+
+@router.post("/batch", summary="Answer many queries in one request")
+async def batch_questions(request: BatchQueryRequest):
+    """
+    Answers a list of queries. All queries are embedded in one pass and searched in one
+    batched index call; LLM answers are then generated with bounded concurrency. Results
+    are streamed as newline-delimited JSON, one line per query in completion order:
+
+    `{"index": 0, "query": "...", "status": 200, "response": "...", "chunks": [...], "elapsed_ms": 812.3}`
+
+    `index` is the query's position in the request. A failed item has `status` 400
+    (empty query), 404 (unknown collection) or 503 (no LLM capacity) and an `error`
+    instead of `response`. With
+    `retrieval_only`, no LLM is called and each chunk includes its `content`.
+    """
+    if not request.queries:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="At least one query is required."
+        )
+    if len(request.queries) > BATCH_QUERY_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch can hold at most {BATCH_QUERY_MAX_ITEMS} queries."
+        )
+
+    started = time.perf_counter()
+    known = {name for name in {item.collection for item in request.queries} if collection_exists(name)}
+    valid = [i for i, item in enumerate(request.queries) if item.query.strip() and item.collection in known]
+    try:
+        retrieved = await retrieve_chunks_batch([
+            (item.query, item.top_k, item.nprobe, item.ef_search, item.filter_dict(), item.collection)
+            for item in (request.queries[i] for i in valid)
+        ])
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while processing your queries: {str(e)}"
+        )
+    chunks_by_index = dict(zip(valid, retrieved))
+    logger.debug("Batch of %s queries retrieved in %.1fms.", len(request.queries), (time.perf_counter() - started) * 1000)
+
+    concurrency = max(1, min(request.concurrency or BATCH_QUERY_CONCURRENCY, BATCH_QUERY_CONCURRENCY))
+    generation_slots = asyncio.Semaphore(concurrency)
+
+    async def answer(index: int, item: QueryRequest) -> dict:
+        line = {"index": index, "query": item.query}
+        if not item.query.strip():
+            line.update(status=status.HTTP_400_BAD_REQUEST, error="Query cannot be empty.")
+            return line
+        if index not in chunks_by_index:
+            line.update(status=status.HTTP_404_NOT_FOUND, error=f"Collection '{item.collection}' not found.")
+            return line
+        chunks = chunks_by_index[index]
+        line["chunks"] = [_chunk_summary(chunk, content=request.retrieval_only) for chunk in chunks]
+        if request.retrieval_only:
+            line["status"] = status.HTTP_200_OK
+        elif not chunks:
+            line.update(status=status.HTTP_200_OK, response="I could not find any relevant information for your query in the uploaded documents.")
+        else:
+            async with generation_slots:
+                try:
+                    line.update(status=status.HTTP_200_OK, response=await generate_response(item.query, chunks, cache_scope=item.cache_scope()))
+                except LLMQueueTimeout as e:
+                    line.update(status=status.HTTP_503_SERVICE_UNAVAILABLE, error=str(e))
+        line["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return line
+
+    async def lines() -> AsyncIterator[str]:
+        tasks = [asyncio.ensure_future(answer(i, item)) for i, item in enumerate(request.queries)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # The client went away or the batch finished: stop anything still queued
+            for task in tasks:
+                task.cancel()
+        logger.debug("Batch of %s queries finished in %.1fms.", len(request.queries), (time.perf_counter() - started) * 1000)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+class LLMGateStats(BaseModel):
+    max_concurrency: int
+    max_queue_wait_seconds: float
+    in_flight: int
+    waiting: int
+    max_waiting: int
+    calls: int
+    rejected: int
+    retries: int
+    failures: int
+    avg_queue_wait_ms: Optional[float]
+    max_queue_wait_ms: float
+
+class SingleFlightStats(BaseModel):
+    in_flight: int
+    leaders: int
+    coalesced: int
+
+class LLMStats(BaseModel):
+    gate: LLMGateStats
+    single_flight: SingleFlightStats
+
+@router.get("/llm-stats", response_model=LLMStats, summary="View LLM concurrency and queueing counters")
+async def get_llm_stats():
+    """
+    Reports LLM slots in use, requests waiting for one, queue wait times, rejections,
+    retries, and how many /ask requests were coalesced onto an identical in-flight one.
+    """
+    return LLMStats(gate=LLMGateStats(**llm_gate.stats()), single_flight=SingleFlightStats(**ask_flight.stats()))
+
+class HistogramStats(BaseModel):
+    buckets: Dict[str, int]
+    count: int
+    sum: float
+    mean: Optional[float]
+
+class QueryBatchStats(BaseModel):
+    max_wait_ms: float
+    max_size: int
+    batches: int
+    queries: int
+    batch_size: HistogramStats
+    wait_ms: HistogramStats
+
+@router.get("/batch-stats", response_model=QueryBatchStats, summary="View query micro-batching histograms")
+async def get_batch_stats():
+    """
+    Reports how many queries were embedded and searched per batch, and how long each
+    query waited for its batch to close, as histograms.
+    """
+    return QueryBatchStats(**query_batcher.stats())
@@ -1,49 +1,129 @@
 #/app/routes/upload.py
-from fastapi import APIRouter, UploadFile, File, HTTPException, status
-from typing import List
-from app.services.ingest import process_document
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+import os
+from app.services.document_loaders import UnsupportedFormatError, UploadTooLargeError, sniff_format
+from app.services.jobs import ingest_queue
+from app.services.retriever import collections
+from app.services.sharding import DEFAULT_COLLECTION
 from sqlalchemy.exc import IntegrityError
 
-router = APIRouter()
+# 1000 pages is a very large document; 100MB is a reasonable proxy for a single PDF. [cite: 8]
+MAX_FILE_SIZE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(100 * 1024 * 1024)))
+# A JSONL back-fill carries the text of many documents
+MAX_JSONL_SIZE_BYTES = int(os.getenv("UPLOAD_MAX_JSONL_BYTES", str(1024 * 1024 * 1024)))
+MAX_FILES_PER_UPLOAD = 20
+# Multipart framing (boundary, part headers) allowed on top of each file's contents
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+def max_request_bytes(limit: int):
+    """Marks an upload endpoint with the largest request body it accepts."""
+    def mark(endpoint):
+        endpoint.max_request_bytes = limit
+        return endpoint
+    return mark
+
+class UploadRoute(APIRoute):
+    """
+    Rejects a request whose Content-Length is over its endpoint's `max_request_bytes`
+    with 413 before the body is read. FastAPI parses the whole multipart body (into
+    memory and temporary files) before the endpoint runs, so checks made there come
+    after the upload has been buffered.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Awaitable[Response]]:
+        handler = super().get_route_handler()
+        limit = getattr(self.endpoint, "max_request_bytes", None)
+        if limit is None:
+            return handler
+
+        async def limited_handler(request: Request) -> Response:
+            content_length = request.headers.get("content-length", "")
+            if content_length.isdigit() and int(content_length) > limit:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Request body exceeds the maximum size of {limit / (1024*1024):.1f} MB."
+                )
+            return await handler(request)
+
+        return limited_handler
+
+router = APIRouter(route_class=UploadRoute)
+
+class JobProgress(BaseModel):
+    pages_parsed: int
+    chunks_total: Optional[int]
+    chunks_embedded: int
+    chunks_persisted: int
+
+class JobStatus(BaseModel):
+    job_id: str
+    document_id: str
+    filename: str
+    collection: Optional[str] = None
+    status: str
+    stage: Optional[str]
+    progress: JobProgress
+    detail: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
 
 @router.post("/documents", response_model=dict, summary="Upload documents for RAG processing")
-async def upload_documents(files: List[UploadFile] = File(...)):
+@max_request_bytes(MAX_FILES_PER_UPLOAD * (MAX_FILE_SIZE_BYTES + MULTIPART_OVERHEAD_BYTES))
+async def upload_documents(files: List[UploadFile] = File(...), collection: str = DEFAULT_COLLECTION):
     """
-    Uploads multiple documents (PDF, TXT) for ingestion into the RAG pipeline.
-    Documents will be chunked, embedded, and stored in the vector database,
-    with metadata saved in the relational database.
+    Uploads multiple documents (PDF or plain text, told apart by their content)
+    for ingestion into the RAG pipeline.
+    Each file is queued as a background job and the response returns immediately
+    with its job ID; poll `/upload/jobs/{job_id}` to follow the ingestion.
+    The documents go to `collection`, which is created if it does not exist yet.
     [cite_start]Supports up to 20 documents. [cite: 8]
     """
-    if not (1 <= len(files) <= 20):  # [cite: 8]
+    if not (1 <= len(files) <= MAX_FILES_PER_UPLOAD):  # [cite: 8]
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You can upload between 1 and 20 documents at a time."
+            detail=f"You can upload between 1 and {MAX_FILES_PER_UPLOAD} documents at a time."
         )
+    try:
+        await run_in_threadpool(collections.create, collection)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     results = []
     for file in files:
         try:
-            # Basic validation: check file type and size
-            if not file.filename.endswith((".pdf", ".txt")):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Unsupported file type: {file.filename}. Only PDF and TXT are allowed."
-                )
-
-            # Max file size 1000 pages, roughly equivalent to 10MB per page for simple text, but could vary.
-            # A more robust check might involve actual page counting after loading.
-            # For simplicity, a general file size limit is used here.
-            # [cite_start]1000 pages is a very large document, 100MB is a reasonable proxy for a single PDF. [cite: 8]
-            MAX_FILE_SIZE_BYTES = 100 * 1024 * 1024 # 100 MB per file, adjusted from 1000 pages for a practical limit
-            file_content = await file.read()
-            if len(file_content) > MAX_FILE_SIZE_BYTES:
+            # By now the request body has been buffered; only its total Content-Length was
+            # checked before that (see UploadRoute). The spool copy stops at the first
+            # chunk over the per-file limit, and a size already known saves the copy.
+            try:
+                if file.size is not None and file.size > MAX_FILE_SIZE_BYTES:
+                    raise UploadTooLargeError()
+                spool_path, content_hash = await run_in_threadpool(ingest_queue.spool, file.file, MAX_FILE_SIZE_BYTES)
+            except UploadTooLargeError:
                 raise HTTPException(
                     status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                     detail=f"File '{file.filename}' exceeds the maximum size of {MAX_FILE_SIZE_BYTES / (1024*1024):.1f} MB."
                 )
 
-            process_result = await process_document(file_content, file.filename)
-            results.append(process_result)
+            # The loader is chosen by content, not by extension
+            try:
+                source_format = await run_in_threadpool(sniff_format, spool_path)
+            except UnsupportedFormatError as e:
+                os.remove(spool_path)
+                raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"'{file.filename}': {e}")
+
+            job = await run_in_threadpool(ingest_queue.submit_spooled, spool_path, content_hash, file.filename, collection, source_format)
+            results.append({
+                "job_id": job.id,
+                "document_id": job.document_id,
+                "filename": file.filename,
+                "status": job.status,
+            })
         except HTTPException as e:
             results.append({"filename": file.filename, "status": "failed", "detail": e.detail})
         except IntegrityError:
@@ -51,4 +131,52 @@ async def upload_documents(files: List[UploadFile] = File(...)):
         except Exception as e:
             results.append({"filename": file.filename, "status": "failed", "detail": f"An unexpected error occurred: {str(e)}"})
 
-    return {"message": "Document upload process initiated for all files.", "results": results}
\ No newline at end of file
+    return {"message": "Document upload process initiated for all files.", "results": results}
+
+def _submit_records(spooled: Dict[str, Tuple[str, str]], collection: str) -> List[Dict]:
+    results = []
+    for doc, (spool_path, content_hash) in spooled.items():
+        try:
+            job = ingest_queue.submit_spooled(spool_path, content_hash, doc, collection, "pages")
+            results.append({"job_id": job.id, "document_id": job.document_id, "filename": doc, "status": job.status})
+        except Exception as e:
+            results.append({"filename": doc, "status": "failed", "detail": f"An unexpected error occurred: {str(e)}"})
+    return results
+
+@router.post("/jsonl", response_model=dict, summary="Bulk-ingest pre-extracted pages from a JSONL file")
+@max_request_bytes(MAX_JSONL_SIZE_BYTES + MULTIPART_OVERHEAD_BYTES)
+async def upload_jsonl(file: UploadFile = File(...), collection: str = DEFAULT_COLLECTION):
+    """
+    Ingests text that is already extracted, skipping PDF parsing: one JSON object per
+    line, `{"doc": "report.pdf", "page": 0, "text": "..."}`. Every distinct `doc` becomes
+    a document of that name and is queued as its own job, just like an uploaded file, so
+    duplicates and new versions are handled the same way. Meant for large back-fills.
+    """
+    try:
+        await run_in_threadpool(collections.create, collection)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    try:
+        spooled = await run_in_threadpool(ingest_queue.spool_records, file.file, MAX_JSONL_SIZE_BYTES)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"'{file.filename}': {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"'{file.filename}': {e}")
+    if not spooled:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"'{file.filename}' contains no records.")
+
+    results = await run_in_threadpool(_submit_records, spooled, collection)
+    return {"message": f"Document upload process initiated for {len(results)} documents.", "results": results}
+
+@router.get("/jobs/{job_id}", response_model=JobStatus, summary="Poll the status of an ingestion job")
+async def get_job_status(job_id: str):
+    """
+    Reports the state of a queued upload and how far each ingestion stage has progressed.
+    """
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Ingestion job '{job_id}' not found."
+        )
+    return JobStatus(**job.to_dict())
@@ -0,0 +1,137 @@
+# app/services/ann.py
+
+import math
+import os
+from typing import Optional
+
+import faiss
+import numpy as np
+
+# Configuration
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat").lower()
+# 0 means "pick from the number of vectors" (about 4 * sqrt(n))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+PQ_M = int(os.getenv("PQ_M", "0"))  # 0 means dimension / 8
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+ANN_TRAIN_SAMPLE = int(os.getenv("ANN_TRAIN_SAMPLE", "100000"))
+# Below this many vectors the trained types (IVF-Flat, IVF-PQ) are built as flat: there is
+# too little data to train their centroids, and an exhaustive scan is as fast anyway
+ANN_MIN_TRAIN_VECTORS = int(os.getenv("ANN_MIN_TRAIN_VECTORS", "1000"))
+# Index types whose stored codes are a lossy encoding of the vectors
+LOSSY_INDEX_TYPES = ("ivf_pq",)
+
+
+def _nlist_for(num_vectors: int) -> int:
+    if IVF_NLIST:
+        return IVF_NLIST
+    # IVF training wants ~39+ points per centroid; keep small corpora on few lists
+    return max(1, min(int(4 * math.sqrt(max(num_vectors, 1))), num_vectors // 39 or 1))
+
+
+def _pq_m_for(dimension: int) -> int:
+    m = PQ_M or max(1, dimension // 8)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def _pq_nbits_for(num_vectors: int) -> int:
+    # Each PQ codebook has 2**nbits centroids and wants ~39 training points per centroid;
+    # the 4-bit floor (16 centroids) is safe since smaller corpora are built as flat
+    return max(4, min(8, int(math.log2(max(num_vectors, 1) / 39)) if num_vectors >= 78 else 4))
+
+
+def effective_index_type(index_type: str, num_vectors: int) -> str:
+    """The type actually built for `num_vectors` vectors when `index_type` is configured."""
+    if index_type in ("ivf_flat", "ivf_pq") and num_vectors < ANN_MIN_TRAIN_VECTORS:
+        return "flat"
+    return index_type
+
+
+def factory_string(index_type: str, dimension: int, num_vectors: int) -> str:
+    """Maps a configured index type to a faiss.index_factory description."""
+    index_type = effective_index_type(index_type, num_vectors)
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{_nlist_for(num_vectors)},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{_nlist_for(num_vectors)},PQ{_pq_m_for(dimension)}x{_pq_nbits_for(num_vectors)}"
+    if index_type == "hnsw":
+        return f"HNSW{HNSW_M},Flat"
+    raise ValueError(f"Unsupported index type: {index_type}. Choose one of {', '.join(INDEX_TYPES)}.")
+
+
+def index_type_of(index: faiss.Index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def build_index(index_type: str, vectors: np.ndarray, train_sample: int = ANN_TRAIN_SAMPLE, seed: int = 0) -> faiss.Index:
+    """
+    Builds an L2 index of the given type over `vectors`, training it first on a random
+    sample of at most `train_sample` of them when the type needs training. Trained types
+    are built as flat below ANN_MIN_TRAIN_VECTORS vectors.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dimension = vectors.shape
+    index = faiss.index_factory(dimension, factory_string(index_type, dimension, num_vectors), faiss.METRIC_L2)
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        hnsw.efSearch = HNSW_EF_SEARCH
+    if not index.is_trained:
+        if num_vectors > train_sample:
+            sample = vectors[np.random.default_rng(seed).choice(num_vectors, train_sample, replace=False)]
+        else:
+            sample = vectors
+        index.train(sample)
+    if isinstance(faiss.downcast_index(index), faiss.IndexIVF):
+        faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    if num_vectors:
+        index.add(vectors)
+    return index
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """
+    Returns every stored vector in position order. Exact for flat, IVF-Flat and HNSW;
+    approximate (decoded codes) for IVF-PQ.
+    """
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def search_parameters(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    selector: Optional[faiss.IDSelector] = None,
+):
+    """
+    Builds per-query search parameters for the index type, or None if nothing needs
+    overriding. Knobs that do not apply to the index (e.g. nprobe on HNSW) are ignored.
+    `selector` restricts the search to the positions it accepts.
+    """
+    index_type = index_type_of(index)
+    if index_type in ("ivf_flat", "ivf_pq") and (nprobe or selector is not None):
+        return faiss.SearchParametersIVF(nprobe=nprobe or faiss.extract_index_ivf(index).nprobe, sel=selector)
+    if index_type == "hnsw" and (ef_search or selector is not None):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or faiss.downcast_index(index).hnsw.efSearch, sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
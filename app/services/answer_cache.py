@@ -0,0 +1,226 @@
+# app/services/answer_cache.py
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document as LangchainDocument
+
+from app.services import retriever
+from app.services.embedding_cache import text_hash
+from app.services.model_registry import get_embeddings
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+# Cosine similarity a past query needs to reuse its answer; 0 turns the semantic tier off
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+# Nearest past queries checked for one in the same scope (e.g. the same metadata filter)
+SEMANTIC_CANDIDATES = 8
+
+
+def normalize_query(query: str) -> str:
+    """Case, surrounding whitespace, repeated spaces and trailing punctuation do not change a question."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+
+
+def chunk_ids(chunks: List[LangchainDocument]) -> List[str]:
+    return [chunk.id or text_hash(chunk.page_content) for chunk in chunks]
+
+
+class _Entry:
+    def __init__(self, label: int, answer: str, vector: Optional[np.ndarray], scope: str):
+        self.label = label
+        self.answer = answer
+        self.vector = vector
+        self.scope = scope
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    """
+    Two-tier cache of generated answers, sitting in front of the LLM call.
+
+    - Exact tier: the normalized query plus the IDs of the retrieved chunks, so a hit
+      means the same question over the same context.
+    - Semantic tier: a small inner-product index of past query embeddings; a new query
+      whose cosine similarity to a cached one reaches `semantic_threshold` reuses its answer.
+
+    Answers are only shared within a `scope` (the query's metadata filter), since the
+    same question asked about different documents needs a different answer.
+
+    Entries expire after `ttl_seconds`, the least recently used are evicted beyond
+    `max_entries`, and everything is dropped as soon as the vector index publishes a
+    new generation (an ingestion or deletion), since answers may then be stale.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        generation: Callable[[], Optional[int]],
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        semantic_threshold: float = ANSWER_CACHE_SEMANTIC_THRESHOLD,
+    ):
+        self.embeddings = embeddings
+        self._generation_fn = generation
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._keys_by_label: Dict[int, str] = {}
+        self._semantic_index: Optional[faiss.IndexIDMap2] = None
+        self._next_label = 0
+        self._generation: Optional[int] = None
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold > 0 and self.embeddings is not None
+
+    @staticmethod
+    def _key(query: str, chunks: List[LangchainDocument], scope: str) -> str:
+        return hashlib.sha256("\x1f".join([scope, normalize_query(query), *chunk_ids(chunks)]).encode("utf-8")).hexdigest()
+
+    def _query_vector(self, query: str) -> Optional[np.ndarray]:
+        if not self.semantic_enabled:
+            return None
+        vector = np.asarray(self.embeddings.embed_query(normalize_query(query)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _check_generation(self) -> None:
+        # Caller holds the lock
+        try:
+            generation = self._generation_fn()
+        except FileNotFoundError:
+            generation = None
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+                logger.debug("Index generation %s -> %s; dropped %s cached answers.", self._generation, generation, len(self._entries))
+            self._entries.clear()
+            self._keys_by_label.clear()
+            self._semantic_index = None
+            self._generation = generation
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._keys_by_label.pop(entry.label, None)
+        if entry.vector is not None and self._semantic_index is not None:
+            self._semantic_index.remove_ids(np.array([entry.label], dtype=np.int64))
+
+    def _expired(self, entry: _Entry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def get(self, query: str, chunks: List[LangchainDocument], scope: str = "") -> Optional[Tuple[str, str]]:
+        """Returns (answer, tier) for a cache hit, tier being 'exact' or 'semantic', or None."""
+        key = self._key(query, chunks, scope)
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.answer, "exact"
+            if not self.semantic_enabled or self._semantic_index is None or self._semantic_index.ntotal == 0:
+                self.misses += 1
+                return None
+
+        vector = self._query_vector(query)  # embedding runs outside the lock
+        with self._lock:
+            if vector is None or self._semantic_index is None or self._semantic_index.ntotal == 0:
+                self.misses += 1
+                return None
+            similarities, labels = self._semantic_index.search(vector[None, :], min(SEMANTIC_CANDIDATES, self._semantic_index.ntotal))
+            for similarity, label in zip(similarities[0], labels[0]):
+                similar_key = self._keys_by_label.get(int(label))
+                if similar_key is None or similarity < self.semantic_threshold:
+                    break
+                entry = self._entries[similar_key]
+                if entry.scope != scope:
+                    continue
+                if not self._expired(entry):
+                    self._entries.move_to_end(similar_key)
+                    self.semantic_hits += 1
+                    return entry.answer, "semantic"
+                self._drop(similar_key)
+                break
+            self.misses += 1
+            return None
+
+    def put(self, query: str, chunks: List[LangchainDocument], answer: str, scope: str = "") -> None:
+        key = self._key(query, chunks, scope)
+        vector = self._query_vector(query)
+        with self._lock:
+            self._check_generation()
+            if key in self._entries:
+                self._drop(key)
+            label = self._next_label
+            self._next_label += 1
+            self._entries[key] = _Entry(label, answer, vector, scope)
+            self._keys_by_label[label] = key
+            if vector is not None:
+                if self._semantic_index is None:
+                    self._semantic_index = faiss.IndexIDMap2(faiss.IndexFlatIP(len(vector)))
+                self._semantic_index.add_with_ids(vector[None, :], np.array([label], dtype=np.int64))
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    async def aget(self, query: str, chunks: List[LangchainDocument], scope: str = "") -> Optional[Tuple[str, str]]:
+        return await asyncio.to_thread(self.get, query, chunks, scope)
+
+    async def aput(self, query: str, chunks: List[LangchainDocument], answer: str, scope: str = "") -> None:
+        await asyncio.to_thread(self.put, query, chunks, answer, scope)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "semantic_threshold": self.semantic_threshold if self.semantic_enabled else None,
+                "generation": self._generation,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.exact_hits + self.semantic_hits) / lookups) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Returns the process-wide answer cache, or None if it is disabled."""
+    global _answer_cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(get_embeddings(), retriever.collections.generation)
+        return _answer_cache
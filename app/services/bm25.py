@@ -0,0 +1,192 @@
+# app/services/bm25.py
+
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+from uuid import uuid4
+
+import numpy as np
+from langchain_core.documents import Document as LangchainDocument
+
+# Configuration
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+LEXICON_FILENAME = "lexicon.json"
+POSTINGS_FILENAME = "postings.bin"
+DOC_LENGTHS_FILENAME = "lengths.bin"
+LEXICAL_FILES = (LEXICON_FILENAME, POSTINGS_FILENAME, DOC_LENGTHS_FILENAME)
+
+# One posting: the chunk's position in its segment and how often the term occurs in it
+POSTING_DTYPE = np.dtype([("position", "<u4"), ("tf", "<u2")])
+
+# Words, numbers and identifiers such as "AB-1234" or "v2.1"; identifiers are also split into their parts
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-_./][^\W_]+)*")
+IDENTIFIER_SEPARATORS = re.compile(r"[-_./]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if IDENTIFIER_SEPARATORS.search(token):
+            tokens.extend(part for part in IDENTIFIER_SEPARATORS.split(token) if part not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndexWriter:
+    """Collects postings for chunks in position order, then writes them next to a segment."""
+
+    def __init__(self):
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._lengths: List[int] = []
+
+    def add(self, doc: LangchainDocument) -> LangchainDocument:
+        """Indexes the next chunk; returns it so the writer can sit inside a chunk stream."""
+        position = len(self._lengths)
+        tokens = tokenize(doc.page_content)
+        for term, tf in Counter(tokens).items():
+            self._postings[term].append((position, min(tf, np.iinfo(np.uint16).max)))
+        self._lengths.append(len(tokens))
+        return doc
+
+    def write(self, path: str) -> None:
+        terms: Dict[str, List[int]] = {}
+        postings = np.zeros(sum(len(entries) for entries in self._postings.values()), dtype=POSTING_DTYPE)
+        start = 0
+        for term in sorted(self._postings):
+            entries = self._postings[term]
+            postings[start:start + len(entries)] = entries
+            terms[term] = [start, len(entries)]
+            start += len(entries)
+        postings.tofile(os.path.join(path, POSTINGS_FILENAME))
+        np.asarray(self._lengths, dtype=np.dtype("<u4")).tofile(os.path.join(path, DOC_LENGTHS_FILENAME))
+        # The lexicon goes last: its presence marks the lexical index as complete
+        with open(os.path.join(path, LEXICON_FILENAME), "w") as f:
+            json.dump({"total_length": int(sum(self._lengths)), "terms": terms}, f, separators=(",", ":"))
+
+    @classmethod
+    def build(cls, path: str, docs: Iterable[LangchainDocument]) -> None:
+        """Indexes an existing segment's chunks in place (segments written before BM25 existed)."""
+        writer = cls()
+        for doc in docs:
+            writer.add(doc)
+        tmp_path = os.path.join(path, f".bm25-{uuid4().hex[:8]}")
+        os.makedirs(tmp_path)
+        writer.write(tmp_path)
+        for filename in LEXICAL_FILES:
+            os.replace(os.path.join(tmp_path, filename), os.path.join(path, filename))
+        os.rmdir(tmp_path)
+
+
+class LexicalIndex:
+    """
+    Read-only BM25 inverted index of one segment. The lexicon (term -> slice of the
+    postings) is loaded into memory; postings and chunk lengths are memory-mapped.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, LEXICON_FILENAME), "r") as f:
+            lexicon = json.load(f)
+        self._terms: Dict[str, List[int]] = lexicon["terms"]
+        self.total_length: int = lexicon["total_length"]
+        self._postings = self._memmap(os.path.join(path, POSTINGS_FILENAME), POSTING_DTYPE)
+        self._lengths = self._memmap(os.path.join(path, DOC_LENGTHS_FILENAME), np.dtype("<u4"))
+
+    @staticmethod
+    def _memmap(path: str, dtype) -> np.ndarray:
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, LEXICON_FILENAME))
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._lengths)
+
+    def document_frequency(self, term: str) -> int:
+        entry = self._terms.get(term)
+        return entry[1] if entry else 0
+
+    def score(self, idf: Dict[str, float], avg_length: float, k1: float = BM25_K1, b: float = BM25_B) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 scores of every chunk containing at least one query term. `idf` and
+        `avg_length` come from the whole index, so scores are comparable across segments.
+        Returns (positions, scores), unordered.
+        """
+        slices = [(self._terms[term], weight) for term, weight in idf.items() if term in self._terms]
+        if not slices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        positions = []
+        contributions = []
+        for (start, count), weight in slices:
+            postings = self._postings[start:start + count]
+            tf = postings["tf"].astype(np.float32)
+            lengths = self._lengths[postings["position"]].astype(np.float32)
+            norm = k1 * (1 - b + b * lengths / max(avg_length, 1e-9))
+            positions.append(postings["position"].astype(np.int64))
+            contributions.append(weight * tf * (k1 + 1) / (tf + norm))
+        unique_positions, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+        return unique_positions, np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+
+
+class TermStatistics:
+    """
+    Corpus statistics BM25 needs for one query: document frequency of each query term,
+    number of chunks and their total length. Statistics of disjoint parts of a corpus
+    (segments, shards) add up, which keeps scores comparable across the parts.
+    """
+
+    def __init__(self, document_frequencies: Dict[str, int], num_docs: int, total_length: int):
+        self.document_frequencies = document_frequencies
+        self.num_docs = num_docs
+        self.total_length = total_length
+
+    @classmethod
+    def collect(cls, terms: Iterable[str], indexes: Sequence[LexicalIndex]) -> "TermStatistics":
+        return cls(
+            {term: sum(index.document_frequency(term) for index in indexes) for term in set(terms)},
+            sum(index.num_docs for index in indexes),
+            sum(index.total_length for index in indexes),
+        )
+
+    @classmethod
+    def combine(cls, parts: Iterable["TermStatistics"]) -> "TermStatistics":
+        combined = cls({}, 0, 0)
+        for part in parts:
+            for term, df in part.document_frequencies.items():
+                combined.document_frequencies[term] = combined.document_frequencies.get(term, 0) + df
+            combined.num_docs += part.num_docs
+            combined.total_length += part.total_length
+        return combined
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_length / max(self.num_docs, 1)
+
+    def idf(self) -> Dict[str, float]:
+        return {
+            term: math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            for term, df in self.document_frequencies.items()
+            if df
+        }
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """Merges ranked ID lists; an ID scores 1 / (k + rank) in every list it appears in."""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += 1.0 / (k + rank)
+    return sorted(scores, key=lambda item: scores[item], reverse=True)
@@ -0,0 +1,145 @@
+# app/services/context_builder.py
+
+import logging
+import math
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document as LangchainDocument
+
+from app.services.embedding_cache import text_hash
+from app.services.pdf_chunking import CHUNK_OVERLAP
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# Prompt tokens the retrieved context may use; 0 means no limit
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+# Token estimate without a provider tokenizer (Gemini counts tokens over the network)
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+# Shorter shared spans between neighbouring chunks are treated as coincidence, not overlap
+MIN_OVERLAP_CHARS = 20
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN) if text else 0
+
+
+def overlap_length(previous: str, following: str, max_overlap: int = CHUNK_OVERLAP) -> int:
+    """Length of the longest suffix of `previous` that `following` starts with."""
+    for length in range(min(len(previous), len(following), max_overlap), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+def _position(chunk: LangchainDocument) -> Tuple[Optional[str], Optional[int], Optional[int]]:
+    metadata = chunk.metadata
+    return metadata.get("document_id", metadata.get("source")), metadata.get("page_number"), metadata.get("chunk_index")
+
+
+class PackedContext:
+    """The passages sent to the LLM and what packing saved compared to the raw chunks."""
+
+    def __init__(self, passages: List[LangchainDocument], retrieved_chunks: int, chunks_used: int, retrieved_tokens: int):
+        self.passages = passages
+        self.retrieved_chunks = retrieved_chunks
+        self.chunks_used = chunks_used
+        self.retrieved_tokens = retrieved_tokens
+        self.tokens = sum(estimate_tokens(passage.page_content) for passage in passages)
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.retrieved_tokens - self.tokens
+
+    def stats(self) -> Dict:
+        return {
+            "retrieved_chunks": self.retrieved_chunks,
+            "chunks_used": self.chunks_used,
+            "passages": len(self.passages),
+            "tokens": self.tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+def build_context(chunks: List[LangchainDocument], token_budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """
+    Turns retrieved chunks (best first) into prompt passages:
+
+    1. chunks with identical text are kept once;
+    2. chunks are taken in rank order while they fit `token_budget`, each costing only
+       the text it adds beyond the overlap with an already taken neighbour;
+    3. taken chunks that are neighbours on the same page (consecutive `chunk_index`)
+       are joined into one passage with the overlapping span removed.
+
+    Passages are returned in the order of their best-ranked chunk.
+    """
+    retrieved_tokens = sum(estimate_tokens(chunk.page_content) for chunk in chunks)
+    unique: List[LangchainDocument] = []
+    seen = set()
+    for chunk in chunks:
+        digest = text_hash(chunk.page_content)
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(chunk)
+
+    by_position = {_position(chunk): (rank, chunk) for rank, chunk in enumerate(unique) if _position(chunk)[2] is not None}
+    taken: Dict[int, LangchainDocument] = {}
+    used_tokens = 0
+    for rank, chunk in enumerate(unique):
+        text = chunk.page_content
+        document_id, page_number, chunk_index = _position(chunk)
+        if chunk_index is not None:
+            # Overlap with neighbours already taken is not paid for twice
+            before = by_position.get((document_id, page_number, chunk_index - 1))
+            after = by_position.get((document_id, page_number, chunk_index + 1))
+            if before is not None and before[0] in taken:
+                text = text[overlap_length(before[1].page_content, text):]
+            if after is not None and after[0] in taken:
+                text = text[:len(text) - overlap_length(text, after[1].page_content)]
+        cost = estimate_tokens(text)
+        if token_budget and used_tokens + cost > token_budget:
+            if taken:
+                continue
+            # The best chunk is always sent, cut down to the budget if it alone exceeds it
+            chunk = LangchainDocument(page_content=chunk.page_content[:int(token_budget * CONTEXT_CHARS_PER_TOKEN)], metadata=chunk.metadata, id=chunk.id)
+            cost = token_budget
+        taken[rank] = chunk
+        used_tokens += cost
+
+    # Group taken chunks into runs of neighbours on the same page
+    pages: Dict[Tuple, List[Tuple[int, int, LangchainDocument]]] = defaultdict(list)
+    singles: List[Tuple[int, LangchainDocument]] = []
+    for rank, chunk in taken.items():
+        document_id, page_number, chunk_index = _position(chunk)
+        if chunk_index is None:
+            singles.append((rank, chunk))
+        else:
+            pages[(document_id, page_number)].append((chunk_index, rank, chunk))
+    passages: List[Tuple[int, LangchainDocument]] = list(singles)
+    for run_chunks in pages.values():
+        run_chunks.sort(key=lambda item: item[0])
+        run: List[Tuple[int, int, LangchainDocument]] = []
+        for item in run_chunks:
+            if run and item[0] != run[-1][0] + 1:
+                passages.append(_join(run))
+                run = []
+            run.append(item)
+        passages.append(_join(run))
+    passages.sort(key=lambda passage: passage[0])
+
+    packed = PackedContext([passage for _, passage in passages], len(chunks), len(taken), retrieved_tokens)
+    logger.debug("%s chunks -> %s passages, %s tokens (%s saved, budget %s).", packed.retrieved_chunks, len(packed.passages),
+                 packed.tokens, packed.tokens_saved, token_budget or "unlimited")
+    return packed
+
+
+def _join(run: List[Tuple[int, int, LangchainDocument]]) -> Tuple[int, LangchainDocument]:
+    """Joins neighbouring chunks of one page, dropping the text each repeats from the previous one."""
+    text = run[0][2].page_content
+    for (_, _, previous), (_, _, chunk) in zip(run, run[1:]):
+        text += chunk.page_content[overlap_length(previous.page_content, chunk.page_content):]
+    first = run[0][2]
+    metadata = dict(first.metadata, chunk_count=len(run))
+    return min(rank for _, rank, _ in run), LangchainDocument(page_content=text, metadata=metadata, id=first.id if len(run) == 1 else None)
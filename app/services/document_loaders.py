@@ -0,0 +1,153 @@
+# app/services/document_loaders.py
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+# Like pdf_chunking, this module stays light: it only reads files.
+
+# Configuration
+# Plain text is cut into sections ("pages") of about this many characters, at a blank line
+TEXT_SECTION_CHARS = int(os.getenv("TEXT_SECTION_CHARS", "4000"))
+
+# Formats a document can be ingested from:
+# - 'pdf': parsed with pypdf;
+# - 'text': UTF-8 text; form feeds separate pages, otherwise it is cut into sections;
+# - 'pages': pre-extracted pages, one {"page": int, "text": str} JSON object per line.
+SOURCE_FORMATS = ("pdf", "text", "pages")
+SNIFF_BYTES = 8192
+# PDF readers accept the header anywhere in the first kilobyte
+PDF_MAGIC = b"%PDF-"
+PDF_MAGIC_WINDOW = 1024
+
+
+class UnsupportedFormatError(ValueError):
+    """The content of a file matches none of the formats that can be ingested."""
+
+
+class UploadTooLargeError(ValueError):
+    """An upload went over the size limit while it was being spooled."""
+
+
+def sniff_format(file_path: str) -> str:
+    """
+    Tells PDFs from plain text by their first bytes rather than by the filename. Text
+    must decode as UTF-8 and contain no NUL bytes; anything else is unsupported.
+    """
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    if PDF_MAGIC in head[:PDF_MAGIC_WINDOW]:
+        return "pdf"
+    if b"\x00" in head:
+        raise UnsupportedFormatError("File is neither a PDF nor text.")
+    try:
+        # The last character may be cut off by the sniff window
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:
+            raise UnsupportedFormatError("File is neither a PDF nor UTF-8 text.") from e
+    return "text"
+
+
+def iter_text_pages(file_path: str, section_chars: int = TEXT_SECTION_CHARS) -> Iterator[Tuple[int, str]]:
+    """
+    Decodes a text file as a stream and yields `(page_number, text)`. A form feed starts
+    a new page; without them, a page ends at the first blank line after `section_chars`
+    characters, or at any line break after four times that.
+    """
+    page_number = 0
+    lines = []
+    size = 0
+    with open(file_path, encoding="utf-8-sig", errors="replace") as f:
+        # Bounded reads, so one enormous line cannot be loaded whole
+        for line in iter(lambda: f.readline(section_chars), ""):
+            parts = line.split("\f")
+            for i, part in enumerate(parts):
+                if i > 0:
+                    yield page_number, "".join(lines)
+                    page_number, lines, size = page_number + 1, [], 0
+                if (size >= section_chars and not part.strip()) or size >= 4 * section_chars:
+                    yield page_number, "".join(lines)
+                    page_number, lines, size = page_number + 1, [], 0
+                lines.append(part)
+                size += len(part)
+    if "".join(lines).strip():
+        yield page_number, "".join(lines)
+
+
+def iter_page_records(file_path: str) -> Iterator[Tuple[int, str]]:
+    """Yields `(page_number, text)` from a file of pre-extracted pages written by `split_page_records`."""
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            yield record["page"], record["text"]
+
+
+def iter_pages(file_path: str, source_format: str) -> Iterator[Tuple[int, str]]:
+    """Pages of a document that is already text; PDFs are parsed by pdf_chunking instead."""
+    if source_format == "text":
+        return iter_text_pages(file_path)
+    if source_format == "pages":
+        return iter_page_records(file_path)
+    raise UnsupportedFormatError(f"No text loader for format '{source_format}'.")
+
+
+def _parse_record(line: bytes, line_number: int) -> Tuple[str, int, str]:
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Line {line_number}: invalid JSON ({e}).") from e
+    if not isinstance(record, dict):
+        raise ValueError(f"Line {line_number}: expected a JSON object.")
+    doc, page, text = record.get("doc"), record.get("page", 0), record.get("text")
+    if not isinstance(doc, str) or not doc.strip():
+        raise ValueError(f"Line {line_number}: 'doc' must be a non-empty string.")
+    if not isinstance(page, int) or isinstance(page, bool) or page < 0:
+        raise ValueError(f"Line {line_number}: 'page' must be a non-negative integer.")
+    if not isinstance(text, str):
+        raise ValueError(f"Line {line_number}: 'text' must be a string.")
+    return doc.strip(), page, text
+
+
+def split_page_records(source: BinaryIO, directory: str, max_bytes: Optional[int] = None) -> Dict[str, Tuple[str, str]]:
+    """
+    Streams JSONL records `{"doc": str, "page": int, "text": str}` from `source` into one
+    'pages' file per document in `directory`, and returns `{doc: (path, content_hash)}`
+    in order of first appearance. Records of a document need not be adjacent. Raises
+    ValueError on the first invalid record and UploadTooLargeError once more than
+    `max_bytes` have been read; no files are left behind then.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files: Dict[str, Tuple[str, "hashlib._Hash"]] = {}
+    current_doc, current = None, None
+    size = 0
+    try:
+        for line_number, line in enumerate(source, start=1):
+            size += len(line)
+            if max_bytes is not None and size > max_bytes:
+                raise UploadTooLargeError(f"File exceeds the maximum size of {max_bytes / (1024 * 1024):.1f} MB.")
+            if not line.strip():
+                continue
+            doc, page, text = _parse_record(line, line_number)
+            if doc != current_doc:
+                if current is not None:
+                    current.close()
+                if doc not in files:
+                    fd, path = tempfile.mkstemp(prefix="records-", dir=directory)
+                    os.close(fd)
+                    files[doc] = (path, hashlib.sha256())
+                current_doc, current = doc, open(files[doc][0], "a", encoding="utf-8")
+            record = json.dumps({"page": page, "text": text}) + "\n"
+            current.write(record)
+            files[doc][1].update(record.encode("utf-8"))
+    except BaseException:
+        if current is not None:
+            current.close()
+        for path, _ in files.values():
+            os.remove(path)
+        raise
+    if current is not None:
+        current.close()
+    return {doc: (path, digest.hexdigest()) for doc, (path, digest) in files.items()}
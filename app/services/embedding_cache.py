@@ -0,0 +1,233 @@
+# app/services/embedding_cache.py
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "vector_db_data/embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+# Cache hits only note their use in memory; the recency column is written in one batch
+# once this many are pending or this many seconds have passed, never once per lookup
+EMBEDDING_CACHE_TOUCH_BATCH = int(os.getenv("EMBEDDING_CACHE_TOUCH_BATCH", "1000"))
+EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS", "30"))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Disk-backed, content-addressed store of embedding vectors keyed by
+    (model name, SHA-256 of the text). Entries are evicted least-recently-used once
+    the cache holds more than `max_entries` vectors.
+
+    The file may be shared by several worker processes. The entry count lives in the
+    database (kept by triggers), so every process evicts against the same number, and
+    lookups are read-only: recency is recorded in batches, so it is approximate to
+    within EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[Tuple[str, str], float] = {}
+        self._touched_flushed_at = time.monotonic()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        # Row count kept up to date by triggers; COUNT(*) would scan the table
+        self._conn.execute("BEGIN IMMEDIATE")
+        if self._conn.execute("SELECT name FROM sqlite_master WHERE name = 'embedding_count'").fetchone() is None:
+            self._conn.execute("CREATE TABLE embedding_count (n INTEGER NOT NULL)")
+            self._conn.execute("INSERT INTO embedding_count (n) SELECT COUNT(*) FROM embeddings")
+            self._conn.execute("CREATE TRIGGER embedding_count_insert AFTER INSERT ON embeddings BEGIN UPDATE embedding_count SET n = n + 1; END")
+            self._conn.execute("CREATE TRIGGER embedding_count_delete AFTER DELETE ON embeddings BEGIN UPDATE embedding_count SET n = n - 1; END")
+        self._conn.commit()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT n FROM embedding_count").fetchone()[0]
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """Returns the cached vectors for the given hashes and notes them as recently used."""
+        if not hashes:
+            return {}
+        found: Dict[str, List[float]] = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for hash_, blob in rows:
+                    found[hash_] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._touched.update(((model, hash_), now) for hash_ in found)
+                if (len(self._touched) >= EMBEDDING_CACHE_TOUCH_BATCH
+                        or time.monotonic() - self._touched_flushed_at >= EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS):
+                    self._flush_touched()
+                    self._conn.commit()
+            hit_count = sum(1 for hash_ in hashes if hash_ in found)
+            self.hits += hit_count
+            self.misses += len(hashes) - hit_count
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, hash_, np.asarray(vector, dtype=np.float32).tobytes(), now) for hash_, vector in items.items()],
+            )
+            # Recency must be current before choosing what to evict
+            self._flush_touched()
+            self._evict()
+            self._conn.commit()
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ? AND last_used < ?",
+                [(used, model, hash_, used) for (model, hash_), used in self._touched.items()],
+            )
+            self._touched = {}
+        self._touched_flushed_at = time.monotonic()
+
+    def _evict(self) -> None:
+        overflow = self._count() - self.max_entries
+        if overflow <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (overflow,),
+        )
+        self.evictions += overflow
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": self._count(),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so that texts already seen are served from the cache and
+    only misses reach the model. Query embeddings are cached under a separate key
+    space, since some models embed queries differently from documents.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache: "EmbeddingCache"):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+
+    def _embed(self, texts: List[str], model_key: str, compute) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        cached = self.cache.get_many(model_key, hashes)
+        missing: Dict[str, str] = {}
+        for hash_, text in zip(hashes, texts):
+            if hash_ not in cached and hash_ not in missing:
+                missing[hash_] = text
+        if missing:
+            # Round through float32 so fresh and cached results are bit-identical
+            vectors = np.asarray(compute(list(missing.values())), dtype=np.float32).tolist()
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(model_key, computed)
+            cached.update(computed)
+        return [cached[hash_] for hash_ in hashes]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, self.model_name, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, f"{self.model_name}#query", lambda misses: embed_queries(self.underlying, misses))
+
+
+# Models whose embed_query is embed_documents on a single text, so queries can share a forward pass
+QUERY_AS_DOCUMENT_MODELS = (HuggingFaceEmbeddings, DeterministicFakeEmbedding)
+
+
+def embed_queries(model: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embeds several queries, in one batch where the model embeds queries like documents."""
+    if isinstance(model, CachedEmbeddings):
+        return model.embed_queries(texts)
+    if isinstance(model, QUERY_AS_DOCUMENT_MODELS):
+        return model.embed_documents(texts)
+    return [model.embed_query(text) for text in texts]
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Returns the process-wide cache, or None if caching is disabled or unavailable."""
+    global _embedding_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            try:
+                _embedding_cache = EmbeddingCache()
+            except Exception as e:
+                logger.warning("Embedding cache disabled, could not open %s: %s", EMBEDDING_CACHE_PATH, e)
+                return None
+        return _embedding_cache
+
+
+def with_embedding_cache(underlying: Optional[Embeddings], model_name: str) -> Optional[Embeddings]:
+    """Puts the shared cache in front of an embedding model, if caching is enabled."""
+    if underlying is None:
+        return None
+    cache = get_embedding_cache()
+    if cache is None:
+        return underlying
+    return CachedEmbeddings(underlying, model_name, cache)
@@ -0,0 +1,741 @@
+# app/services/index_manager.py
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+from uuid import uuid4
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document as LangchainDocument
+from langchain_core.embeddings import Embeddings
+
+from app.services.ann import INDEX_TYPE, build_index, search_parameters
+from app.services.bm25 import TermStatistics, tokenize
+from app.services.metrics import observe
+from app.services.segments import (
+    SEGMENTS_DIRNAME,
+    VECTOR_ID_WIDTH,
+    Segment,
+    empty_manifest,
+    manifest_lock,
+    manifest_version,
+    new_segment_name,
+    read_manifest,
+    write_manifest,
+)
+
+logger = logging.getLogger(__name__)
+
+# Files of the single-index layout used before segments; migrated on first load
+LEGACY_INDEX_FILES = ("index.faiss", "index.pkl")
+LEGACY_GENERATION_FILENAME = "GENERATION"
+LEGACY_TOMBSTONES_FILENAME = "TOMBSTONES"
+
+# Compact once this fraction of the stored vectors is tombstoned
+COMPACTION_TOMBSTONE_RATIO = float(os.getenv("COMPACTION_TOMBSTONE_RATIO", "0.2"))
+# ...and at least this many vectors are tombstoned, so tiny indexes are not rewritten constantly
+COMPACTION_MIN_TOMBSTONES = int(os.getenv("COMPACTION_MIN_TOMBSTONES", "100"))
+# Background merges keep the number of segments a search fans out to at or below this
+SEGMENT_MAX_COUNT = int(os.getenv("SEGMENT_MAX_COUNT", "8"))
+# Minimum number of (smallest) segments combined by one merge
+SEGMENT_MERGE_FACTOR = int(os.getenv("SEGMENT_MERGE_FACTOR", "4"))
+# A writer flushes a segment once it holds this many vectors, bounding its memory
+SEGMENT_FLUSH_VECTORS = int(os.getenv("SEGMENT_FLUSH_VECTORS", "20000"))
+# Files of merged-away segments are deleted only this long after the merge, since other
+# processes may have read the previous manifest and still be about to load them
+SEGMENT_RETIRE_GRACE_SECONDS = float(os.getenv("SEGMENT_RETIRE_GRACE_SECONDS", "300"))
+# Attempts of a rebuild whose merge keeps being pre-empted by concurrent merges
+REBUILD_ATTEMPTS = 3
+
+
+class _Snapshot:
+    """An immutable view of the published segments; searches never need a lock."""
+
+    def __init__(self, version, generation: int, index_type: Optional[str], segments: List[Segment], tombstones: FrozenSet[str]):
+        self.version = version
+        self.generation = generation
+        self.index_type = index_type
+        self.segments = segments
+        self.tombstones = tombstones
+        self._live_selectors: Dict[str, Optional[faiss.IDSelector]] = {}
+        self._tombstone_array: Optional[np.ndarray] = None
+        self._selectors_lock = threading.Lock()
+
+    def live_selector(self, segment: Segment) -> Optional[faiss.IDSelector]:
+        """
+        ID selector excluding the segment's tombstoned positions, or None if it has none.
+        FAISS then skips deleted vectors during the search itself, so a query never has
+        to over-fetch by the number of tombstones. Built once per segment and snapshot.
+        """
+        with self._selectors_lock:
+            if segment.name not in self._live_selectors:
+                selector = None
+                if self.tombstones:
+                    if self._tombstone_array is None:
+                        self._tombstone_array = np.array(sorted(self.tombstones), dtype=f"S{VECTOR_ID_WIDTH}")
+                    tombstoned = segment.positions_in(self._tombstone_array)
+                    if len(tombstoned):
+                        excluded = faiss.IDSelectorBatch(tombstoned.astype(np.int64))
+                        selector = faiss.IDSelectorNot(excluded)
+                        selector.excluded = excluded  # IDSelectorNot does not own the selector it wraps
+                self._live_selectors[segment.name] = selector
+            return self._live_selectors[segment.name]
+
+    @property
+    def num_vectors(self) -> int:
+        return sum(segment.num_vectors for segment in self.segments)
+
+    def locate(self, vector_id: str) -> Optional[Tuple[Segment, int]]:
+        for segment in self.segments:
+            position = segment.position_of(vector_id)
+            if position is not None:
+                return segment, position
+        return None
+
+
+class AllowList:
+    """
+    The chunks a filtered search may return, resolved against one snapshot: sorted
+    positions per segment, plus a FAISS ID selector over them so the filter is applied
+    inside the index search rather than to its results. Segments are immutable, so the
+    positions stay valid in any process that has the same segments loaded.
+    """
+
+    def __init__(self, generation: int, positions: Dict[str, np.ndarray]):
+        self.generation = generation
+        self.positions = positions
+        self.selectors = {name: faiss.IDSelectorBatch(found) for name, found in positions.items()}
+
+    @classmethod
+    def resolve(cls, snapshot: _Snapshot, vector_ids: Iterable[str]) -> "AllowList":
+        positions: Dict[str, List[int]] = defaultdict(list)
+        for vector_id in vector_ids:
+            if vector_id in snapshot.tombstones:
+                continue
+            location = snapshot.locate(vector_id)
+            if location is not None:
+                positions[location[0].name].append(location[1])
+        return cls(snapshot.generation, {name: np.array(sorted(found), dtype=np.int64) for name, found in positions.items()})
+
+    def __reduce__(self):
+        # FAISS selectors cannot be pickled; they are rebuilt from the positions
+        return AllowList, (self.generation, self.positions)
+
+    def __len__(self) -> int:
+        return sum(len(found) for found in self.positions.values())
+
+
+class SegmentWriter:
+    """
+    Collects the vectors of one ingestion and writes them as new immutable segments.
+    Nothing is visible to searches until `flush()` or `commit()` publishes a segment.
+    """
+
+    def __init__(self, manager: "IndexManager", flush_vectors: int = SEGMENT_FLUSH_VECTORS):
+        self.manager = manager
+        self.flush_vectors = flush_vectors
+        self.flushed_ids: List[str] = []
+        self._ids: List[str] = []
+        self._vectors: List[np.ndarray] = []
+        self._docs: List[LangchainDocument] = []
+
+    @property
+    def vector_ids(self) -> List[str]:
+        return self.flushed_ids + self._ids
+
+    def add_embeddings(self, texts: List[str], vectors: Sequence[Sequence[float]], metadatas: List[Dict]) -> List[str]:
+        """Buffers pre-computed embeddings and returns the vector IDs assigned to them."""
+        ids = [str(uuid4()) for _ in texts]
+        self._docs.extend(LangchainDocument(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas))
+        self._ids.extend(ids)
+        self._vectors.append(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        if len(self._ids) >= self.flush_vectors:
+            self.flush()
+        return ids
+
+    def flush(self, tombstones: Iterable[str] = ()) -> None:
+        """Publishes the buffered vectors as one segment, together with `tombstones`."""
+        segment = None
+        if self._ids:
+            index = build_index("flat", np.vstack(self._vectors))
+            segment = Segment.create(self.manager.directory, new_segment_name(), index, self._ids, self._docs)
+        self.manager.publish_segment(segment, tombstones)
+        self.flushed_ids.extend(self._ids)
+        self._ids, self._vectors, self._docs = [], [], []
+
+    def commit(self, tombstones: Iterable[str] = ()) -> None:
+        """
+        Publishes what is left and tombstones the given vector IDs in the same manifest
+        update, so a re-ingested document switches versions atomically.
+        """
+        self.flush(tombstones)
+
+    def abort(self) -> None:
+        """Drops buffered vectors and tombstones any segments this writer already published."""
+        self._ids, self._vectors, self._docs = [], [], []
+        self.manager.remove(self.flushed_ids)
+        self.flushed_ids = []
+
+
+class IndexManager:
+    """
+    Keeps the vector index resident in memory for the whole process, stored on disk as
+    an append-only log of immutable segments.
+
+    A small JSON manifest lists the live segments and the tombstoned vector IDs. Each
+    ingestion writes its chunks as a new segment and then updates the manifest
+    atomically under a cross-process file lock, so writes cost O(new chunks) rather than
+    O(corpus) and concurrent uploads cannot lose each other's vectors. Searches fan out
+    across the segments and merge the results by distance.
+
+    Every manifest update bumps a generation; processes sharing the directory notice it
+    on their next query and load only the segments they have not seen. A background
+    merge keeps the segment count bounded and drops tombstoned vectors for good.
+    """
+
+    def __init__(self, directory: str, embedding_provider: Callable[[], Optional[Embeddings]]):
+        self.directory = directory
+        # Called on use, so the embedding model is only loaded once something needs it
+        self._embedding_provider = embedding_provider
+        self._snapshot: Optional[_Snapshot] = None
+        # Guards the snapshot swap in refresh(); held only briefly, since searches load
+        # new segments under it
+        self._lock = threading.RLock()
+        # Serialises compaction, merges and rebuilds in this process; searches never take it
+        self._maintenance_lock = threading.Lock()
+        self._load_time_seconds: Optional[float] = None
+        self._loaded_at: Optional[datetime] = None
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self.last_compaction: Optional[Dict] = None
+        self.last_merge: Optional[Dict] = None
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_provider()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def read_generation(self) -> int:
+        """Returns the generation last published to disk (0 if none has been recorded)."""
+        manifest = read_manifest(self.directory)
+        return manifest["generation"] if manifest else 0
+
+    def _migrate_legacy_index(self) -> bool:
+        """
+        Moves an index saved in the pre-segment layout (index.faiss/index.pkl in the
+        directory root) into the first segment. Must be called with the manifest lock held.
+        """
+        if not all(os.path.exists(self._path(name)) for name in LEGACY_INDEX_FILES):
+            return False
+        name = new_segment_name()
+        os.makedirs(Segment.path(self.directory, name))
+        for filename in LEGACY_INDEX_FILES:
+            os.replace(self._path(filename), os.path.join(Segment.path(self.directory, name), filename))
+        # Converts the pickled docstore to the chunk store on the way
+        segment = Segment.load(self.directory, name)
+
+        manifest = empty_manifest()
+        try:
+            with open(self._path(LEGACY_GENERATION_FILENAME), "r") as f:
+                manifest["generation"] = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            pass
+        tombstones = set()
+        try:
+            with open(self._path(LEGACY_TOMBSTONES_FILENAME), "r") as f:
+                tombstones.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        # The old layout seeded every new index with a placeholder "initialization" text
+        for position in range(segment.num_vectors):
+            doc = segment.document(position)
+            if doc.page_content == "initialization" and "document_id" not in doc.metadata:
+                tombstones.add(doc.id)
+        manifest["index_type"] = segment.index_type
+        manifest["segments"].append(self._segment_entry(segment))
+        manifest["tombstones"] = sorted(tombstones)
+        manifest["generation"] += 1
+        write_manifest(self.directory, manifest)
+        for filename in (LEGACY_GENERATION_FILENAME, LEGACY_TOMBSTONES_FILENAME):
+            if os.path.exists(self._path(filename)):
+                os.remove(self._path(filename))
+        logger.info("Migrated legacy FAISS index (%d vectors) into segment %s.", segment.num_vectors, name)
+        return True
+
+    def _ensure_manifest(self, create: bool) -> None:
+        if manifest_version(self.directory) is not None:
+            return
+        with manifest_lock(self.directory):
+            if read_manifest(self.directory) is not None or self._migrate_legacy_index():
+                return
+            if not create:
+                raise FileNotFoundError(f"FAISS index not found at {self.directory}. Please ingest documents first.")
+            logger.info("Creating new segmented FAISS index at %s", self.directory)
+            os.makedirs(self._path(SEGMENTS_DIRNAME), exist_ok=True)
+            write_manifest(self.directory, empty_manifest())
+
+    def refresh(self, create: bool = False) -> _Snapshot:
+        """
+        Returns the current snapshot of the index. If the manifest changed on disk since
+        the last call, segments that appeared are loaded and ones merged away are
+        dropped; segments already resident are reused as they are.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == manifest_version(self.directory):
+            return snapshot
+        self._ensure_manifest(create)
+
+        with self._lock:
+            snapshot = self._snapshot
+            version = manifest_version(self.directory)
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            resident = {segment.name: segment for segment in snapshot.segments} if snapshot else {}
+            started = time.perf_counter()
+            while True:
+                manifest = read_manifest(self.directory)
+                try:
+                    segments = [resident.get(entry["name"]) or Segment.load(self.directory, entry["name"]) for entry in manifest["segments"]]
+                    break
+                except FileNotFoundError:
+                    # A merge retired a segment (and its grace period ran out) after this
+                    # manifest was read; the manifest that replaced it no longer lists it
+                    if manifest_version(self.directory) == version:
+                        raise
+                    version = manifest_version(self.directory)
+            loaded = [segment for segment in segments if segment.name not in resident]
+            if loaded:
+                self._load_time_seconds = time.perf_counter() - started
+                self._loaded_at = datetime.utcnow()
+                observe("index_load", self._load_time_seconds)
+                logger.info("Loaded %d segment(s), %d vectors in %.3fs (generation %s).", len(loaded),
+                            sum(segment.num_vectors for segment in loaded), self._load_time_seconds, manifest["generation"])
+            self._snapshot = _Snapshot(
+                version,
+                manifest["generation"],
+                manifest.get("index_type"),
+                segments,
+                frozenset(manifest["tombstones"]),
+            )
+            return self._snapshot
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[LangchainDocument]:
+        """Embeds the query and searches the resident segments."""
+        if not self.embeddings:
+            raise ValueError("Embedding model not initialized.")
+        query_vector = self.embeddings.embed_query(query)
+        return self.similarity_search_by_vector(query_vector, k, nprobe=nprobe, ef_search=ef_search)
+
+    def similarity_search_by_vector(
+        self,
+        query_vector: List[float],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[LangchainDocument]:
+        """
+        Searches every segment, skipping tombstoned vectors, and merges the hits by
+        distance. `nprobe` (IVF segments) and `ef_search` (HNSW) override the index
+        defaults for this query only.
+        """
+        return self.similarity_search_by_vectors([query_vector], k, nprobe=nprobe, ef_search=ef_search)[0]
+
+    def similarity_search_by_vectors(
+        self,
+        query_vectors: Sequence[Sequence[float]],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        allow: Optional[AllowList] = None,
+    ) -> List[List[LangchainDocument]]:
+        """
+        Batched `similarity_search_by_vector`: one FAISS search per segment covers every
+        query, and the top `k` documents are returned for each query in order. With
+        `allow`, only the chunks it lists are searched.
+        """
+        return [[doc for _, doc in hits] for hits in self.search_with_distances(query_vectors, k, nprobe, ef_search, allow)]
+
+    def search_with_distances(
+        self,
+        query_vectors: Sequence[Sequence[float]],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        allow: Optional[AllowList] = None,
+    ) -> List[List[Tuple[float, LangchainDocument]]]:
+        """`similarity_search_by_vectors` with each document's distance, for merging with other indexes."""
+        if len(query_vectors) == 0:
+            return []
+        snapshot = self.refresh()
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        hits: List[List[Tuple[float, Segment, int]]] = [[] for _ in range(len(query_vectors))]
+        for segment in snapshot.segments:
+            if segment.num_vectors == 0:
+                continue
+            if allow is not None:
+                # Allow-lists never contain tombstoned positions
+                selector = allow.selectors.get(segment.name)
+                if selector is None:
+                    continue  # nothing in this segment passes the filter
+            else:
+                selector = snapshot.live_selector(segment)
+            params = search_parameters(segment.index, nprobe=nprobe, ef_search=ef_search, selector=selector)
+            distances, positions = segment.search(query_vectors, k, params=params)
+            for query_hits, query_distances, query_positions in zip(hits, distances, positions):
+                for distance, position in zip(query_distances, query_positions):
+                    if position == -1:
+                        continue
+                    if segment.vector_id(position) not in snapshot.tombstones:
+                        query_hits.append((float(distance), segment, int(position)))
+        results = []
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit[0])
+            # Chunk text is only read from the memory-mapped store for the final k hits
+            results.append([(distance, segment.document(position)) for distance, segment, position in query_hits[:k]])
+        return results
+
+    def term_statistics(self, query: str) -> TermStatistics:
+        """BM25 statistics of the query terms over every segment."""
+        snapshot = self.refresh()
+        return TermStatistics.collect(tokenize(query), [segment.lexical for segment in snapshot.segments if segment.num_vectors])
+
+    def lexical_search(self, query: str, k: int, allow: Optional[AllowList] = None) -> List[LangchainDocument]:
+        """
+        BM25 search over the chunk text of every segment, skipping tombstoned chunks and,
+        with `allow`, chunks it does not list. Term statistics are summed over all
+        segments so scores compare across them.
+        """
+        return [doc for _, doc in self.lexical_search_with_scores(query, k, allow)]
+
+    def lexical_search_with_scores(
+        self,
+        query: str,
+        k: int,
+        allow: Optional[AllowList] = None,
+        statistics: Optional[TermStatistics] = None,
+    ) -> List[Tuple[float, LangchainDocument]]:
+        """
+        `lexical_search` with each document's BM25 score. Pass `statistics` of a larger
+        corpus this index is part of to get scores comparable with its other parts.
+        """
+        snapshot = self.refresh()
+        segments = [segment for segment in snapshot.segments if segment.num_vectors]
+        statistics = statistics or TermStatistics.collect(tokenize(query), [segment.lexical for segment in segments])
+        idf = statistics.idf()
+        if not idf:
+            return []
+        avg_length = statistics.avg_length
+        hits: List[Tuple[float, Segment, int]] = []
+        for segment in segments:
+            if allow is not None and segment.name not in allow.positions:
+                continue
+            positions, scores = segment.lexical.score(idf, avg_length)
+            if allow is not None:
+                allowed = np.isin(positions, allow.positions[segment.name], assume_unique=True)
+                positions, scores = positions[allowed], scores[allowed]
+            live = 0
+            for i in np.argsort(-scores, kind="stable"):
+                if live == k:
+                    break
+                if segment.vector_id(positions[i]) not in snapshot.tombstones:
+                    hits.append((float(scores[i]), segment, int(positions[i])))
+                    live += 1
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [(score, segment.document(position)) for score, segment, position in hits[:k]]
+
+    def allow_list(self, vector_ids: Iterable[str]) -> AllowList:
+        """Resolves vector IDs (e.g. from a metadata query) to an allow-list for filtered searches."""
+        return AllowList.resolve(self.refresh(), vector_ids)
+
+    def writer(self) -> SegmentWriter:
+        """Starts a new batch of vectors that will be published as new segment(s)."""
+        return SegmentWriter(self)
+
+    @staticmethod
+    def _segment_entry(segment: Segment) -> Dict:
+        return {
+            "name": segment.name,
+            "num_vectors": segment.num_vectors,
+            "index_type": segment.index_type,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+
+    def publish_segment(self, segment: Optional[Segment], tombstones: Iterable[str] = ()) -> int:
+        """
+        Appends `segment` (if any, already written with `Segment.create`) to the manifest
+        and adds `tombstones` in one atomic manifest update. Returns the new generation.
+        """
+        self._ensure_manifest(create=True)
+        with manifest_lock(self.directory):
+            manifest = read_manifest(self.directory)
+            if segment is not None:
+                manifest["segments"].append(self._segment_entry(segment))
+            manifest["tombstones"] = sorted(set(manifest["tombstones"]).union(tombstones))
+            manifest["generation"] += 1
+            purged = self._purge_retired(manifest)
+            write_manifest(self.directory, manifest)
+        self._remove_segments(purged)
+        if segment is not None:
+            logger.info("Published segment %s (%d vectors) as generation %s.", segment.name, segment.num_vectors, manifest["generation"])
+        self.refresh()
+        self.maybe_compact()
+        return manifest["generation"]
+
+    def remove(self, vector_ids: Iterable[str]) -> None:
+        """
+        Tombstones vectors so they stop appearing in search results straight away. Only
+        the manifest is rewritten; the vectors stay in their segments until a merge.
+        """
+        snapshot = self.refresh(create=True)
+        vector_ids = [vector_id for vector_id in vector_ids if vector_id and snapshot.locate(vector_id) is not None]
+        if vector_ids:
+            self.publish_segment(None, vector_ids)
+
+    def live_vector_ids(self, vector_ids: Iterable[str]) -> Set[str]:
+        """Returns those of `vector_ids` that are in a published segment and not tombstoned."""
+        snapshot = self.refresh(create=True)
+        return {
+            vector_id for vector_id in vector_ids
+            if vector_id and vector_id not in snapshot.tombstones and snapshot.locate(vector_id) is not None
+        }
+
+    def get_vectors(self, vector_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Returns the stored vectors of the given IDs, for copying them into a new segment."""
+        vector_ids = list(vector_ids)
+        if not vector_ids:
+            return {}
+        snapshot = self.refresh()
+        found: Dict[str, np.ndarray] = {}
+        for vector_id in vector_ids:
+            location = snapshot.locate(vector_id)
+            if location is not None:
+                segment, position = location
+                found[vector_id] = segment.reconstruct([position])[0]
+        return found
+
+    @staticmethod
+    def _purge_retired(manifest: Dict) -> List[str]:
+        """
+        Drops retired segments whose grace period is over from `manifest` and returns
+        their names; their files are removed once the manifest has been written.
+        """
+        cutoff = time.time() - SEGMENT_RETIRE_GRACE_SECONDS
+        retired = manifest.get("retired", [])
+        manifest["retired"] = [entry for entry in retired if entry["retired_at"] > cutoff]
+        return [entry["name"] for entry in retired if entry["retired_at"] <= cutoff]
+
+    def _remove_segments(self, names: Iterable[str]) -> None:
+        # Processes that still have these segments mapped keep reading them: unlinking
+        # does not invalidate an open mapping
+        for name in names:
+            Segment.remove_files(self.directory, name)
+
+    def _merge(self, names: List[str], index_type: Optional[str] = None) -> Optional[Dict]:
+        """
+        Rewrites the named segments as one new segment without their tombstoned vectors.
+        The expensive part runs without any lock, so searches and segment loads carry on;
+        only the manifest swap is locked, and it is abandoned if another process merged
+        any of the same segments in the meantime. The replaced segments are retired: their
+        files stay for SEGMENT_RETIRE_GRACE_SECONDS, for processes still on an older manifest.
+        """
+        started = time.perf_counter()
+        snapshot = self.refresh()
+        sources = [segment for segment in snapshot.segments if segment.name in names]
+        index_type = index_type or snapshot.index_type or INDEX_TYPE
+
+        kept_ids: List[str] = []
+        dropped_ids: List[str] = []
+        kept_positions: List[Tuple[Segment, List[int]]] = []
+        vectors: List[np.ndarray] = []
+        for segment in sources:
+            keep = []
+            for position, vector_id in enumerate(segment.iter_vector_ids()):
+                if vector_id in snapshot.tombstones:
+                    dropped_ids.append(vector_id)
+                else:
+                    keep.append(position)
+                    kept_ids.append(vector_id)
+            kept_positions.append((segment, keep))
+            vectors.append(segment.reconstruct(keep))
+
+        merged = None
+        if kept_ids:
+            # Chunks are streamed from the source stores into the new one
+            docs = (segment.document(position) for segment, keep in kept_positions for position in keep)
+            vectors = np.vstack(vectors)
+            merged = Segment.create(self.directory, new_segment_name(), build_index(index_type, vectors), kept_ids, docs, vectors)
+
+        source_names = [segment.name for segment in sources]
+        with manifest_lock(self.directory):
+            manifest = read_manifest(self.directory)
+            current = [entry["name"] for entry in manifest["segments"]]
+            if not all(name in current for name in source_names):
+                if merged is not None:
+                    Segment.remove_files(self.directory, merged.name)
+                logger.info("Merge abandoned: segments changed concurrently.")
+                return None
+            # The merged segment takes the place of the first segment it replaces
+            segments = []
+            placed = merged is None
+            for entry in manifest["segments"]:
+                if entry["name"] not in source_names:
+                    segments.append(entry)
+                elif not placed:
+                    segments.append(self._segment_entry(merged))
+                    placed = True
+            manifest["segments"] = segments
+            manifest["tombstones"] = sorted(set(manifest["tombstones"]).difference(dropped_ids))
+            manifest["index_type"] = index_type
+            manifest["generation"] += 1
+            purged = self._purge_retired(manifest)
+            manifest["retired"].extend({"name": name, "retired_at": time.time()} for name in source_names)
+            write_manifest(self.directory, manifest)
+        self._remove_segments(purged)
+        self.refresh()
+
+        return {
+            "finished_at": datetime.utcnow(),
+            "merged_segments": len(source_names),
+            "num_vectors": len(kept_ids),
+            "removed_vectors": len(dropped_ids),
+            "index_type": index_type,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def needs_compaction(self) -> bool:
+        snapshot = self._snapshot
+        if snapshot is None or len(snapshot.tombstones) < COMPACTION_MIN_TOMBSTONES:
+            return False
+        return len(snapshot.tombstones) >= COMPACTION_TOMBSTONE_RATIO * max(snapshot.num_vectors, 1)
+
+    def needs_merge(self) -> bool:
+        snapshot = self._snapshot
+        return snapshot is not None and len(snapshot.segments) > SEGMENT_MAX_COUNT
+
+    def compact(self) -> Dict:
+        """
+        Physically drops tombstoned vectors by merging every segment that holds any
+        into one new segment. Stored vectors are reused; nothing is re-embedded.
+        """
+        with self._maintenance_lock:
+            started = time.perf_counter()
+            snapshot = self.refresh(create=True)
+            names = [
+                segment.name for segment in snapshot.segments
+                if any(vector_id in snapshot.tombstones for vector_id in segment.iter_vector_ids())
+            ]
+            result = self._merge(names) if names else None
+            self.last_compaction = {
+                "finished_at": datetime.utcnow(),
+                "removed_vectors": result["removed_vectors"] if result else 0,
+                "seconds": time.perf_counter() - started,
+            }
+            logger.info("Compacted index: removed %d vectors.", self.last_compaction["removed_vectors"])
+            return self.last_compaction
+
+    def merge_segments(self) -> Optional[Dict]:
+        """Merges the smallest segments so that at most SEGMENT_MAX_COUNT remain."""
+        with self._maintenance_lock:
+            snapshot = self.refresh()
+            excess = len(snapshot.segments) - SEGMENT_MAX_COUNT
+            if excess <= 0:
+                return None
+            count = min(len(snapshot.segments), max(SEGMENT_MERGE_FACTOR, excess + 1))
+            smallest = sorted(snapshot.segments, key=lambda segment: segment.num_vectors)[:count]
+            result = self._merge([segment.name for segment in smallest])
+            if result is not None:
+                self.last_merge = result
+                logger.info("Merged %d segments into one of %d vectors.", result["merged_segments"], result["num_vectors"])
+            return result
+
+    def rebuild(self, index_type: str) -> Dict:
+        """
+        Merges every segment into a single one of another index type (flat, ivf_flat,
+        ivf_pq or hnsw), dropping tombstoned vectors on the way. Later merges keep
+        producing segments of this type. Raises RuntimeError if concurrent merges in other
+        processes pre-empt it REBUILD_ATTEMPTS times in a row.
+        """
+        with self._maintenance_lock:
+            started = time.perf_counter()
+            previous_type = self.refresh().index_type or INDEX_TYPE
+            for _ in range(REBUILD_ATTEMPTS):
+                snapshot = self.refresh()
+                if self._merge([segment.name for segment in snapshot.segments], index_type=index_type) is not None:
+                    break
+            else:
+                raise RuntimeError(f"Rebuild as {index_type} abandoned: segments kept changing concurrently.")
+            snapshot = self.refresh()
+            result = {
+                "previous_index_type": previous_type,
+                "index_type": snapshot.index_type,
+                "num_vectors": snapshot.num_vectors,
+                "seconds": time.perf_counter() - started,
+            }
+            logger.info("Rebuilt index as %s: %s", index_type, result)
+            return result
+
+    def maybe_compact(self) -> bool:
+        """
+        Starts background maintenance (compaction, then merging down to SEGMENT_MAX_COUNT
+        segments) if it is needed and not already running.
+        """
+        if not (self.needs_compaction() or self.needs_merge()):
+            return False
+        with self._lock:
+            if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+                return False
+            self._maintenance_thread = threading.Thread(target=self._maintain_in_background, name="index-maintenance", daemon=True)
+            self._maintenance_thread.start()
+            return True
+
+    def _maintain_in_background(self) -> None:
+        try:
+            if self.needs_compaction():
+                self.compact()
+            while self.needs_merge():
+                if self.merge_segments() is None:
+                    break
+        except Exception as e:
+            logger.exception("Background index maintenance failed: %s", e)
+
+    def stats(self) -> Dict:
+        """Reports what is resident in memory and how large the published segments are on disk."""
+        snapshot = self._snapshot
+        segments = [
+            {
+                "name": segment.name,
+                "num_vectors": segment.num_vectors,
+                "index_type": segment.index_type,
+                "size_bytes": Segment.size_bytes(self.directory, segment.name),
+            }
+            for segment in (snapshot.segments if snapshot else [])
+        ]
+        return {
+            "directory": self.directory,
+            "loaded": snapshot is not None,
+            "generation": snapshot.generation if snapshot else None,
+            "published_generation": self.read_generation(),
+            "index_type": snapshot.index_type if snapshot and snapshot.index_type else INDEX_TYPE,
+            "num_vectors": snapshot.num_vectors if snapshot else 0,
+            "num_tombstones": len(snapshot.tombstones) if snapshot else 0,
+            "num_segments": len(segments),
+            "segments": segments,
+            "index_size_bytes": sum(segment["size_bytes"] for segment in segments),
+            "load_time_seconds": self._load_time_seconds,
+            "loaded_at": self._loaded_at,
+            "last_compaction": self.last_compaction,
+            "last_merge": self.last_merge,
+        }
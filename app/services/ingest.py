@@ -2,207 +2,512 @@
 
 from uuid import uuid4
 from datetime import datetime
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional, Callable, Iterable, Iterator, NamedTuple
+from collections import defaultdict, deque
+import asyncio
+import hashlib
+import logging
 import os
-import re
+import tempfile
 from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings # For local models
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document as LangchainDocument
 
 from app.models.metadata import SessionLocal, Document, Chunk
+from app.services.retriever import collections, filter_cache
+from app.services.index_manager import SegmentWriter
+from app.services.metadata_filter import in_collection
+from app.services.sharding import DEFAULT_COLLECTION
+from app.services.document_loaders import iter_pages, sniff_format
+from app.services.embedding_cache import text_hash
+from app.services.metrics import span
+from app.services.model_registry import get_embeddings
+from app.services.pdf_chunking import (
+    chunk_page,
+    count_pdf_pages,
+    iter_pdf_chunks_parallel,
+    get_text_splitter,
+    INGEST_PARALLEL_MIN_PAGES,
+    INGEST_PARSE_PROCESSES,
+)
 from sqlalchemy.orm import Session
 from sqlalchemy import exc
 
+logger = logging.getLogger(__name__)
+
 # Configuration
 # Change VECTOR_DB_PATH to be just the directory name
 VECTOR_DB_DIRECTORY = os.getenv("VECTOR_DB_DIRECTORY", "vector_db_data/faiss_index")
-EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+# Chunks embedded and persisted together; bounds memory and progress granularity per batch
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+# Read size when hashing or copying uploaded files
+FILE_CHUNK_BYTES = 1024 * 1024
 
 # Ensure the vector DB directory exists
 os.makedirs(VECTOR_DB_DIRECTORY, exist_ok=True)
 
 
-def _clean_text(text: str) -> str:
+class _PreviousChunk(NamedTuple):
+    """Plain copy of a chunk row, unaffected by the session expiring its objects on commit."""
+    id: str
+    vector_id: Optional[str]
+    content_hash: Optional[str]
+    page_number: Optional[int]
+    chunk_index: Optional[int]
+
+
+def file_hash(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def file_hash_from_path(file_path: str) -> str:
+    """Same as `file_hash`, reading the file a chunk at a time."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(FILE_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _find_duplicate(db: Session, content_hash: str, collection: str, exclude_id: Optional[str] = None) -> Optional[Document]:
+    """Finds a document of the collection with identical content that is ingested or on its way to being ingested."""
+    query = db.query(Document).filter(
+        Document.content_hash == content_hash,
+        Document.status.in_(("queued", "processing", "completed")),
+        in_collection(collection),
+    )
+    if exclude_id:
+        query = query.filter(Document.id != exclude_id)
+    return query.first()
+
+
+def _find_previous_version(db: Session, filename: str, collection: str) -> Optional[Document]:
+    """Finds the most recent completed document of the collection uploaded under the same filename."""
+    return (
+        db.query(Document)
+        .filter(Document.filename == filename, Document.status == "completed", in_collection(collection))
+        .order_by(Document.uploaded_at.desc())
+        .first()
+    )
+
+
+def plan_ingestion(filename: str, content_hash: str, collection: str = DEFAULT_COLLECTION) -> Dict:
     """
-    Cleans the input text by removing common OCR/PDF extraction artifacts and standardizing.
+    Decides how an upload to `collection` is ingested before it is queued:
+    - 'duplicate': identical content already exists in it, nothing to do;
+    - 'update': a new version of a known filename, re-ingested into the existing document;
+    - 'new': recorded as a new 'queued' document.
     """
-    # ... (rest of the _clean_text function remains unchanged)
-    cleaned_text = text.replace('♂phone', 'Phone: ')
-    cleaned_text = cleaned_text.replace('/envel⌢p', 'Email: ') # Combine /envel and ⌢p
-    cleaned_text = cleaned_text.replace('/linkedin', 'LinkedIn: ')
-    cleaned_text = cleaned_text.replace('/github', 'GitHub: ')
-    cleaned_text = cleaned_text.replace('♂¶ap-¶arker-alt', 'Location: ')
-    cleaned_text = cleaned_text.replace('/char◎-line', '') # Remove interest icon
-    cleaned_text = cleaned_text.replace('/brain', '') # Remove interest icon
-    cleaned_text = cleaned_text.replace('/code-branch', '') # Remove interest icon
-    cleaned_text = cleaned_text.replace('♂project-diagra¶', '') # Remove interest icon
-    cleaned_text = cleaned_text.replace('♂robot', '') # Remove interest icon
-    cleaned_text = cleaned_text.replace('¨', '') # Remove diacritic for "Schrödinger"
-    cleaned_text = cleaned_text.replace('´', '') # Remove diacritic for "Schrödinger"
-    cleaned_text = cleaned_text.replace('˜', '') # Remove diacritic or other artifacts
-
-    # 2. Remove any remaining non-ASCII characters that are not basic punctuation or whitespace
-    # This regex keeps alphanumeric characters, spaces, and common punctuation.
-    # Adjust if you have specific foreign language characters that *should* be preserved.
-    cleaned_text = re.sub(r'[^\x20-\x7E\n\r]+', ' ', cleaned_text)
+    db: Session = SessionLocal()
+    try:
+        duplicate = _find_duplicate(db, content_hash, collection)
+        if duplicate is not None:
+            return {"action": "duplicate", "document_id": duplicate.id}
 
-    # 3. Normalize whitespace: multiple spaces to single space, remove leading/trailing whitespace
-    cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
+        previous = _find_previous_version(db, filename, collection)
+        if previous is not None:
+            previous.status = "queued"
+            db.commit()
+            return {"action": "update", "document_id": previous.id}
+    finally:
+        db.close()
 
-    return cleaned_text
+    return {"action": "new", "document_id": create_pending_document(filename, content_hash=content_hash, collection=collection)}
 
 
-# Initialize Embedding Model (load once)
-try:
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-except Exception as e:
-    print(f"Error loading embedding model: {e}")
-    embeddings = None # Handle this gracefully in your app
+def create_pending_document(
+    filename: str,
+    document_id: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    collection: str = DEFAULT_COLLECTION,
+) -> str:
+    """
+    Records a document as 'queued' before ingestion starts, so its status can be
+    followed through the documents table while it waits for a worker.
+    """
+    document_id = document_id or str(uuid4())
+    db: Session = SessionLocal()
+    try:
+        db.add(Document(
+            id=document_id,
+            filename=filename,
+            uploaded_at=datetime.utcnow(),
+            status="queued",
+            content_hash=content_hash,
+            collection=collection
+        ))
+        db.commit()
+    finally:
+        db.close()
+    return document_id
 
 
-def get_faiss_vector_store():
-    """Initializes or loads the FAISS vector store."""
-    if not embeddings:
-        raise ValueError("Embedding model not initialized.")
+def set_document_status(document_id: str, status: str, only_if: Optional[str] = None) -> None:
+    """
+    Updates the status column of an existing document, ignoring unknown IDs. With
+    `only_if`, the update only applies while the document is in that status.
+    """
+    db: Session = SessionLocal()
+    try:
+        doc = db.get(Document, document_id)
+        if doc is not None and (only_if is None or doc.status == only_if):
+            doc.status = status
+            db.commit()
+    finally:
+        db.close()
 
-    # Check for the existence of the FAISS files within the directory
-    # Langchain's FAISS.load_local expects the directory path, and it will look for
-    # 'index.faiss' and 'index.pkl' (or similar) inside that directory.
-    faiss_index_file = os.path.join(VECTOR_DB_DIRECTORY, "index.faiss")
-    faiss_pkl_file = os.path.join(VECTOR_DB_DIRECTORY, "index.pkl")
 
-    if os.path.exists(faiss_index_file) and os.path.exists(faiss_pkl_file):
-        print(f"Loading existing FAISS index from {VECTOR_DB_DIRECTORY}")
-        # Pass the directory path to load_local
-        return FAISS.load_local(VECTOR_DB_DIRECTORY, embeddings, allow_dangerous_deserialization=True)
+def _iter_page_chunks(
+    file_path: str,
+    filename: str,
+    document_id: str,
+    num_pages: int,
+    report: Callable[..., None],
+) -> Iterator[LangchainDocument]:
+    """
+    Lazily yields the cleaned chunks of a PDF in page order, reporting parsed pages as it goes.
+    Large PDFs are parsed across the process pool, smaller ones page by page in-process.
+    """
+    if num_pages >= INGEST_PARALLEL_MIN_PAGES and INGEST_PARSE_PROCESSES > 1:
+        logger.info("Parsing %d pages of %s across %d processes", num_pages, filename, INGEST_PARSE_PROCESSES)
+        ranges = iter_pdf_chunks_parallel(file_path, filename, document_id, num_pages)
+        while True:
+            # Pool workers parse and chunk together; only the wait for their results is seen here
+            with span("pdf_parse"):
+                parsed = next(ranges, None)
+            if parsed is None:
+                return
+            report(pages_parsed=parsed[0])
+            yield from parsed[1]
     else:
-        print(f"Creating new FAISS index at {VECTOR_DB_DIRECTORY}")
-        # Initialize with a dummy text, then save to establish the files
-        # It's important to save it so subsequent calls can load it
-        new_faiss_store = FAISS.from_texts(["initialization"], embeddings)
-        new_faiss_store.save_local(VECTOR_DB_DIRECTORY) # Save the initial empty store
-        return new_faiss_store
+        text_splitter = get_text_splitter()
+        pages = PyPDFLoader(file_path).lazy_load()
+        for i in range(num_pages):
+            with span("pdf_parse"):
+                page = next(pages, None)
+            if page is None:
+                return
+            report(pages_parsed=i + 1)
+            with span("chunk"):
+                page_chunks = chunk_page(page.page_content, page.metadata, i, filename, document_id, text_splitter)
+            yield from page_chunks
 
 
-async def process_document(file_content: bytes, filename: str) -> Dict:
+def _iter_text_chunks(
+    pages: Iterator[Tuple[int, str]],
+    filename: str,
+    document_id: str,
+    report: Callable[..., None],
+) -> Iterator[LangchainDocument]:
+    """
+    Lazily yields the cleaned chunks of a document that is already text (a text file or
+    pre-extracted pages), reporting pages as they are read. Nothing goes through pypdf.
+    """
+    text_splitter = get_text_splitter()
+    pages_parsed = 0
+    while True:
+        with span("text_parse"):
+            page = next(pages, None)
+        if page is None:
+            return
+        pages_parsed += 1
+        report(pages_parsed=pages_parsed)
+        page_number, text = page
+        with span("chunk"):
+            page_chunks = chunk_page(text, {"source": filename, "page": page_number}, page_number, filename, document_id, text_splitter)
+        yield from page_chunks
+
+
+def _batched(items: Iterable, batch_size: int) -> Iterator[List]:
+    batch: List = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _discard_partial_ingestion(db: Session, document_id: str, writer: Optional[SegmentWriter]) -> None:
+    """
+    Removes the vectors and chunk rows a failed ingestion already wrote. Chunks that
+    belonged to a previous version of the document are left untouched.
+    """
+    if writer is None:
+        return
+    try:
+        vector_ids = writer.vector_ids
+        writer.abort()
+        if vector_ids:
+            db.query(Chunk).filter(Chunk.vector_id.in_(vector_ids)).delete(synchronize_session=False)
+        db.commit()
+    except Exception as cleanup_error:
+        db.rollback()
+        logger.error("Could not clean up partial ingestion of %s: %s", document_id, cleanup_error)
+
+
+def ingest_document(
+    file_content: Optional[bytes],
+    filename: str,
+    document_id: Optional[str] = None,
+    progress: Optional[Callable[..., None]] = None,
+    collection: str = DEFAULT_COLLECTION,
+    file_path: Optional[str] = None,
+    source_format: Optional[str] = None,
+) -> Dict:
     """
     Ingests a document: loads, chunks, embeds, and stores in vector DB and metadata DB.
+    Its vectors go to the shard of `collection` that its document ID hashes to.
+
+    The document is either `file_content` or the file at `file_path`, which is parsed in
+    place and left for the caller to remove; bytes are written to a temporary file first.
+    Its `source_format` (see document_loaders) is sniffed from the content if not given.
+
+    This is blocking work (PDF parsing, embedding, index and DB writes) and must run on a
+    worker thread, never on the event loop. If `document_id` refers to a row created by
+    `create_pending_document`, that row is updated in place. `progress`, if given, is
+    called with keyword arguments describing the current stage and counts.
     """
     db: Session = SessionLocal() # Use SessionLocal directly without 'with' for now, to ensure finally block handles close
-    document_id = str(uuid4())
     doc_metadata = None
+    is_update = False
+    temp_file_path = None
+    report = progress or (lambda **_: None)
+    writer: Optional[SegmentWriter] = None
+    num_chunks = 0
 
-    print(f"[{datetime.utcnow()}] Starting processing for document: {filename}")
+    logger.info("Starting processing for document: %s", filename)
 
     try:
-        temp_file_path = f"/tmp/{filename}"
-        with open(temp_file_path, "wb") as f:
-            f.write(file_content)
-        print(f"[{datetime.utcnow()}] Temporary file saved: {temp_file_path}")
-
-        loader = PyPDFLoader(temp_file_path)
-        pages = loader.load()
-        num_pages = len(pages) if pages else 0
-        print(f"[{datetime.utcnow()}] Loaded {num_pages} pages from {filename}")
-
-        # Create new document record in DB
-        doc_metadata = Document(
-            id=document_id,
-            filename=filename,
-            uploaded_at=datetime.utcnow(),
-            num_pages=num_pages,
-            status="processing"
-        )
-        db.add(doc_metadata)
-        print(f"[{datetime.utcnow()}] Added document metadata to session. Document ID: {document_id}")
+        content_hash = file_hash_from_path(file_path) if file_path is not None else file_hash(file_content)
+        duplicate = _find_duplicate(db, content_hash, collection, exclude_id=document_id)
+        if duplicate is not None:
+            logger.info("%s is identical to document %s; skipping ingestion.", filename, duplicate.id)
+            if document_id and document_id != duplicate.id:
+                # Drop the placeholder row queued for this upload
+                db.query(Document).filter(Document.id == document_id, Document.status == "queued").delete()
+                db.commit()
+            num_duplicate_chunks = db.query(Chunk).filter(Chunk.document_id == duplicate.id).count()
+            return {"document_id": duplicate.id, "filename": filename, "num_chunks": num_duplicate_chunks, "status": "duplicate"}
+
+        if document_id is None:
+            previous = _find_previous_version(db, filename, collection)
+            document_id = previous.id if previous is not None else str(uuid4())
+        shard = collections.get(collection).manager_for(document_id)
+        writer = shard.writer()
+
+        if file_path is None:
+            fd, temp_file_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+            with os.fdopen(fd, "wb") as f:
+                f.write(file_content)
+            file_path = temp_file_path
+            logger.debug("Temporary file saved: %s", temp_file_path)
+
+        # Create the document record in DB, or pick up the existing one (queued by the
+        # upload route, or a previous version being re-ingested)
+        doc_metadata = db.get(Document, document_id)
+        if doc_metadata is None:
+            doc_metadata = Document(
+                id=document_id,
+                filename=filename,
+                uploaded_at=datetime.utcnow(),
+                collection=collection,
+            )
+            db.add(doc_metadata)
+        is_update = db.query(Chunk.id).filter(Chunk.document_id == document_id).first() is not None
+        doc_metadata.status = "processing"
+        logger.debug("Added document metadata to session. Document ID: %s", document_id)
         db.commit() # Commit here to persist the initial 'processing' status
         db.refresh(doc_metadata)
-        print(f"[{datetime.utcnow()}] Committed initial document status to DB.")
+        logger.debug("Committed initial document status to DB.")
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        chunks: List[LangchainDocument] = []
-        for i, page in enumerate(pages):
-            cleaned_page_content = _clean_text(page.page_content)
-            cleaned_page_doc = LangchainDocument(page_content=cleaned_page_content, metadata=page.metadata)
-            page_chunks = text_splitter.split_documents([cleaned_page_doc])
-            for chunk_idx, pc in enumerate(page_chunks):
-                pc.metadata.update({
-                    "source": filename,
-                    "document_id": document_id,
-                    "chunk_index": chunk_idx,
-                    "page_number": page.metadata.get("page", i),  # fallback to index if missing
-                    "doc_title": os.path.splitext(filename)[0].replace("_", " ").title()
-                })
-                chunks.append(pc)
-        print(f"[{datetime.utcnow()}] Split document into {len(chunks)} chunks.")
+        report(stage="parsing")
+        source_format = source_format or sniff_format(file_path)
+        pages_parsed = 0
+
+        def report_parsing(**fields) -> None:
+            nonlocal pages_parsed
+            pages_parsed = fields.get("pages_parsed", pages_parsed)
+            report(**fields)
+
+        if source_format == "pdf":
+            num_pages = count_pdf_pages(file_path)
+            page_chunks = _iter_page_chunks(file_path, filename, document_id, num_pages, report_parsing)
+        else:
+            # Text is not paged in advance; the count is known once it has been read
+            num_pages = None
+            page_chunks = _iter_text_chunks(iter_pages(file_path, source_format), filename, document_id, report_parsing)
 
+        # Shared with the retriever; loaded on first use if start-up warm-up is off
+        embeddings = get_embeddings()
         if not embeddings:
             raise ValueError("Embedding model not loaded. Cannot process document.")
 
-        # Load or initialize vector store
-        try:
-            faiss_store = get_faiss_vector_store()
-            print(f"[{datetime.utcnow()}] FAISS store loaded from disk.")
-        except Exception as e:
-            print(f"[{datetime.utcnow()}] No existing FAISS store found or error: {e}. Creating new.")
-            faiss_store = FAISS.from_documents([], embeddings)
-
-        # Add new document chunks to the store
-        vector_ids = faiss_store.add_documents(chunks)
-        print(f"[{datetime.utcnow()}] Added {len(vector_ids)} chunks to FAISS store.")
-
-        # Save updated store
-        faiss_store.save_local(VECTOR_DB_DIRECTORY)
-        print(f"[{datetime.utcnow()}] FAISS store saved to {VECTOR_DB_DIRECTORY}.")
-
-        # Store chunk metadata in relational DB
-        new_chunk_records = []
-        for i, chunk in enumerate(chunks):
-            vector_id = vector_ids[i] if i < len(vector_ids) else None
-            new_chunk_records.append(Chunk(
-                id=str(uuid4()),
-                document_id=document_id,
-                chunk_text=chunk.page_content,
-                page_number=chunk.metadata.get("page_number"),
-                chunk_index=chunk.metadata.get("chunk_index"),
-                vector_id=vector_id
-            ))
-        print(f"[{datetime.utcnow()}] Prepared {len(new_chunk_records)} chunk records for bulk save.")
-        db.bulk_save_objects(new_chunk_records)
-        print(f"[{datetime.utcnow()}] Bulk saved chunk records to session.")
+        # Chunks of a previous version, keyed by content hash. Chunks whose text is
+        # unchanged keep their vectors; only new or changed text is embedded. Rows are
+        # read as plain tuples: the batch commits below would otherwise expire ORM
+        # objects and reload each one, one query per chunk.
+        previous_chunks: Dict[str, deque] = defaultdict(deque)
+        previous_rows = (
+            db.query(Chunk.id, Chunk.vector_id, Chunk.content_hash, Chunk.page_number, Chunk.chunk_index, Chunk.chunk_text)
+            .filter(Chunk.document_id == document_id)
+            .order_by(Chunk.page_number, Chunk.chunk_index)
+            .all()
+        )
+        # Rows are committed batch by batch before their segment is published. If a writer
+        # died in between, its rows point at vectors no search can find; they are dropped
+        # so their text is embedded again rather than kept as unchanged.
+        live_vector_ids = shard.live_vector_ids(row.vector_id for row in previous_rows) if previous_rows else set()
+        orphaned_ids = [row.id for row in previous_rows if row.vector_id not in live_vector_ids]
+        if orphaned_ids:
+            logger.warning("Dropping %s chunks of %s whose vectors were never published.", len(orphaned_ids), filename)
+            db.query(Chunk).filter(Chunk.id.in_(orphaned_ids)).delete(synchronize_session=False)
+            db.commit()
+            is_update = len(orphaned_ids) < len(previous_rows)
+        for chunk_id, vector_id, chunk_hash, page_number, chunk_index, chunk_text in previous_rows:
+            if vector_id in live_vector_ids:
+                previous_chunks[chunk_hash or text_hash(chunk_text)].append(
+                    _PreviousChunk(chunk_id, vector_id, chunk_hash, page_number, chunk_index)
+                )
+        if previous_chunks:
+            logger.info("Re-ingesting %s: %s chunks from the previous version.", filename, sum(map(len, previous_chunks.values())))
+        # Chunks of the previous version that are gone or were copied elsewhere; their rows
+        # and vectors are retired once the new version is complete
+        retired_chunks: List[_PreviousChunk] = []
+        num_embedded = num_kept = num_moved = 0
+
+        # Stream pages -> chunks -> fixed-size batches. Each batch is embedded, its rows are
+        # committed and its vectors published as a segment before the next one is built, so
+        # memory holds one batch whatever the size of the document.
+        report(stage="embedding")
+        for batch in _batched(page_chunks, INGEST_EMBED_BATCH_SIZE):
+            new_chunks: List[Tuple[LangchainDocument, str]] = []
+            moved_chunks: List[Tuple[_PreviousChunk, LangchainDocument, str]] = []
+            hash_updates: List[Dict] = []
+            for chunk in batch:
+                chunk_hash = text_hash(chunk.page_content)
+                pool = previous_chunks.get(chunk_hash)
+                if not pool:
+                    new_chunks.append((chunk, chunk_hash))
+                    continue
+                old_chunk = pool.popleft()
+                num_kept += 1
+                if (old_chunk.page_number, old_chunk.chunk_index) != (chunk.metadata.get("page_number"), chunk.metadata.get("chunk_index")):
+                    moved_chunks.append((old_chunk, chunk, chunk_hash))
+                elif old_chunk.content_hash != chunk_hash:
+                    hash_updates.append({"id": old_chunk.id, "content_hash": chunk_hash})
+
+            # Segments are immutable, so an unchanged chunk that moved to another page or
+            # position gets a copy of its stored vector with the new metadata, and its old
+            # row and vector are retired; nothing is re-embedded. A vector deleted meanwhile
+            # is embedded again.
+            stored_vectors = shard.get_vectors(old_chunk.vector_id for old_chunk, _, _ in moved_chunks)
+            copied_chunks: List[Tuple[LangchainDocument, str]] = []
+            copied_vectors: List = []
+            for old_chunk, chunk, chunk_hash in moved_chunks:
+                if old_chunk.vector_id in stored_vectors:
+                    copied_chunks.append((chunk, chunk_hash))
+                    copied_vectors.append(stored_vectors[old_chunk.vector_id])
+                else:
+                    new_chunks.append((chunk, chunk_hash))
+                retired_chunks.append(old_chunk)
+            num_moved += len(moved_chunks)
+
+            vectors: List = []
+            if new_chunks:
+                with span("embed"):
+                    vectors = embeddings.embed_documents([chunk.page_content for chunk, _ in new_chunks])
+                num_embedded += len(new_chunks)
+                report(chunks_embedded=num_embedded)
+            added_chunks = new_chunks + copied_chunks
+            vectors = list(vectors) + copied_vectors
+
+            with span("persist"):
+                if added_chunks:
+                    batch_vector_ids = writer.add_embeddings(
+                        [chunk.page_content for chunk, _ in added_chunks], vectors, [chunk.metadata for chunk, _ in added_chunks]
+                    )
+                    db.bulk_save_objects([
+                        Chunk(
+                            id=str(uuid4()),
+                            document_id=document_id,
+                            chunk_text=chunk.page_content,
+                            page_number=chunk.metadata.get("page_number"),
+                            chunk_index=chunk.metadata.get("chunk_index"),
+                            vector_id=vector_id,
+                            content_hash=chunk_hash
+                        )
+                        for (chunk, chunk_hash), vector_id in zip(added_chunks, batch_vector_ids)
+                    ])
+                if hash_updates:
+                    db.bulk_update_mappings(Chunk, hash_updates)
+                db.commit()
+                # Published only after its rows are committed (see the orphaned rows above)
+                if added_chunks:
+                    writer.flush()
+            num_chunks += len(batch)
+            report(chunks_persisted=num_chunks)
+        num_pages = num_pages if num_pages is not None else pages_parsed
+        logger.info("Embedded and saved %s new chunks from %s pages (%s).", num_embedded, num_pages, source_format)
+
+        # Retire chunks of the previous version that no longer exist
+        retired_chunks.extend(old_chunk for pool in previous_chunks.values() for old_chunk in pool)
+        retired_vector_ids = [old_chunk.vector_id for old_chunk in retired_chunks]
+        if retired_chunks:
+            db.query(Chunk).filter(Chunk.id.in_([old_chunk.id for old_chunk in retired_chunks])).delete(synchronize_session=False)
+        if previous_chunks:
+            logger.info("Kept %s unchanged chunks (%s moved), retired %s.", num_kept, num_moved, len(retired_chunks) - num_moved)
+
+        # Tombstone the retired vectors in one manifest update, so the previous version
+        # leaves the index all at once
+        report(stage="persisting", chunks_total=num_chunks)
+        with span("persist"):
+            writer.commit(tombstones=retired_vector_ids)
+        logger.info("FAISS segment(s) published to %s.", shard.directory)
 
         # Update document status to completed
         doc_metadata.status = "completed"
-        print(f"[{datetime.utcnow()}] Updating document status to 'completed'.")
+        doc_metadata.num_pages = num_pages
+        doc_metadata.content_hash = content_hash
+        doc_metadata.updated_at = datetime.utcnow()
+        logger.debug("Updating document status to 'completed'.")
         db.commit()
-        print(f"[{datetime.utcnow()}] Final DB commit successful.")
+        logger.debug("Final DB commit successful.")
+        # The new chunk rows are committed only now, after the index generation moved
+        filter_cache.invalidate()
 
-        return {"document_id": document_id, "filename": filename, "num_chunks": len(chunks), "status": "completed"}
+        return {"document_id": document_id, "filename": filename, "num_chunks": num_chunks, "status": "completed"}
 
     except exc.IntegrityError as e:
         db.rollback()
-        print(f"[{datetime.utcnow()}] Database IntegrityError: {e}")
+        logger.error("Database IntegrityError: %s", e)
+        _discard_partial_ingestion(db, document_id, writer)
         if doc_metadata:
-            doc_metadata.status = "failed"
+            # A failed re-ingestion leaves the previous version's chunks in place and searchable
+            doc_metadata.status = "completed" if is_update else "failed"
             db.commit() # Attempt to save failure status
         raise ValueError(f"Document with ID {document_id} already exists or similar DB error.") from e
     except Exception as e:
         db.rollback()
-        print(f"[{datetime.utcnow()}] Critical Error processing document {filename}: {e}", flush=True)
+        logger.error("Critical Error processing document %s: %s", filename, e)
+        _discard_partial_ingestion(db, document_id, writer)
         if doc_metadata:
-            doc_metadata.status = "failed"
+            # A failed re-ingestion leaves the previous version's chunks in place and searchable
+            doc_metadata.status = "completed" if is_update else "failed"
             db.commit() # Attempt to save failure status
         raise RuntimeError(f"Failed to process document {filename}: {e}")
     finally:
         if db.is_active: # Check if the session is still active before closing
              db.close()
-        print(f"[{datetime.utcnow()}] DB session closed.")
-        if os.path.exists(temp_file_path):
+        logger.debug("DB session closed.")
+        if temp_file_path and os.path.exists(temp_file_path):
             os.remove(temp_file_path)
-            print(f"[{datetime.utcnow()}] Temporary file removed: {temp_file_path}")
+            logger.debug("Temporary file removed: %s", temp_file_path)
+
+
+async def process_document(file_content: bytes, filename: str) -> Dict:
+    """
+    Async entry point kept for callers that want to await a single ingestion.
+    The blocking work runs on a worker thread so the event loop stays responsive.
+    """
+    return await asyncio.to_thread(ingest_document, file_content, filename)
@@ -0,0 +1,366 @@
+# app/services/jobs.py
+
+import fcntl
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy.orm import Session
+
+from app.models.metadata import IngestJobRecord, SessionLocal
+from app.services.document_loaders import UploadTooLargeError, split_page_records
+from app.services.ingest import FILE_CHUNK_BYTES, VECTOR_DB_DIRECTORY, ingest_document, plan_ingestion, set_document_status
+from app.services.sharding import DEFAULT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "2"))
+INGEST_MAX_TRACKED_JOBS = int(os.getenv("INGEST_MAX_TRACKED_JOBS", "1000"))
+# Uploads wait here for the ingest writer; must be shared by all workers of the app
+INGEST_SPOOL_DIRECTORY = os.getenv("INGEST_SPOOL_DIRECTORY", os.path.join(VECTOR_DB_DIRECTORY, "spool"))
+# How often a worker checks for queued jobs (as the writer) or for a vacant writer lock
+INGEST_POLL_INTERVAL_SECONDS = float(os.getenv("INGEST_POLL_INTERVAL_SECONDS", "1.0"))
+# Progress counters are written to the database at most this often per job
+INGEST_PROGRESS_INTERVAL_SECONDS = float(os.getenv("INGEST_PROGRESS_INTERVAL_SECONDS", "0.5"))
+
+WRITER_LOCK_FILENAME = "WRITER.lock"
+FINISHED_STATUSES = ("completed", "failed", "duplicate")
+JOB_FIELDS = (
+    "document_id", "filename", "collection", "status", "stage", "pages_parsed", "chunks_total", "chunks_embedded",
+    "chunks_persisted", "detail", "spool_path", "source_format", "created_at", "started_at", "finished_at",
+)
+
+
+class IngestJob:
+    """
+    Tracks one uploaded file from the moment it is queued until ingestion finishes.
+    The `ingest_jobs` row is the source of truth, so any worker can report on a job
+    that another worker runs.
+    """
+
+    def __init__(self, record: IngestJobRecord):
+        self.id = record.id
+        for name in JOB_FIELDS:
+            setattr(self, name, getattr(record, name))
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    def update(self, **fields) -> None:
+        """
+        Progress callback handed to `ingest_document`. Status changes are saved at once,
+        progress counters at most every INGEST_PROGRESS_INTERVAL_SECONDS.
+        """
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            if "status" not in fields and time.monotonic() - self._saved_at < INGEST_PROGRESS_INTERVAL_SECONDS:
+                return
+            self._saved_at = time.monotonic()
+            values = {name: getattr(self, name) for name in JOB_FIELDS}
+        db: Session = SessionLocal()
+        try:
+            db.query(IngestJobRecord).filter(IngestJobRecord.id == self.id).update(values)
+            db.commit()
+        finally:
+            db.close()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "document_id": self.document_id,
+                "filename": self.filename,
+                "collection": self.collection,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": {
+                    "pages_parsed": self.pages_parsed or 0,
+                    "chunks_total": self.chunks_total,
+                    "chunks_embedded": self.chunks_embedded or 0,
+                    "chunks_persisted": self.chunks_persisted or 0,
+                },
+                "detail": self.detail,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class IngestJobQueue:
+    """
+    Runs document ingestion in the background so uploads return immediately and the
+    event loop never blocks on parsing, embedding or index writes.
+
+    Jobs are rows in `ingest_jobs` and uploaded bytes wait in a spool directory, so
+    when the app runs as several worker processes any of them can accept an upload or
+    report on a job, while exactly one of them - the writer, which holds an exclusive
+    lock file next to the index - runs the jobs on its thread pool. Other workers only
+    read the index and pick up what the writer published on their next query. If the
+    writer exits, another worker takes the lock within a poll interval and resumes the
+    jobs it left unfinished.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = INGEST_MAX_WORKERS,
+        max_tracked_jobs: int = INGEST_MAX_TRACKED_JOBS,
+        spool_directory: str = INGEST_SPOOL_DIRECTORY,
+        lock_directory: str = VECTOR_DB_DIRECTORY,
+    ):
+        self._max_workers = max_workers
+        self._max_tracked_jobs = max_tracked_jobs
+        self._spool_directory = spool_directory
+        self._lock_path = os.path.join(lock_directory, WRITER_LOCK_FILENAME)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock_file = None
+        self._running: Dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._dispatcher: Optional[threading.Thread] = None
+
+    @property
+    def is_writer(self) -> bool:
+        return self._lock_file is not None
+
+    def start(self) -> None:
+        """
+        Starts competing for the writer role. Call it in each worker process after the
+        fork (the app's startup event); `submit` also starts it on first use.
+        """
+        with self._lock:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            self._stopped.clear()
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="ingest-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+    def spool(self, source: BinaryIO, max_bytes: Optional[int] = None) -> Tuple[str, str]:
+        """
+        Copies `source` into a new spool file a chunk at a time, hashing it on the way, and
+        returns `(spool_path, content_hash)`. Raises UploadTooLargeError as soon as more
+        than `max_bytes` have been read, without reading the rest.
+        """
+        os.makedirs(self._spool_directory, exist_ok=True)
+        fd, spool_path = tempfile.mkstemp(prefix="upload-", dir=self._spool_directory)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for block in iter(lambda: source.read(FILE_CHUNK_BYTES), b""):
+                    size += len(block)
+                    if max_bytes is not None and size > max_bytes:
+                        raise UploadTooLargeError(f"File exceeds the maximum size of {max_bytes / (1024 * 1024):.1f} MB.")
+                    digest.update(block)
+                    f.write(block)
+        except BaseException:
+            os.remove(spool_path)
+            raise
+        return spool_path, digest.hexdigest()
+
+    def spool_records(self, source: BinaryIO, max_bytes: Optional[int] = None) -> Dict[str, Tuple[str, str]]:
+        """
+        Spools a JSONL stream of pre-extracted pages as one 'pages' file per document;
+        returns `{doc: (spool_path, content_hash)}` (see `split_page_records`).
+        """
+        return split_page_records(source, self._spool_directory, max_bytes)
+
+    def submit(self, file_content: bytes, filename: str, collection: str = DEFAULT_COLLECTION) -> IngestJob:
+        """Spools `file_content` and submits it; see `submit_spooled`."""
+        spool_path, content_hash = self.spool(io.BytesIO(file_content))
+        return self.submit_spooled(spool_path, content_hash, filename, collection)
+
+    def submit_spooled(
+        self,
+        spool_path: str,
+        content_hash: str,
+        filename: str,
+        collection: str = DEFAULT_COLLECTION,
+        source_format: Optional[str] = None,
+    ) -> IngestJob:
+        """
+        Records the document as queued for the writer, which ingests straight from
+        `spool_path` (a file from `spool` or `spool_records`) and then removes it; its
+        format is sniffed from the content unless `source_format` is given. Files
+        identical to an existing document of the collection are not queued; their job is
+        returned already finished with status 'duplicate' and the existing document's ID.
+        """
+        try:
+            plan = plan_ingestion(filename, content_hash, collection)
+            record = IngestJobRecord(id=str(uuid4()), document_id=plan["document_id"], filename=filename, collection=collection,
+                                     status="queued", pages_parsed=0, chunks_embedded=0, chunks_persisted=0, created_at=datetime.utcnow())
+            if plan["action"] == "duplicate":
+                record.status = "duplicate"
+                record.detail = f"Identical to existing document {plan['document_id']}."
+                record.finished_at = datetime.utcnow()
+            else:
+                record.spool_path = spool_path
+                record.source_format = source_format
+
+            db: Session = SessionLocal()
+            try:
+                db.add(record)
+                db.commit()
+                job = IngestJob(record)
+            finally:
+                db.close()
+        except BaseException:
+            os.remove(spool_path)
+            raise
+
+        if plan["action"] == "duplicate":
+            os.remove(spool_path)
+            logger.info("%s duplicates document %s; not queued.", filename, job.document_id)
+            return job
+        logger.info("Queued ingestion job %s for %s (document %s, %s).", job.id, filename, job.document_id, plan["action"])
+        self.start()
+        self._wake.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            job = self._running.get(job_id)
+        if job is not None:
+            return job
+        db: Session = SessionLocal()
+        try:
+            record = db.get(IngestJobRecord, job_id)
+            return IngestJob(record) if record is not None else None
+        finally:
+            db.close()
+
+    def _try_become_writer(self) -> bool:
+        os.makedirs(os.path.dirname(self._lock_path) or ".", exist_ok=True)
+        lock_file = open(self._lock_path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="ingest")
+        # Jobs a previous writer was running when it exited start over
+        db: Session = SessionLocal()
+        try:
+            resumed = (
+                db.query(IngestJobRecord)
+                .filter(IngestJobRecord.status == "processing")
+                .update({"status": "queued", "stage": None}, synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+        logger.info("Process %d is the ingest writer%s.", os.getpid(), f"; resuming {resumed} job(s)" if resumed else "")
+        return True
+
+    def _dispatch_loop(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                if self.is_writer or self._try_become_writer():
+                    for job in self._claim_queued():
+                        self._executor.submit(self._run, job)
+            except Exception as e:
+                logger.error("Ingest dispatcher error: %s", e)
+            self._wake.wait(INGEST_POLL_INTERVAL_SECONDS)
+            self._wake.clear()
+
+    def _claim_queued(self) -> List[IngestJob]:
+        """Marks as many queued jobs as there are idle ingest threads 'processing', oldest first."""
+        with self._lock:
+            capacity = self._max_workers - len(self._running)
+        if capacity <= 0:
+            return []
+        db: Session = SessionLocal()
+        try:
+            records = (
+                db.query(IngestJobRecord)
+                .filter(IngestJobRecord.status == "queued")
+                .order_by(IngestJobRecord.created_at)
+                .limit(capacity)
+                .all()
+            )
+            claimed = []
+            for record in records:
+                started_at = datetime.utcnow()
+                updated = (
+                    db.query(IngestJobRecord)
+                    .filter(IngestJobRecord.id == record.id, IngestJobRecord.status == "queued")
+                    .update({"status": "processing", "started_at": started_at}, synchronize_session=False)
+                )
+                db.commit()
+                if updated:
+                    db.refresh(record)
+                    claimed.append(IngestJob(record))
+        finally:
+            db.close()
+        with self._lock:
+            self._running.update((job.id, job) for job in claimed)
+        return claimed
+
+    def _run(self, job: IngestJob) -> None:
+        spool_path = job.spool_path
+        try:
+            set_document_status(job.document_id, "processing")
+            result = ingest_document(None, job.filename, document_id=job.document_id, progress=job.update,
+                                     collection=job.collection or DEFAULT_COLLECTION, file_path=spool_path,
+                                     source_format=job.source_format)
+            job.update(
+                status=result.get("status", "completed"),
+                document_id=result.get("document_id", job.document_id),
+                stage=None,
+                spool_path=None,
+                finished_at=datetime.utcnow(),
+            )
+        except Exception as e:
+            logger.error("Ingestion job %s failed: %s", job.id, e)
+            job.update(status="failed", detail=str(e), spool_path=None, finished_at=datetime.utcnow())
+            try:
+                set_document_status(job.document_id, "failed", only_if="processing")
+            except Exception as status_error:
+                logger.error("Could not mark document %s as failed: %s", job.document_id, status_error)
+        finally:
+            with self._lock:
+                if spool_path and os.path.exists(spool_path):
+                    os.remove(spool_path)
+                self._running.pop(job.id, None)
+            self._evict_finished()
+            self._wake.set()
+
+    def _evict_finished(self) -> None:
+        # Forget the oldest finished jobs once too many are tracked; unfinished jobs are kept.
+        db: Session = SessionLocal()
+        try:
+            finished = db.query(IngestJobRecord.id).filter(IngestJobRecord.status.in_(FINISHED_STATUSES))
+            excess = finished.count() - self._max_tracked_jobs
+            if excess > 0:
+                stale = [row.id for row in finished.order_by(IngestJobRecord.created_at).limit(excess)]
+                db.query(IngestJobRecord).filter(IngestJobRecord.id.in_(stale)).delete(synchronize_session=False)
+                db.commit()
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            running = len(self._running)
+        return {"pid": os.getpid(), "ingest_writer": self.is_writer, "running_jobs": running}
+
+    def shutdown(self) -> None:
+        # Jobs that have not started stay queued in the table for the next writer. The
+        # writer lock is held until the process exits, so a job still running here is
+        # not resumed elsewhere at the same time.
+        self._stopped.set()
+        self._wake.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+ingest_queue = IngestJobQueue()
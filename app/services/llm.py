@@ -1,57 +1,75 @@
 #/app/services/llm.py
 
+import asyncio
+import logging
 import os
-from typing import List
+import time
+from typing import AsyncIterator, List, Optional
 from langchain_core.documents import Document as LangchainDocument
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.rate_limiters import InMemoryRateLimiter
 from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI # Assuming using Gemini
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
+from app.services.answer_cache import get_answer_cache
+from app.services.context_builder import build_context, PackedContext
+from app.services.llm_gate import llm_gate, LLMQueueTimeout, LLM_MAX_CONCURRENCY
+from app.services.metrics import observe, span
+from app.services.model_registry import get_chat_model
+
+logger = logging.getLogger(__name__)
 
 # Configure LLM provider
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
-print(f"[LLM] Using provider: {LLM_PROVIDER}")
+# LLM_PROVIDER=fake: canned answer streamed character by character, for offline tests and benchmarks
+FAKE_LLM_RESPONSE = os.getenv("FAKE_LLM_RESPONSE", "This is an offline answer from the fake LLM provider.")
+FAKE_LLM_TOKEN_DELAY = float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0"))  # seconds between streamed tokens
+# Token bucket in front of the provider; 0 means no request-rate limit (concurrency is still capped)
+LLM_REQUESTS_PER_SECOND = float(os.getenv("LLM_REQUESTS_PER_SECOND", "0"))
+logger.info("Using LLM provider: %s", LLM_PROVIDER)
 
 # Initialize LLM based on provider
 def get_llm():
     """
     Initializes and returns the appropriate LLM client based on the LLM_PROVIDER
-    environment variable. Supports OpenAI and Gemini.
+    environment variable. Supports OpenAI, Gemini and a local fake model. Only the
+    configured provider's client library is imported.
     """
+    rate_limiter = None
+    if LLM_REQUESTS_PER_SECOND > 0:
+        rate_limiter = InMemoryRateLimiter(
+            requests_per_second=LLM_REQUESTS_PER_SECOND,
+            check_every_n_seconds=0.05,
+            max_bucket_size=LLM_MAX_CONCURRENCY,
+        )
     if LLM_PROVIDER == "openai":
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable not set.")
+        from langchain_openai import ChatOpenAI
         # Using gpt-3.5-turbo as a default model for OpenAI
-        return ChatOpenAI(model="gpt-3.5-turbo", api_key=api_key, temperature=0.0)
+        return ChatOpenAI(model="gpt-3.5-turbo", api_key=api_key, temperature=0.0, rate_limiter=rate_limiter)
     elif LLM_PROVIDER == "gemini":
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY environment variable not set.")
+        from langchain_google_genai import ChatGoogleGenerativeAI
         # Using gemini-1.5-flash as a default model for Gemini
-        return ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=api_key, temperature=0.0)
+        return ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=api_key, temperature=0.0, rate_limiter=rate_limiter)
+    elif LLM_PROVIDER == "fake":
+        # No network or API key: answers with FAKE_LLM_RESPONSE, streamed one character at a time
+        return FakeListChatModel(responses=[FAKE_LLM_RESPONSE], sleep=FAKE_LLM_TOKEN_DELAY or None, rate_limiter=rate_limiter)
     else:
-        raise ValueError(f"Unsupported LLM provider: {LLM_PROVIDER}. Please set LLM_PROVIDER to 'openai' or 'gemini'.")
-
-# Initialize LLM instance globally when the module is imported.
-# This ensures the LLM is ready for use across the application.
-try:
-    llm = get_llm()
-except Exception as e:
-    # If LLM initialization fails (e.g., missing API key, network issues),
-    # set llm to None and print an error. The application should handle this gracefully.
-    print(f"LLM initialization error: {e}")
-    llm = None # Handle this gracefully
-
-async def generate_response(query_text: str, retrieved_chunks: List[LangchainDocument]) -> str:
-    if not llm:
-        print("LLM service is not available during generate_response. Returning fallback message.")
-        return "LLM service is not available. Please check configuration and API keys."
+        raise ValueError(f"Unsupported LLM provider: {LLM_PROVIDER}. Please set LLM_PROVIDER to 'openai', 'gemini' or 'fake'.")
+
+# The LLM client is created once, on first use or by the start-up warm-up
+# (see model_registry); it is None if initialization failed, e.g. a missing API key.
 
-    # Group chunks by document_id (or source)
+def build_rag_chain(context: PackedContext, llm):
+    """Builds the prompt -> LLM -> string chain over the packed context; input is the question."""
+    # Group passages by document_id (or source)
     grouped_context: dict[str, List[str]] = {}
-    for doc in retrieved_chunks:
+    for doc in context.passages:
         doc_id = doc.metadata.get("document_id", doc.metadata.get("source", "unknown"))
         doc_title = doc.metadata.get("source", f"Document {doc_id}")
         if doc_title not in grouped_context:
@@ -76,16 +94,94 @@ Question: {question}
 Answer:"""
     )
 
-    rag_chain = (
+    return (
         {"context": lambda x: formatted_context, "question": RunnablePassthrough()}
         | prompt_template
         | llm
         | StrOutputParser()
     )
 
+async def generate_response(
+    query_text: str,
+    retrieved_chunks: List[LangchainDocument],
+    cache_scope: str = "",
+    context: Optional[PackedContext] = None,
+) -> str:
+    """`context` is the already packed `retrieved_chunks`, if the caller built it."""
+    llm = get_chat_model()
+    if not llm:
+        logger.warning("LLM service is not available during generate_response. Returning fallback message.")
+        return "LLM service is not available. Please check configuration and API keys."
+
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        cached = await answer_cache.aget(query_text, retrieved_chunks, cache_scope)
+        if cached is not None:
+            logger.debug("Answer served from the %s answer cache.", cached[1])
+            return cached[0]
+
+    # Neighbouring chunks are merged without their overlap and packed into the token budget
+    if context is None:
+        with span("prompt_build"):
+            context = build_context(retrieved_chunks)
+    rag_chain = build_rag_chain(context, llm)
+
+    async def call() -> str:
+        with span("llm_total"):
+            return await rag_chain.ainvoke(query_text)
+
     try:
-        response = rag_chain.invoke(query_text)
+        # Async call: the event loop keeps serving other requests while the LLM responds.
+        # The gate caps concurrent calls and retries transient failures.
+        response = await llm_gate.run(call)
+        if answer_cache is not None:
+            await answer_cache.aput(query_text, retrieved_chunks, response, cache_scope)
         return response
+    except LLMQueueTimeout:
+        raise
     except Exception as e:
-        print(f"Error calling LLM API: {e}")
-        return "An error occurred while generating the response."
\ No newline at end of file
+        logger.error("Error calling LLM API: %s", e)
+        return "An error occurred while generating the response."
+
+async def stream_response(
+    query_text: str,
+    retrieved_chunks: List[LangchainDocument],
+    context: Optional[PackedContext] = None,
+) -> AsyncIterator[str]:
+    """
+    Yields the answer as the LLM produces it. Unlike `generate_response`, errors are
+    raised to the caller, which has already started sending the response. The LLM slot
+    is held until the stream ends; a failure is retried only if no token was sent yet.
+    `context` is the already packed `retrieved_chunks`, if the caller built it.
+    """
+    llm = get_chat_model()
+    if not llm:
+        raise ValueError("LLM service is not available. Please check configuration and API keys.")
+
+    if context is None:
+        with span("prompt_build"):
+            context = build_context(retrieved_chunks)
+    rag_chain = build_rag_chain(context, llm)
+    async with llm_gate.slot():
+        started = time.perf_counter()
+        for attempt in range(llm_gate.max_retries + 1):
+            streamed = False
+            try:
+                async for token in rag_chain.astream(query_text):
+                    if token:
+                        if not streamed:
+                            observe("llm_ttft", time.perf_counter() - started)
+                        streamed = True
+                        yield token
+                observe("llm_total", time.perf_counter() - started)
+                return
+            except ValueError:
+                raise
+            except Exception as e:
+                if streamed or attempt == llm_gate.max_retries:
+                    llm_gate.failures += 1
+                    raise
+                llm_gate.retries += 1
+                delay = llm_gate.backoff_seconds(attempt)
+                logger.warning("Streaming call failed before the first token (%s); retrying in %.2fs.", e, delay)
+                await asyncio.sleep(delay)
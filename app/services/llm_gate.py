@@ -0,0 +1,164 @@
+# app/services/llm_gate.py
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.services.metrics import observe
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# How long a request may wait for a free LLM slot before it is rejected with 503
+LLM_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("LLM_MAX_QUEUE_WAIT_SECONDS", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "0.5"))
+
+
+class LLMQueueTimeout(Exception):
+    """Raised when no LLM slot frees up within the maximum queue wait."""
+
+
+class LLMGate:
+    """
+    Caps concurrent LLM calls across the process. Callers wait for a slot at most
+    `max_queue_wait` seconds and are then rejected, so a burst fails fast instead of
+    piling up behind a slow or rate-limited provider. Failed calls are retried with
+    exponential backoff and jitter.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue_wait: float = LLM_MAX_QUEUE_WAIT_SECONDS,
+        max_retries: int = LLM_MAX_RETRIES,
+        retry_backoff: float = LLM_RETRY_BACKOFF_SECONDS,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue_wait = max_queue_wait
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        # asyncio.Semaphore binds to the loop it is first used on, so keep one per loop
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.calls = 0
+        self.rejected = 0
+        self.retries = 0
+        self.failures = 0
+        self._total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for stale in [other for other in self._semaphores if other.is_closed()]:
+                del self._semaphores[stale]
+            if loop not in self._semaphores:
+                self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+            return self._semaphores[loop]
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds one LLM slot for the duration of the block (e.g. a whole streamed answer)."""
+        semaphore = self._semaphore()
+        started = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise LLMQueueTimeout(f"No LLM capacity within {self.max_queue_wait:.1f}s; try again shortly.")
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        observe("llm_queue_wait", waited)
+        self.calls += 1
+        self._total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+
+    def backoff_seconds(self, attempt: int) -> float:
+        return self.retry_backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def run(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Awaits `call()` inside a slot, retrying failures (except configuration errors)."""
+        async with self.slot():
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return await call()
+                except ValueError:
+                    raise
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self.failures += 1
+                        raise
+                    self.retries += 1
+                    delay = self.backoff_seconds(attempt)
+                    logger.warning("LLM call failed (%s); retry %s/%s in %.2fs.", e, attempt + 1, self.max_retries, delay)
+                    await asyncio.sleep(delay)
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue_wait_seconds": self.max_queue_wait,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "failures": self.failures,
+            "avg_queue_wait_ms": (self._total_wait_seconds / self.calls * 1000) if self.calls else None,
+            "max_queue_wait_ms": self.max_wait_seconds * 1000,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the work and
+    everyone who arrives while it is running awaits the same result (or exception).
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is None or future.get_loop() is not asyncio.get_running_loop():
+            future = asyncio.ensure_future(work())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        # Shielded so one caller disconnecting does not cancel the work the others await
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, done: asyncio.Future) -> None:
+        if self._in_flight.get(key) is done:
+            del self._in_flight[key]
+        if not done.cancelled():
+            done.exception()  # mark as retrieved even if every caller went away
+
+    def stats(self) -> Dict:
+        return {"in_flight": len(self._in_flight), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+llm_gate = LLMGate()
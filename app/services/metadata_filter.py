@@ -0,0 +1,140 @@
+# app/services/metadata_filter.py
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.models.metadata import SessionLocal, Document, Chunk
+from app.services.sharding import DEFAULT_COLLECTION, CollectionRegistry, ShardedAllowList
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+FILTER_CACHE_MAX_ENTRIES = int(os.getenv("FILTER_CACHE_MAX_ENTRIES", "256"))
+# Bounds how long another process's ingestion can go unseen by a cached filter
+FILTER_CACHE_TTL_SECONDS = float(os.getenv("FILTER_CACHE_TTL_SECONDS", "60"))
+
+# Filter fields; all are optional and combined with AND
+FILTER_FIELDS = ("document_ids", "sources", "page_from", "page_to", "uploaded_after", "uploaded_before")
+
+
+def filter_key(filters: Optional[Dict]) -> Optional[str]:
+    """Canonical form of a filter, or None if it filters nothing."""
+    filters = {field: filters[field] for field in FILTER_FIELDS if filters and filters.get(field) is not None}
+    if not filters:
+        return None
+    return json.dumps(filters, sort_keys=True, default=str)
+
+
+def _naive_utc(value: datetime) -> datetime:
+    # uploaded_at is stored as naive UTC
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def in_collection(name: str):
+    """SQL condition for documents of a collection; rows from before collections existed belong to the default one."""
+    if name == DEFAULT_COLLECTION:
+        return or_(Document.collection == name, Document.collection.is_(None))
+    return Document.collection == name
+
+
+def matching_vector_ids(db: Session, filters: Dict, collection: str = DEFAULT_COLLECTION) -> List[str]:
+    """Vector IDs of the chunks of `collection` whose row (or document's row) matches the filter."""
+    query = (
+        db.query(Chunk.vector_id)
+        .join(Document, Chunk.document_id == Document.id)
+        .filter(Chunk.vector_id.isnot(None), in_collection(collection))
+    )
+    if filters.get("document_ids") is not None:
+        query = query.filter(Chunk.document_id.in_(filters["document_ids"]))
+    if filters.get("sources") is not None:
+        query = query.filter(Document.filename.in_(filters["sources"]))
+    if filters.get("page_from") is not None:
+        query = query.filter(Chunk.page_number >= filters["page_from"])
+    if filters.get("page_to") is not None:
+        query = query.filter(Chunk.page_number <= filters["page_to"])
+    if filters.get("uploaded_after") is not None:
+        query = query.filter(Document.uploaded_at >= _naive_utc(filters["uploaded_after"]))
+    if filters.get("uploaded_before") is not None:
+        query = query.filter(Document.uploaded_at <= _naive_utc(filters["uploaded_before"]))
+    return [vector_id for (vector_id,) in query]
+
+
+class _Entry:
+    def __init__(self, allow: ShardedAllowList):
+        self.allow = allow
+        self.created_at = time.monotonic()
+
+
+class FilterCache:
+    """
+    Caches the allow-list of each metadata filter per collection, so a repeated filter
+    costs neither the database query nor resolving vector IDs to segment positions. An
+    entry is rebuilt when the collection publishes a new generation, when this process
+    finishes an ingestion (`invalidate`), or after `ttl_seconds`.
+    """
+
+    def __init__(self, collections: CollectionRegistry, max_entries: int = FILTER_CACHE_MAX_ENTRIES, ttl_seconds: float = FILTER_CACHE_TTL_SECONDS):
+        self.collections = collections
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def allow_list(self, filters: Dict, collection: Optional[str] = None) -> ShardedAllowList:
+        """Returns the allow-list for `filters` in `collection` (blocking: may query the database)."""
+        index = self.collections.get(collection)
+        key = f"{index.name}:{filter_key(filters)}"
+        generation = index.generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.allow.generation == generation and time.monotonic() - entry.created_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.allow
+            self.misses += 1
+
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            vector_ids = matching_vector_ids(db, filters, index.name)
+        finally:
+            db.close()
+        allow = index.allow_list(vector_ids)
+        logger.debug("Filter %s matches %s chunks (built in %.1fms).", key, len(allow), (time.perf_counter() - started) * 1000)
+        with self._lock:
+            self._entries[key] = _Entry(allow)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return allow
+
+    def invalidate(self) -> None:
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else None,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,118 @@
+# app/services/metrics.py
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, Optional
+
+from prometheus_client import CollectorRegistry, Histogram, generate_latest, multiprocess
+
+# Configuration
+# Adds a Server-Timing header with the stage timings of each request
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+# Pipeline stages that are timed; one histogram series per stage
+QUERY_STAGES = ("index_load", "filter_resolve", "query_embed", "vector_search", "lexical_search",
+                "prompt_build", "llm_queue_wait", "llm_ttft", "llm_total")
+INGEST_STAGES = ("pdf_parse", "text_parse", "chunk", "embed", "persist")
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds",
+    "Time spent in each stage of the query and ingestion pipelines.",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+# Query micro-batching (retriever.QueryBatcher): queries per batch, and how long each
+# query waited for its batch to close
+QUERY_BATCH_SIZE = Histogram(
+    "rag_query_batch_size",
+    "Queries embedded and searched together in one micro-batch.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+QUERY_BATCH_WAIT_SECONDS = Histogram(
+    "rag_query_batch_wait_seconds",
+    "Time a query waited for its micro-batch to close.",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+# Stage timings of the HTTP request being served; None outside a request
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request() -> Dict[str, float]:
+    """Starts collecting stage timings for the current request and returns them."""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[Dict[str, float]]:
+    return _request_timings.get()
+
+
+def observe(stage: str, seconds: float, requests: Optional[Iterable[Optional[Dict[str, float]]]] = None) -> None:
+    """
+    Records one observation of `stage` and adds its duration to the timings of the
+    current request, or to each of `requests` when the work was shared between
+    several requests (a micro-batch is observed once but charged to every member).
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    targets = (current_timings(),) if requests is None else requests
+    # A request with several queries in the batch (POST /query/batch) is charged once
+    for timings in {id(timings): timings for timings in targets if timings is not None}.values():
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str, requests: Optional[Iterable[Optional[Dict[str, float]]]] = None) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, requests)
+
+
+def histogram_summary(histogram: Histogram, scale: float = 1.0) -> Dict:
+    """
+    Per-bucket counts (not cumulative), count, sum and mean of an unlabelled histogram,
+    as observed by this process. Values and bounds are multiplied by `scale`, e.g. 1000
+    to report seconds as milliseconds.
+    """
+    buckets: Dict[str, int] = {}
+    count, total = 0, 0.0
+    below = 0.0
+    previous_bound = None
+    for sample in histogram.collect()[0].samples:
+        if sample.name.endswith("_bucket"):
+            bound = float(sample.labels["le"])
+            label = f"<={bound * scale:g}" if bound != float("inf") else f">{previous_bound * scale:g}"
+            buckets[label] = int(sample.value - below)
+            below, previous_bound = sample.value, bound
+        elif sample.name.endswith("_count"):
+            count = int(sample.value)
+        elif sample.name.endswith("_sum"):
+            total = sample.value * scale
+    return {"buckets": buckets, "count": count, "sum": total, "mean": (total / count) if count else None}
+
+
+def server_timing(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Formats stage timings as a Server-Timing header value (durations in milliseconds)."""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def latest_metrics() -> bytes:
+    """
+    The Prometheus exposition text. When the app runs as several worker processes,
+    PROMETHEUS_MULTIPROC_DIR must point to a directory they share; the counters of all
+    workers are then aggregated, whichever worker serves the scrape.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
@@ -0,0 +1,140 @@
+# app/services/model_registry.py
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from app.services.embedding_cache import with_embedding_cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+# Load the models while the app starts instead of on the first request that needs them
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() in ("1", "true", "yes")
+
+
+class LazyModel:
+    """
+    A model built by `factory` on first use and shared by the whole process. A failed
+    build is remembered (the model stays None) so every request does not retry it.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self._factory = factory
+        self._model: Any = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def get(self) -> Any:
+        if self._loaded:
+            return self._model
+        with self._lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                try:
+                    self._model = self._factory()
+                except Exception as e:
+                    self.error = str(e)
+                    logger.error("Error loading %s: %s", self.name, e)
+                self.load_seconds = time.perf_counter() - started
+                self._loaded = True
+                if self.error is None:
+                    logger.info("Loaded %s in %.2fs.", self.name, self.load_seconds)
+        return self._model
+
+    def set(self, model: Any) -> None:
+        """Replaces the model, e.g. with an offline stand-in for tests and benchmarks."""
+        with self._lock:
+            self._model = model
+            self._loaded = True
+            self.error = None
+
+    def stats(self) -> Dict:
+        return {
+            "loaded": self._loaded and self._model is not None,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+def _load_embeddings() -> Embeddings:
+    # Imported here: sentence-transformers pulls in torch, which dominates start-up time
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    return with_embedding_cache(HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME), EMBEDDING_MODEL_NAME)
+
+
+def _load_chat_model():
+    from app.services.llm import get_llm
+
+    return get_llm()
+
+
+embedding_model = LazyModel("embedding model", _load_embeddings)
+chat_model = LazyModel("LLM", _load_chat_model)
+
+
+def get_embeddings() -> Optional[Embeddings]:
+    """The process-wide embedding model (behind the embedding cache), or None if it failed to load."""
+    return embedding_model.get()
+
+
+def set_embeddings(model: Optional[Embeddings]) -> None:
+    embedding_model.set(model)
+
+
+def get_chat_model():
+    """The process-wide LLM client for `LLM_PROVIDER`, or None if it could not be created."""
+    return chat_model.get()
+
+
+def set_chat_model(model) -> None:
+    chat_model.set(model)
+
+
+_startup_seconds: Dict[str, float] = {}
+
+
+def record_startup(phase: str, seconds: float) -> None:
+    _startup_seconds[phase] = round(seconds, 4)
+
+
+def warm_up() -> None:
+    """
+    Loads both models and runs one embedding, so the first request pays for neither
+    the model load nor the first forward pass. Blocking; call it off the event loop.
+    """
+    started = time.perf_counter()
+    embeddings = get_embeddings()
+    if embeddings is not None:
+        try:
+            embeddings.embed_query("warm up")
+        except Exception as e:
+            logger.warning("Embedding warm-up failed: %s", e)
+    get_chat_model()
+    record_startup("warm_up", time.perf_counter() - started)
+
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def startup_report() -> Dict:
+    return {
+        "seconds": dict(_startup_seconds),
+        "warm_up_enabled": MODEL_WARMUP,
+        "models": {"embeddings": embedding_model.stats(), "llm": chat_model.stats()},
+        "rss_bytes": rss_bytes(),
+    }
@@ -0,0 +1,182 @@
+# app/services/pdf_chunking.py
+
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pypdf import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document as LangchainDocument
+
+# This module is imported by the parse worker processes, so it must stay light:
+# no embedding model, no database engine, nothing from app.services.ingest.
+
+# Configuration
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# Number of parse worker processes; 0 means one per CPU core.
+INGEST_PARSE_PROCESSES = int(os.getenv("INGEST_PARSE_PROCESSES", "0")) or (os.cpu_count() or 1)
+# Documents shorter than this are parsed in-process; the pool only pays off for large PDFs.
+INGEST_PARALLEL_MIN_PAGES = int(os.getenv("INGEST_PARALLEL_MIN_PAGES", "50"))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "25"))
+
+
+def _clean_text(text: str) -> str:
+    """
+    Cleans the input text by removing common OCR/PDF extraction artifacts and standardizing.
+    """
+    cleaned_text = text.replace('♂phone', 'Phone: ')
+    cleaned_text = cleaned_text.replace('/envel⌢p', 'Email: ') # Combine /envel and ⌢p
+    cleaned_text = cleaned_text.replace('/linkedin', 'LinkedIn: ')
+    cleaned_text = cleaned_text.replace('/github', 'GitHub: ')
+    cleaned_text = cleaned_text.replace('♂¶ap-¶arker-alt', 'Location: ')
+    cleaned_text = cleaned_text.replace('/char◎-line', '') # Remove interest icon
+    cleaned_text = cleaned_text.replace('/brain', '') # Remove interest icon
+    cleaned_text = cleaned_text.replace('/code-branch', '') # Remove interest icon
+    cleaned_text = cleaned_text.replace('♂project-diagra¶', '') # Remove interest icon
+    cleaned_text = cleaned_text.replace('♂robot', '') # Remove interest icon
+    cleaned_text = cleaned_text.replace('¨', '') # Remove diacritic for "Schrödinger"
+    cleaned_text = cleaned_text.replace('´', '') # Remove diacritic for "Schrödinger"
+    cleaned_text = cleaned_text.replace('˜', '') # Remove diacritic or other artifacts
+
+    # 2. Remove any remaining non-ASCII characters that are not basic punctuation or whitespace
+    # This regex keeps alphanumeric characters, spaces, and common punctuation.
+    # Adjust if you have specific foreign language characters that *should* be preserved.
+    cleaned_text = re.sub(r'[^\x20-\x7E\n\r]+', ' ', cleaned_text)
+
+    # 3. Normalize whitespace: multiple spaces to single space, remove leading/trailing whitespace
+    cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
+
+    return cleaned_text
+
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+    )
+
+
+def chunk_page(
+    page_content: str,
+    page_metadata: Dict,
+    page_index: int,
+    filename: str,
+    document_id: str,
+    text_splitter: Optional[RecursiveCharacterTextSplitter] = None,
+) -> List[LangchainDocument]:
+    """Cleans one page and splits it into chunks carrying the metadata ingestion stores."""
+    text_splitter = text_splitter or get_text_splitter()
+    cleaned_page_doc = LangchainDocument(page_content=_clean_text(page_content), metadata=dict(page_metadata))
+    page_chunks = text_splitter.split_documents([cleaned_page_doc])
+    for chunk_idx, pc in enumerate(page_chunks):
+        pc.metadata.update({
+            "source": filename,
+            "document_id": document_id,
+            "chunk_index": chunk_idx,
+            "page_number": page_metadata.get("page", page_index),  # fallback to index if missing
+            "doc_title": os.path.splitext(filename)[0].replace("_", " ").title()
+        })
+    return page_chunks
+
+
+def chunk_page_range(file_path: str, start: int, end: int, filename: str, document_id: str) -> List[LangchainDocument]:
+    """
+    Extracts, cleans and chunks pages [start, end) of a PDF. Runs inside a parse worker
+    process, so it opens its own reader on the file instead of receiving page objects.
+    """
+    reader = PdfReader(file_path)
+    text_splitter = get_text_splitter()
+    chunks: List[LangchainDocument] = []
+    for page_index in range(start, end):
+        page_content = reader.pages[page_index].extract_text()
+        page_metadata = {"source": file_path, "page": page_index}
+        chunks.extend(chunk_page(page_content, page_metadata, page_index, filename, document_id, text_splitter))
+    return chunks
+
+
+def page_ranges(num_pages: int, pages_per_task: int = INGEST_PAGES_PER_TASK) -> List[Tuple[int, int]]:
+    return [(start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task)]
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared parse pool, starting it on first use. Workers are spawned rather
+    than forked so they do not inherit the server's threads, model or DB connections.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=INGEST_PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def count_pdf_pages(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def iter_pdf_chunks_parallel(
+    file_path: str,
+    filename: str,
+    document_id: str,
+    num_pages: int,
+    executor: Optional[ProcessPoolExecutor] = None,
+    max_pending: Optional[int] = None,
+) -> Iterator[Tuple[int, List[LangchainDocument]]]:
+    """
+    Chunks page ranges across the parse pool and yields `(pages_done, chunks)` per range
+    in page order. Only `max_pending` ranges are in flight at once, so a huge PDF never
+    has all of its chunks in memory at the same time.
+    """
+    executor = executor or get_parse_pool()
+    max_pending = max_pending or 2 * INGEST_PARSE_PROCESSES
+    ranges = iter(page_ranges(num_pages))
+    pending = deque()
+    for start, end in ranges:
+        pending.append((end, executor.submit(chunk_page_range, file_path, start, end, filename, document_id)))
+        if len(pending) >= max_pending:
+            break
+    while pending:
+        end, future = pending.popleft()
+        chunks = future.result()
+        next_range = next(ranges, None)
+        if next_range is not None:
+            pending.append((next_range[1], executor.submit(chunk_page_range, file_path, *next_range, filename, document_id)))
+        yield end, chunks
+
+
+def chunk_pdf_parallel(
+    file_path: str,
+    filename: str,
+    document_id: str,
+    num_pages: int,
+    executor: Optional[ProcessPoolExecutor] = None,
+) -> List[LangchainDocument]:
+    """
+    Splits the PDF into page ranges, chunks them across the parse pool and merges the
+    results back in page order.
+    """
+    chunks: List[LangchainDocument] = []
+    for _, range_chunks in iter_pdf_chunks_parallel(file_path, filename, document_id, num_pages, executor):
+        chunks.extend(range_chunks)
+    return chunks
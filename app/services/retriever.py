@@ -1,51 +1,257 @@
 # app/services/retriever.py
 
+import asyncio
+import logging
 import os
-from typing import List, Dict
+import time
+from typing import List, Dict, Optional, Tuple
 from collections import defaultdict
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document as LangchainDocument
 
+from app.services.sharding import CollectionNotFoundError, CollectionRegistry
+from app.services.embedding_cache import embed_queries
+from app.services.bm25 import reciprocal_rank_fusion
+from app.services.metadata_filter import FilterCache, filter_key
+from app.services.metrics import QUERY_BATCH_SIZE, QUERY_BATCH_WAIT_SECONDS, current_timings, histogram_summary, span
+from app.services.model_registry import get_embeddings
+
+logger = logging.getLogger(__name__)
+
 # Configuration
 VECTOR_DB_DIRECTORY = os.getenv("VECTOR_DB_DIRECTORY", "vector_db_data/faiss_index")
-EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
-
-# Initialize Embedding Model
-try:
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-except Exception as e:
-    print(f"[Retriever] Error loading embedding model: {e}")
-    embeddings = None
-
-def get_faiss_vector_store():
-    """Loads the FAISS vector store from disk."""
-    if not embeddings:
-        raise ValueError("Embedding model not initialized.")
-
-    faiss_index_path = os.path.join(VECTOR_DB_DIRECTORY, "index.faiss")
-    faiss_pkl_path = os.path.join(VECTOR_DB_DIRECTORY, "index.pkl")
-
-    if os.path.exists(faiss_index_path) and os.path.exists(faiss_pkl_path):
-        print(f"[Retriever] Loading FAISS index from {VECTOR_DB_DIRECTORY}")
-        return FAISS.load_local(VECTOR_DB_DIRECTORY, embeddings, allow_dangerous_deserialization=True)
-    else:
-        raise FileNotFoundError(f"FAISS index not found at {VECTOR_DB_DIRECTORY}. Please ingest documents first.")
-
-async def retrieve_chunks(query_text: str, top_k: int = 4) -> List[LangchainDocument]:
+# Concurrent queries are embedded and searched together: a batch closes after this many
+# milliseconds or queries, whichever comes first. QUERY_BATCH_MAX_SIZE=1 turns batching off.
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+# "hybrid" fuses BM25 and vector results with reciprocal rank fusion; "dense" is vector search only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+# Candidates taken from each of the BM25 and vector rankings before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Process-wide collections of segmented FAISS indexes, loaded once and shared by every
+# query. The embedding model comes from the shared registry and is loaded on first use
+# (or at start-up warm-up).
+collections = CollectionRegistry(VECTOR_DB_DIRECTORY, get_embeddings)
+# The default collection's single index, kept directly in VECTOR_DB_DIRECTORY
+index_manager = collections.default.managers[0]
+# Allow-lists of metadata filters, resolved from the database and cached per filter
+filter_cache = FilterCache(collections)
+
+class _PendingQuery:
+    def __init__(
+        self,
+        query: str,
+        k: int,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        filters: Optional[Dict] = None,
+        collection: Optional[str] = None,
+        future: Optional[asyncio.Future] = None,
+    ):
+        self.query = query
+        self.k = k
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.filters = filters
+        self.filter_key = filter_key(filters)
+        self.collection = collection
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+        # Stage timings of the request that asked; batch stages are charged to every member
+        self.timings = current_timings()
+
+class QueryBatcher:
+    """
+    Micro-batches retrieval across concurrent requests. Queries arriving within
+    `max_wait_ms` of each other (up to `max_size`) are embedded in one forward pass and
+    searched with one FAISS call per segment; each caller then gets its own top k.
+    Queries with different collections / `nprobe` / `ef_search` / metadata filters
+    share the embedding pass but are searched separately. In hybrid mode each query's
+    vector hits are fused with its BM25 hits before the top k is taken.
+    """
+
+    def __init__(
+        self,
+        collections: CollectionRegistry,
+        filters: FilterCache,
+        max_wait_ms: float = QUERY_BATCH_MAX_WAIT_MS,
+        max_size: int = QUERY_BATCH_MAX_SIZE,
+    ):
+        self.collections = collections
+        self.filters = filters
+        self.max_wait = max_wait_ms / 1000
+        self.max_size = max(1, max_size)
+        # Pending queries and their flush timer, per event loop
+        self._pending: Dict[asyncio.AbstractEventLoop, List[_PendingQuery]] = {}
+        self._timers: Dict[asyncio.AbstractEventLoop, asyncio.TimerHandle] = {}
+
+    async def search(
+        self,
+        query: str,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict] = None,
+        collection: Optional[str] = None,
+    ) -> List[LangchainDocument]:
+        if self.max_size == 1:
+            pending = _PendingQuery(query, k, nprobe, ef_search, filters, collection)
+            self._record([pending.enqueued_at])
+            return (await asyncio.to_thread(self._search_batch, [pending]))[0]
+
+        loop = asyncio.get_running_loop()
+        pending = _PendingQuery(query, k, nprobe, ef_search, filters, collection, loop.create_future())
+        batch = self._pending.setdefault(loop, [])
+        batch.append(pending)
+        if len(batch) >= self.max_size:
+            self._flush(loop)
+        elif loop not in self._timers:
+            self._timers[loop] = loop.call_later(self.max_wait, self._flush, loop)
+        return await pending.future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        timer = self._timers.pop(loop, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(loop, [])
+        if batch:
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch: List[_PendingQuery]) -> None:
+        self._record([pending.enqueued_at for pending in batch])
+        try:
+            results = await asyncio.to_thread(self._search_batch, batch)
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        for pending, docs in zip(batch, results):
+            if not pending.future.done():  # the caller may have been cancelled
+                pending.future.set_result(docs)
+
+    async def search_many(self, queries: List[Tuple[str, int, Optional[int], Optional[int], Optional[Dict], Optional[str]]]) -> List[List[LangchainDocument]]:
+        """Embeds and searches a known list of (query, k, nprobe, ef_search, filters, collection) as one batch, without waiting."""
+        if not queries:
+            return []
+        batch = [_PendingQuery(*query) for query in queries]
+        self._record([pending.enqueued_at for pending in batch])
+        return await asyncio.to_thread(self._search_batch, batch)
+
+    def _search_batch(self, batch: List[_PendingQuery]) -> List[List[LangchainDocument]]:
+        embeddings = self.collections.embeddings
+        if not embeddings:
+            raise ValueError("Embedding model not initialized.")
+        with span("query_embed", [pending.timings for pending in batch]):
+            vectors = embed_queries(embeddings, [pending.query for pending in batch])
+        groups: Dict[Tuple[Optional[str], Optional[int], Optional[int], Optional[str]], List[int]] = defaultdict(list)
+        for i, pending in enumerate(batch):
+            groups[(pending.collection, pending.nprobe, pending.ef_search, pending.filter_key)].append(i)
+        results: List[List[LangchainDocument]] = [[] for _ in batch]
+        for (collection, nprobe, ef_search, key), members in groups.items():
+            index = self.collections.get(collection)
+            member_timings = [batch[i].timings for i in members]
+            allow = None
+            if key is not None:
+                with span("filter_resolve", member_timings):
+                    allow = self.filters.allow_list(batch[members[0]].filters, collection)
+                if len(allow) == 0:
+                    continue  # no chunk matches the filter
+            k = max(self._candidates(batch[i].k) for i in members)
+            with span("vector_search", member_timings):
+                found = index.similarity_search_by_vectors([vectors[i] for i in members], k, nprobe=nprobe, ef_search=ef_search, allow=allow)
+            for i, docs in zip(members, found):
+                results[i] = self._fuse(index, batch[i], docs[:self._candidates(batch[i].k)], allow)
+        return results
+
+    @staticmethod
+    def _candidates(k: int) -> int:
+        return max(k, HYBRID_CANDIDATES) if RETRIEVAL_MODE == "hybrid" else k
+
+    def _fuse(self, index, pending: _PendingQuery, dense: List[LangchainDocument], allow=None) -> List[LangchainDocument]:
+        """Reciprocal rank fusion of the vector hits with BM25 hits for the same query."""
+        if RETRIEVAL_MODE != "hybrid":
+            return dense[:pending.k]
+        with span("lexical_search", [pending.timings]):
+            lexical = index.lexical_search(pending.query, self._candidates(pending.k), allow=allow)
+        by_id = {doc.id: doc for doc in lexical + dense}
+        fused = reciprocal_rank_fusion([[doc.id for doc in dense], [doc.id for doc in lexical]], k=RRF_K)
+        return [by_id[doc_id] for doc_id in fused[:pending.k]]
+
+    @staticmethod
+    def _record(enqueued_at: List[float]) -> None:
+        now = time.perf_counter()
+        QUERY_BATCH_SIZE.observe(len(enqueued_at))
+        for started in enqueued_at:
+            QUERY_BATCH_WAIT_SECONDS.observe(now - started)
+
+    def stats(self) -> Dict:
+        """Batching settings and the rag_query_batch_* histograms of this process."""
+        batch_size = histogram_summary(QUERY_BATCH_SIZE)
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_size": self.max_size,
+            "batches": batch_size["count"],
+            "queries": int(batch_size["sum"]),
+            "batch_size": batch_size,
+            "wait_ms": histogram_summary(QUERY_BATCH_WAIT_SECONDS, scale=1000),
+        }
+
+query_batcher = QueryBatcher(collections, filter_cache)
+
+async def retrieve_chunks(
+    query_text: str,
+    top_k: int = 4,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    filters: Optional[Dict] = None,
+    collection: Optional[str] = None,
+) -> List[LangchainDocument]:
     """
     Retrieves relevant document chunks from the vector database.
+    `nprobe` / `ef_search` tune approximate indexes for this query only; `filters`
+    (see `metadata_filter.FILTER_FIELDS`) restricts which chunks are searched, and
+    `collection` which collection (the default one if None).
     """
     top_k = min(top_k, 20)
     try:
-        faiss_store = get_faiss_vector_store()
-        retrieved_docs = faiss_store.similarity_search(query_text, k=top_k)
-        print(f"[Retriever] Retrieved {len(retrieved_docs)} chunks for query: '{query_text}'")
+        # Batched with concurrent queries; embedding and search run off the event loop
+        retrieved_docs = await query_batcher.search(query_text, top_k, nprobe=nprobe, ef_search=ef_search, filters=filters, collection=collection)
+        logger.info("Retrieved %d chunks for query: '%s'", len(retrieved_docs), query_text)
+        # Chunk text is only formatted when debug logging is on; it is too costly for every query
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, doc in enumerate(retrieved_docs):
+                logger.debug(
+                    "Retrieved chunk %d (source: %s, page: %s, chunk index: %s): %s...",
+                    i + 1, doc.metadata.get("source", "N/A"), doc.metadata.get("page_number", "N/A"),
+                    doc.metadata.get("chunk_index", "N/A"), doc.page_content[:500],
+                )
         return retrieved_docs
     except FileNotFoundError as e:
-        print(f"[Retriever] Retrieval error: {e}")
+        logger.warning("Retrieval error: %s", e)
         return []
+    except CollectionNotFoundError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"[Retriever] Unexpected error during retrieval: {e}")
+
+async def retrieve_chunks_batch(
+    queries: List[Tuple[str, int, Optional[int], Optional[int], Optional[Dict], Optional[str]]],
+) -> List[List[LangchainDocument]]:
+    """
+    Retrieves chunks for many (query, top_k, nprobe, ef_search, filters, collection) at
+    once: all queries are embedded in one pass and searched with one FAISS call per segment.
+    """
+    queries = [(query, min(top_k, 20), *rest) for query, top_k, *rest in queries]
+    try:
+        retrieved = await query_batcher.search_many(queries)
+        logger.info("Retrieved chunks for a batch of %d queries.", len(queries))
+        return retrieved
+    except FileNotFoundError as e:
+        logger.warning("Retrieval error: %s", e)
+        return [[] for _ in queries]
     except Exception as e:
         raise RuntimeError(f"[Retriever] Unexpected error during retrieval: {e}")
 
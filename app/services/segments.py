@@ -0,0 +1,327 @@
+# app/services/segments.py
+
+import fcntl
+import json
+import mmap
+import os
+import pickle
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document as LangchainDocument
+
+from app.services.ann import LOSSY_INDEX_TYPES, index_type_of
+from app.services.bm25 import LEXICAL_FILES, LexicalIndex, LexicalIndexWriter
+
+MANIFEST_FILENAME = "MANIFEST"
+MANIFEST_LOCK_FILENAME = "MANIFEST.lock"
+SEGMENTS_DIRNAME = "segments"
+INDEX_FILENAME = "index.faiss"
+IDS_FILENAME = "ids.bin"
+CHUNKS_DATA_FILENAME = "chunks.dat"
+CHUNKS_OFFSETS_FILENAME = "chunks.idx"
+# Original float32 vectors of a segment whose index stores lossy codes (IVF-PQ), so that
+# merges and moved chunks start from the exact vectors rather than decoded ones
+VECTORS_FILENAME = "vectors.bin"
+SEGMENT_FILES = (INDEX_FILENAME, IDS_FILENAME, CHUNKS_DATA_FILENAME, CHUNKS_OFFSETS_FILENAME, VECTORS_FILENAME) + LEXICAL_FILES
+# Segments written before the chunk store kept chunks in a LangChain docstore pickle
+PICKLED_DOCSTORE_FILENAME = "index.pkl"
+
+# Vector IDs are UUID4 strings, stored fixed-width so position -> ID is a plain array lookup
+VECTOR_ID_WIDTH = 36
+# Chunk metadata kept in the chunk store; anything else the PDF loader attached is dropped
+CHUNK_METADATA_FIELDS = ("source", "document_id", "page_number", "chunk_index", "doc_title")
+# Map segment vectors read-only from the file instead of copying them onto the heap, so
+# every worker process on the host shares one copy through the OS page cache
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() in ("1", "true", "yes")
+
+
+def read_faiss_index(path: str) -> faiss.Index:
+    """
+    Reads a segment's FAISS index. With INDEX_MMAP the flat vector codes (flat, HNSW and
+    IVF storage) stay file-backed; index types or FAISS builds that cannot map a file are
+    read into memory as before.
+    """
+    mmap_flags = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if INDEX_MMAP and mmap_flags is not None:
+        try:
+            return faiss.read_index(path, mmap_flags | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path)
+
+
+def _memmap(path: str, dtype) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped chunk text and metadata of one segment.
+
+    `chunks.dat` holds one compact JSON record per vector, back to back, and
+    `chunks.idx` holds n + 1 little-endian uint64 offsets into it, so the chunk at a
+    position is a single slice. Nothing is read until a chunk is requested, and pages
+    that are read are shared with the OS page cache rather than copied onto the heap.
+    """
+
+    def __init__(self, path: str):
+        self._offsets = _memmap(os.path.join(path, CHUNKS_OFFSETS_FILENAME), np.dtype("<u8"))
+        with open(os.path.join(path, CHUNKS_DATA_FILENAME), "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return max(len(self._offsets) - 1, 0)
+
+    def get(self, position: int, vector_id: Optional[str] = None) -> LangchainDocument:
+        record = json.loads(self._data[int(self._offsets[position]):int(self._offsets[position + 1])])
+        return LangchainDocument(page_content=record["text"], metadata=record["metadata"], id=vector_id)
+
+    @staticmethod
+    def write(path: str, docs: Iterable[LangchainDocument]) -> None:
+        offsets = [0]
+        with open(os.path.join(path, CHUNKS_DATA_FILENAME), "wb") as data:
+            for doc in docs:
+                metadata = {field: doc.metadata[field] for field in CHUNK_METADATA_FIELDS if field in doc.metadata}
+                record = json.dumps({"text": doc.page_content, "metadata": metadata}, separators=(",", ":")).encode("utf-8")
+                data.write(record)
+                offsets.append(offsets[-1] + len(record))
+        np.asarray(offsets, dtype=np.dtype("<u8")).tofile(os.path.join(path, CHUNKS_OFFSETS_FILENAME))
+
+
+class Segment:
+    """
+    One immutable slice of the vector index: a FAISS index, the vector ID at each
+    position, the chunks those vectors belong to and a BM25 index over the chunk
+    text. Segments are written once and
+    never modified; deletions are tombstones in the manifest, and merges write a new
+    segment. Vector IDs and chunks are memory-mapped, and so are the vectors themselves
+    unless INDEX_MMAP is off, so loading a segment costs little beyond the FAISS index
+    header and worker processes share the pages rather than each holding a copy.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        index: faiss.Index,
+        vector_ids: np.ndarray,
+        chunks: ChunkStore,
+        lexical: LexicalIndex,
+        vectors: Optional[np.ndarray] = None,
+    ):
+        self.name = name
+        self.index = index
+        self._vector_ids = vector_ids  # position in the FAISS index -> vector ID (fixed-width bytes)
+        self._vectors = vectors  # original vectors (n x d, memory-mapped) if the index is lossy
+        self.chunks = chunks
+        self.lexical = lexical
+        self._positions: Optional[Dict[str, int]] = None
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            # Needed by reconstruct(); built once here rather than under concurrent searches
+            ivf.make_direct_map()
+
+    @property
+    def num_vectors(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def index_type(self) -> str:
+        return index_type_of(self.index)
+
+    def vector_id(self, position: int) -> str:
+        return self._vector_ids[position].decode("ascii")
+
+    def iter_vector_ids(self) -> Iterator[str]:
+        return (vector_id.decode("ascii") for vector_id in self._vector_ids)
+
+    def positions_in(self, vector_ids: np.ndarray) -> np.ndarray:
+        """Positions holding any of `vector_ids` (an array of dtype S36), in ascending order."""
+        return np.flatnonzero(np.isin(self._vector_ids, vector_ids))
+
+    def position_of(self, vector_id: str) -> Optional[int]:
+        if self._positions is None:
+            self._positions = {vector_id: position for position, vector_id in enumerate(self.iter_vector_ids())}
+        return self._positions.get(vector_id)
+
+    def document(self, position: int) -> LangchainDocument:
+        return self.chunks.get(position, self.vector_id(position))
+
+    def search(self, query_vectors: np.ndarray, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.index.search(query_vectors, min(k, self.num_vectors), params=params)
+
+    def reconstruct(self, positions: List[int]) -> np.ndarray:
+        """
+        Returns the vectors at the given positions: exactly as embedded, except for IVF-PQ
+        segments written before the original vectors were kept, whose codes are decoded.
+        """
+        if not positions:
+            return np.zeros((0, self.index.d), dtype=np.float32)
+        if self._vectors is not None:
+            return np.array(self._vectors[np.asarray(positions, dtype=np.int64)], dtype=np.float32)
+        return np.vstack([self.index.reconstruct(int(position)) for position in positions])
+
+    @staticmethod
+    def path(directory: str, name: str) -> str:
+        return os.path.join(directory, SEGMENTS_DIRNAME, name)
+
+    @staticmethod
+    def _write_files(
+        path: str,
+        index: faiss.Index,
+        vector_ids: List[str],
+        docs: Iterable[LangchainDocument],
+        vectors: Optional[np.ndarray] = None,
+    ) -> None:
+        if any(len(vector_id) != VECTOR_ID_WIDTH for vector_id in vector_ids):
+            raise ValueError(f"Vector IDs must be {VECTOR_ID_WIDTH}-character UUID strings.")
+        faiss.write_index(index, os.path.join(path, INDEX_FILENAME))
+        if index_type_of(index) in LOSSY_INDEX_TYPES:
+            if vectors is None:
+                raise ValueError("The original vectors are required for a segment with a lossy index.")
+            np.ascontiguousarray(vectors, dtype=np.float32).tofile(os.path.join(path, VECTORS_FILENAME))
+        np.asarray(vector_ids, dtype=f"S{VECTOR_ID_WIDTH}").tofile(os.path.join(path, IDS_FILENAME))
+        lexical = LexicalIndexWriter()
+        # Chunks are indexed for BM25 as they stream into the chunk store
+        ChunkStore.write(path, (lexical.add(doc) for doc in docs))
+        lexical.write(path)
+
+    @classmethod
+    def create(
+        cls,
+        directory: str,
+        name: str,
+        index: faiss.Index,
+        vector_ids: List[str],
+        docs: Iterable[LangchainDocument],
+        vectors: Optional[np.ndarray] = None,
+    ) -> "Segment":
+        """
+        Writes a new segment into a temporary directory that is renamed into place once
+        complete, and returns it opened from disk. `docs` are in position order.
+        `vectors`, the vectors `index` was built from, are required if it is lossy.
+        """
+        tmp_path = cls.path(directory, f".tmp-{name}")
+        os.makedirs(tmp_path, exist_ok=True)
+        cls._write_files(tmp_path, index, vector_ids, docs, vectors)
+        os.rename(tmp_path, cls.path(directory, name))
+        return cls.load(directory, name, index=index)
+
+    @classmethod
+    def load(cls, directory: str, name: str, index: Optional[faiss.Index] = None) -> "Segment":
+        path = cls.path(directory, name)
+        if not os.path.exists(os.path.join(path, CHUNKS_OFFSETS_FILENAME)):
+            cls._convert_pickled_docstore(path)
+        if index is None:
+            index = read_faiss_index(os.path.join(path, INDEX_FILENAME))
+        vector_ids = _memmap(os.path.join(path, IDS_FILENAME), np.dtype(f"S{VECTOR_ID_WIDTH}"))
+        vectors = None
+        if os.path.exists(os.path.join(path, VECTORS_FILENAME)):
+            vectors = _memmap(os.path.join(path, VECTORS_FILENAME), np.float32).reshape(-1, index.d)
+        chunks = ChunkStore(path)
+        if not LexicalIndex.exists(path):
+            LexicalIndexWriter.build(path, (chunks.get(position) for position in range(len(chunks))))
+        return cls(name, index, vector_ids, chunks, LexicalIndex(path), vectors)
+
+    @classmethod
+    def _convert_pickled_docstore(cls, path: str) -> None:
+        """
+        One-time upgrade of a segment that still has a LangChain `index.pkl` docstore to
+        the memory-mapped chunk store. This is the only place a pickle is ever loaded.
+        """
+        pickle_path = os.path.join(path, PICKLED_DOCSTORE_FILENAME)
+        try:
+            with open(pickle_path, "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+        except FileNotFoundError:
+            if os.path.exists(os.path.join(path, CHUNKS_OFFSETS_FILENAME)):
+                return  # another process converted it first
+            raise
+        vector_ids = [index_to_docstore_id[position] for position in range(len(index_to_docstore_id))]
+        tmp_path = os.path.join(path, f".convert-{uuid4().hex[:8]}")
+        os.makedirs(tmp_path)
+        np.asarray(vector_ids, dtype=f"S{VECTOR_ID_WIDTH}").tofile(os.path.join(tmp_path, IDS_FILENAME))
+        ChunkStore.write(tmp_path, (docstore.search(vector_id) for vector_id in vector_ids))
+        # The offsets file goes last: its presence marks the conversion as complete
+        for filename in (IDS_FILENAME, CHUNKS_DATA_FILENAME, CHUNKS_OFFSETS_FILENAME):
+            os.replace(os.path.join(tmp_path, filename), os.path.join(path, filename))
+        os.rmdir(tmp_path)
+        if os.path.exists(pickle_path):
+            os.remove(pickle_path)
+
+    @classmethod
+    def size_bytes(cls, directory: str, name: str) -> int:
+        path = cls.path(directory, name)
+        return sum(
+            os.path.getsize(os.path.join(path, filename))
+            for filename in SEGMENT_FILES
+            if os.path.exists(os.path.join(path, filename))
+        )
+
+    @classmethod
+    def remove_files(cls, directory: str, name: str) -> None:
+        shutil.rmtree(cls.path(directory, name), ignore_errors=True)
+
+
+def new_segment_name() -> str:
+    # Time-ordered, and unique across processes writing to the same directory
+    return f"seg-{int(time.time() * 1000):013d}-{uuid4().hex[:8]}"
+
+
+def empty_manifest() -> Dict:
+    # "retired": segments merged away, kept on disk until no reader can still be loading them
+    return {"generation": 0, "index_type": None, "segments": [], "tombstones": [], "retired": [], "updated_at": None}
+
+
+def read_manifest(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(directory: str, manifest: Dict) -> None:
+    """Atomically replaces the manifest (write to a temp file, fsync, rename)."""
+    manifest["updated_at"] = datetime.utcnow().isoformat()
+    tmp_path = os.path.join(directory, f".{MANIFEST_FILENAME}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_FILENAME))
+
+
+def manifest_version(directory: str) -> Optional[Tuple[int, int]]:
+    """
+    Cheap change marker for the manifest. Every update renames a new file into place,
+    so the inode changes even when two updates land within the same mtime tick.
+    """
+    try:
+        stat = os.stat(os.path.join(directory, MANIFEST_FILENAME))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+@contextmanager
+def manifest_lock(directory: str):
+    """
+    Cross-process exclusive lock around manifest read-modify-write cycles, so concurrent
+    writers (threads or uvicorn workers) never lose each other's updates.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, MANIFEST_LOCK_FILENAME), "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,353 @@
+# app/services/sharding.py
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import numpy as np
+from langchain_core.documents import Document as LangchainDocument
+from langchain_core.embeddings import Embeddings
+
+from app.services.bm25 import TermStatistics
+from app.services.index_manager import AllowList, IndexManager, SegmentWriter
+
+# Configuration
+# Collection used when an upload or query names none; it is the single index kept
+# directly in VECTOR_DB_DIRECTORY, as before collections existed
+DEFAULT_COLLECTION = "default"
+# Shards of a collection created without an explicit count
+COLLECTION_NUM_SHARDS = int(os.getenv("COLLECTION_NUM_SHARDS", "4"))
+# Threads that search the shards of a collection in parallel (FAISS releases the GIL)
+SHARD_SEARCH_THREADS = int(os.getenv("SHARD_SEARCH_THREADS", str(os.cpu_count() or 4)))
+# Serve each shard's searches from its own local process, standing in for a shard node
+SHARD_PROCESSES = os.getenv("SHARD_PROCESSES", "false").lower() in ("1", "true", "yes")
+
+COLLECTIONS_DIRNAME = "collections"
+COLLECTION_CONFIG_FILENAME = "COLLECTION.json"
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+class CollectionNotFoundError(LookupError):
+    pass
+
+
+def shard_of(document_id: str, num_shards: int) -> int:
+    """The shard holding a document's chunks; stable across processes and restarts."""
+    digest = hashlib.blake2b(document_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % num_shards
+
+
+# --- Shard worker processes ---------------------------------------------------------
+# The child process opens the shard read-only and answers searches; writes always go
+# through the coordinator's own IndexManager, and the child picks them up from the
+# manifest like any other reader.
+
+_process_shard: Optional[IndexManager] = None
+
+
+def _open_process_shard(directory: str) -> None:
+    global _process_shard
+    _process_shard = IndexManager(directory, lambda: None)
+
+
+def _call_process_shard(method: str, *args):
+    return getattr(_process_shard, method)(*args)
+
+
+class ShardProcess:
+    """
+    A shard searched in a dedicated local process. It exposes the read methods the
+    coordinator uses on an IndexManager, so a shard on another node only needs the
+    same three calls over the network.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_open_process_shard,
+            initargs=(directory,),
+        )
+
+    def search_with_distances(self, query_vectors, k, nprobe=None, ef_search=None, allow=None):
+        return self._executor.submit(_call_process_shard, "search_with_distances", np.asarray(query_vectors, dtype=np.float32), k, nprobe, ef_search, allow).result()
+
+    def term_statistics(self, query: str) -> TermStatistics:
+        return self._executor.submit(_call_process_shard, "term_statistics", query).result()
+
+    def lexical_search_with_scores(self, query, k, allow=None, statistics=None):
+        return self._executor.submit(_call_process_shard, "lexical_search_with_scores", query, k, allow, statistics).result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Sharded collections ------------------------------------------------------------
+
+_fan_out_pool = ThreadPoolExecutor(max_workers=max(1, SHARD_SEARCH_THREADS), thread_name_prefix="shard-search")
+
+
+class ShardedAllowList:
+    """A metadata filter resolved against every shard of a collection."""
+
+    def __init__(self, generation: int, shards: List[AllowList]):
+        self.generation = generation
+        self.shards = shards
+
+    def __len__(self) -> int:
+        return sum(len(allow) for allow in self.shards)
+
+
+class ShardedIndex:
+    """
+    A named collection of documents, split into `num_shards` independent segmented
+    indexes. All chunks of a document live in the shard its ID hashes to, so ingesting
+    or deleting a document touches one shard. Searches go to every shard in parallel
+    and the per-shard top k are merged: by distance for vector search, and by BM25
+    score for lexical search, with term statistics summed over all shards first so
+    scores compare across them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        shard_directories: List[str],
+        embedding_provider: Callable[[], Optional[Embeddings]],
+        processes: bool = SHARD_PROCESSES,
+    ):
+        self.name = name
+        self.managers = [IndexManager(directory, embedding_provider) for directory in shard_directories]
+        self._embedding_provider = embedding_provider
+        # Only multi-shard collections are worth a process per shard
+        self._searchers = [ShardProcess(directory) for directory in shard_directories] if processes and len(shard_directories) > 1 else self.managers
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.managers)
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_provider()
+
+    def manager_for(self, document_id: str) -> IndexManager:
+        return self.managers[shard_of(document_id, self.num_shards)]
+
+    def writer(self, document_id: str) -> SegmentWriter:
+        """Starts the segment writer of the shard that holds `document_id`."""
+        return self.manager_for(document_id).writer()
+
+    def generation(self) -> int:
+        """Changes whenever any shard publishes; shard generations only grow, so their sum does too."""
+        return sum(manager.refresh().generation for manager in self.managers)
+
+    def _fan_out(self, call: Callable, calls: Sequence) -> List:
+        if len(calls) == 1:
+            return [call(*calls[0])]
+        return list(_fan_out_pool.map(lambda args: call(*args), calls))
+
+    def allow_list(self, vector_ids: Iterable[str]) -> ShardedAllowList:
+        vector_ids = list(vector_ids)
+        shards = [manager.allow_list(vector_ids) for manager in self.managers]
+        return ShardedAllowList(sum(allow.generation for allow in shards), shards)
+
+    def similarity_search_by_vectors(
+        self,
+        query_vectors: Sequence[Sequence[float]],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        allow: Optional[ShardedAllowList] = None,
+    ) -> List[List[LangchainDocument]]:
+        if len(query_vectors) == 0:
+            return []
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        shards = [
+            (searcher, allow.shards[i] if allow is not None else None)
+            for i, searcher in enumerate(self._searchers)
+            if allow is None or len(allow.shards[i])
+        ]
+        found = self._fan_out(
+            lambda searcher, shard_allow: searcher.search_with_distances(query_vectors, k, nprobe, ef_search, shard_allow),
+            shards,
+        )
+        results = []
+        for i in range(len(query_vectors)):
+            hits = [hit for shard_hits in found for hit in shard_hits[i]]
+            hits.sort(key=lambda hit: hit[0])
+            results.append([doc for _, doc in hits[:k]])
+        return results
+
+    def lexical_search(self, query: str, k: int, allow: Optional[ShardedAllowList] = None) -> List[LangchainDocument]:
+        shards = [
+            (searcher, allow.shards[i] if allow is not None else None)
+            for i, searcher in enumerate(self._searchers)
+            if allow is None or len(allow.shards[i])
+        ]
+        if not shards:
+            return []
+        statistics = TermStatistics.combine(self._fan_out(lambda searcher: searcher.term_statistics(query), [(searcher,) for searcher in self._searchers]))
+        found = self._fan_out(
+            lambda searcher, shard_allow: searcher.lexical_search_with_scores(query, k, shard_allow, statistics),
+            shards,
+        )
+        hits = [hit for shard_hits in found for hit in shard_hits]
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [doc for _, doc in hits[:k]]
+
+    def remove(self, vector_ids: Iterable[str]) -> None:
+        """Tombstones vectors in whichever shards hold them."""
+        vector_ids = list(vector_ids)
+        for manager in self.managers:
+            manager.remove(vector_ids)
+
+    def compact(self) -> Dict:
+        results = [manager.compact() for manager in self.managers]
+        return {
+            "finished_at": datetime.utcnow(),
+            "removed_vectors": sum(result["removed_vectors"] for result in results),
+            "seconds": sum(result["seconds"] for result in results),
+        }
+
+    def rebuild(self, index_type: str) -> Dict:
+        results = [manager.rebuild(index_type) for manager in self.managers]
+        return {
+            "previous_index_type": results[0]["previous_index_type"],
+            "index_type": index_type,
+            "num_vectors": sum(result["num_vectors"] for result in results),
+            "seconds": sum(result["seconds"] for result in results),
+        }
+
+    def stats(self) -> Dict:
+        shards = [manager.stats() for manager in self.managers]
+        return {
+            "name": self.name,
+            "num_shards": self.num_shards,
+            "shard_processes": self._searchers is not self.managers,
+            "num_vectors": sum(shard["num_vectors"] for shard in shards),
+            "index_size_bytes": sum(shard["index_size_bytes"] for shard in shards),
+            "shards": shards,
+        }
+
+    def shutdown(self) -> None:
+        if self._searchers is not self.managers:
+            for searcher in self._searchers:
+                searcher.shutdown()
+
+
+class CollectionRegistry:
+    """
+    The collections in VECTOR_DB_DIRECTORY. `default` is the index in the directory
+    itself (one shard); named collections live in `collections/<name>/shard-NN`, with
+    their shard count in COLLECTION.json. Collections are opened on first use, so one
+    created by another worker process is found on disk.
+    """
+
+    def __init__(self, directory: str, embedding_provider: Callable[[], Optional[Embeddings]]):
+        self.directory = directory
+        self._embedding_provider = embedding_provider
+        self._collections: Dict[str, ShardedIndex] = {
+            DEFAULT_COLLECTION: ShardedIndex(DEFAULT_COLLECTION, [directory], embedding_provider, processes=False),
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def default(self) -> ShardedIndex:
+        return self._collections[DEFAULT_COLLECTION]
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_provider()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, COLLECTIONS_DIRNAME, name)
+
+    @staticmethod
+    def _shard_directories(path: str, num_shards: int) -> List[str]:
+        return [os.path.join(path, f"shard-{shard:02d}") for shard in range(num_shards)]
+
+    def get(self, name: Optional[str] = None) -> ShardedIndex:
+        """The named collection (the default one for None); raises CollectionNotFoundError."""
+        name = name or DEFAULT_COLLECTION
+        collection = self._collections.get(name)
+        if collection is not None:
+            return collection
+        if not COLLECTION_NAME_PATTERN.match(name):
+            raise CollectionNotFoundError(f"Collection '{name}' not found.")
+        with self._lock:
+            if name not in self._collections:
+                try:
+                    with open(os.path.join(self._path(name), COLLECTION_CONFIG_FILENAME), "r") as f:
+                        config = json.load(f)
+                except FileNotFoundError:
+                    raise CollectionNotFoundError(f"Collection '{name}' not found.")
+                self._collections[name] = ShardedIndex(name, self._shard_directories(self._path(name), config["num_shards"]), self._embedding_provider)
+            return self._collections[name]
+
+    def create(self, name: str, num_shards: Optional[int] = None) -> Tuple[ShardedIndex, bool]:
+        """
+        Creates a collection with `num_shards` empty shards (COLLECTION_NUM_SHARDS by
+        default), or returns the existing one. The second value tells whether it was created.
+        """
+        try:
+            return self.get(name), False
+        except CollectionNotFoundError:
+            if not COLLECTION_NAME_PATTERN.match(name):
+                raise ValueError("Collection names are 1-64 letters, digits, '-' or '_', starting with a letter or digit.")
+        num_shards = num_shards or COLLECTION_NUM_SHARDS
+        if num_shards < 1:
+            raise ValueError("A collection needs at least one shard.")
+        path = self._path(name)
+        config_path = os.path.join(path, COLLECTION_CONFIG_FILENAME)
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            # The config is written in full under a temporary name, then linked into place:
+            # readers never see a partial file, and when two processes race, the first link wins
+            tmp_path = os.path.join(path, f".{COLLECTION_CONFIG_FILENAME}-{uuid4().hex[:8]}")
+            with open(tmp_path, "w") as f:
+                json.dump({"num_shards": num_shards, "created_at": datetime.utcnow().isoformat()}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.link(tmp_path, config_path)
+                created = True
+            except FileExistsError:
+                created = False
+            finally:
+                os.unlink(tmp_path)
+        collection = self.get(name)
+        # Every shard gets a manifest up front, so searches never meet a missing one
+        for manager in collection.managers:
+            manager.refresh(create=True)
+        return collection, created
+
+    def names(self) -> List[str]:
+        try:
+            on_disk = [
+                name for name in os.listdir(os.path.join(self.directory, COLLECTIONS_DIRNAME))
+                if os.path.exists(os.path.join(self._path(name), COLLECTION_CONFIG_FILENAME))
+            ]
+        except FileNotFoundError:
+            on_disk = []
+        return [DEFAULT_COLLECTION] + sorted(on_disk)
+
+    def generation(self) -> int:
+        """Changes whenever any open collection publishes (used to expire cached answers)."""
+        total = 0
+        for collection in list(self._collections.values()):
+            try:
+                total += collection.generation()
+            except FileNotFoundError:
+                pass  # nothing ingested into the default collection yet
+        return total
+
+    def shutdown(self) -> None:
+        for collection in list(self._collections.values()):
+            collection.shutdown()
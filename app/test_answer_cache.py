@@ -0,0 +1,69 @@
+import unittest
+import zlib
+from typing import List
+
+from langchain_core.documents import Document as LangchainDocument
+from langchain_core.embeddings import Embeddings
+
+from app.services.answer_cache import AnswerCache, normalize_query
+
+CHUNKS = [LangchainDocument(page_content="Refunds are accepted within 30 days.", id="chunk-1")]
+OTHER_CHUNKS = [LangchainDocument(page_content="Shipping takes a week.", id="chunk-2")]
+
+
+class WordEmbedding(Embeddings):
+    """Bag of words, so questions sharing most words have similar vectors."""
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * 64
+        for word in text.split():
+            vector[zlib.crc32(word.encode()) % 64] += 1.0
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+class TestAnswerCache(unittest.TestCase):
+    """Exact and semantic hits, scopes, expiry, eviction and invalidation by index generation."""
+
+    def setUp(self):
+        self.generation = 1
+        self.cache = AnswerCache(WordEmbedding(), lambda: self.generation, semantic_threshold=0.85)
+
+    def test_exact_hits_ignore_case_and_punctuation(self):
+        self.assertEqual(normalize_query("  What is the  refund policy?? "), "what is the refund policy")
+        self.cache.put("What is the refund policy?", CHUNKS, "30 days.")
+        self.assertEqual(self.cache.get("what is the REFUND policy", CHUNKS), ("30 days.", "exact"))
+        self.assertEqual(self.cache.exact_hits, 1)
+
+    def test_similar_questions_hit_the_semantic_tier(self):
+        self.cache.put("What is the refund policy?", CHUNKS, "30 days.")
+        self.assertEqual(self.cache.get("what is the refund policy here", OTHER_CHUNKS), ("30 days.", "semantic"))
+        self.assertIsNone(self.cache.get("how long does shipping take", CHUNKS))
+        # Answers are not shared between scopes (metadata filters)
+        self.assertIsNone(self.cache.get("what is the refund policy here", CHUNKS, scope="other"))
+        self.assertEqual((self.cache.semantic_hits, self.cache.misses), (1, 2))
+
+    def test_new_generation_drops_every_answer(self):
+        self.cache.put("What is the refund policy?", CHUNKS, "30 days.")
+        self.generation = 2
+        self.assertIsNone(self.cache.get("What is the refund policy?", CHUNKS))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        self.assertEqual(self.cache.invalidations, 1)
+
+    def test_expired_and_least_recently_used_entries_are_dropped(self):
+        cache = AnswerCache(WordEmbedding(), lambda: 1, max_entries=2, semantic_threshold=0)
+        for i in range(3):
+            cache.put(f"question {i}", CHUNKS, f"answer {i}")
+        self.assertIsNone(cache.get("question 0", CHUNKS))
+        self.assertEqual(cache.get("question 2", CHUNKS), ("answer 2", "exact"))
+        self.assertEqual(cache.evictions, 1)
+
+        cache.ttl_seconds = -1
+        self.assertIsNone(cache.get("question 2", CHUNKS))
+        self.assertEqual(cache.stats()["entries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import math
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+import numpy as np
+from langchain_core.documents import Document as LangchainDocument
+
+from app.services.bm25 import LexicalIndex, LexicalIndexWriter, TermStatistics, reciprocal_rank_fusion, tokenize
+
+CORPUS = [
+    "The AB-1234 pump replaces the AB-1000 pump.",
+    "Pump maintenance: check the seals every month.",
+    "Valve assembly instructions for the valve housing.",
+    "Safety notes for the pump and the valve.",
+]
+
+
+def reference_scores(query: str, k1: float = 1.2, b: float = 0.75):
+    """Textbook BM25 over the whole corpus, position -> score of every chunk matching the query."""
+    documents = [Counter(tokenize(text)) for text in CORPUS]
+    avg_length = sum(sum(tf.values()) for tf in documents) / len(documents)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for tf in documents if term in tf)
+        if not df:
+            continue
+        idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+        for position, tf in enumerate(documents):
+            if term in tf:
+                norm = k1 * (1 - b + b * sum(tf.values()) / avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * tf[term] * (k1 + 1) / (tf[term] + norm)
+    return scores
+
+
+class TestBM25(unittest.TestCase):
+    """Per-segment BM25 ranks a fixed corpus as plain BM25 over all of it would."""
+
+    def setUp(self):
+        self.directories = []
+
+    def tearDown(self):
+        for directory in self.directories:
+            shutil.rmtree(directory)
+
+    def segment(self, texts):
+        directory = tempfile.mkdtemp()
+        self.directories.append(directory)
+        writer = LexicalIndexWriter()
+        for text in texts:
+            writer.add(LangchainDocument(page_content=text))
+        writer.write(directory)
+        return LexicalIndex(directory)
+
+    def rank(self, query: str, indexes):
+        """(segment number, position) of every matching chunk, best first, with its score."""
+        terms = tokenize(query)
+        statistics = TermStatistics.collect(terms, indexes)
+        hits = []
+        for number, index in enumerate(indexes):
+            positions, scores = index.score(statistics.idf(), statistics.avg_length)
+            hits.extend(((number, int(position)), float(score)) for position, score in zip(positions, scores))
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)
+
+    def test_tokenize_keeps_identifiers_and_their_parts(self):
+        self.assertEqual(tokenize("The AB-1234 pump, v2.1"), ["ab-1234", "ab", "1234", "pump", "v2.1", "v2", "1"])
+
+    def test_ranking_matches_reference_bm25(self):
+        index = self.segment(CORPUS)
+        self.assertEqual(index.num_docs, len(CORPUS))
+        self.assertEqual(index.document_frequency("pump"), 3)
+
+        ranked = self.rank("AB-1234 pump", [index])
+        # The exact identifier wins; of the two other pump chunks the shorter one ranks higher
+        self.assertEqual([position for (_, position), _ in ranked], [0, 3, 1])
+        expected = reference_scores("AB-1234 pump")
+        for (_, position), score in ranked:
+            self.assertAlmostEqual(score, expected[position], places=5)
+
+        self.assertEqual([position for (_, position), _ in self.rank("valve housing", [index])], [2, 3])
+        self.assertEqual(self.rank("turbine", [index]), [])
+
+    def test_scores_are_the_same_when_the_corpus_is_split_into_segments(self):
+        whole = self.rank("pump valve", [self.segment(CORPUS)])
+        split = self.rank("pump valve", [self.segment(CORPUS[:2]), self.segment(CORPUS[2:])])
+        self.assertEqual([(number * 2 + position) for (number, position), _ in split], [position for (_, position), _ in whole])
+        np.testing.assert_allclose([score for _, score in split], [score for _, score in whole], rtol=1e-6)
+
+        # Statistics gathered per shard and combined equal those of the whole corpus
+        parts = [TermStatistics.collect(["pump"], [self.segment(CORPUS[:2])]), TermStatistics.collect(["pump"], [self.segment(CORPUS[2:])])]
+        combined = TermStatistics.combine(parts)
+        self.assertEqual((combined.document_frequencies, combined.num_docs), ({"pump": 3}, len(CORPUS)))
+        self.assertEqual(combined.idf(), TermStatistics.collect(["pump"], [self.segment(CORPUS)]).idf())
+
+    def test_empty_segment_scores_nothing(self):
+        index = self.segment([])
+        positions, scores = index.score({"pump": 1.0}, 1.0)
+        self.assertEqual((len(positions), len(scores)), (0, 0))
+
+
+class TestReciprocalRankFusion(unittest.TestCase):
+    """IDs ranked well in several lists rise above IDs ranked first in only one."""
+
+    def test_fused_order(self):
+        dense = ["a", "b", "c"]
+        lexical = ["c", "a", "d"]
+        # a: 1/61 + 1/62, c: 1/63 + 1/61, b: 1/62, d: 1/63
+        self.assertEqual(reciprocal_rank_fusion([dense, lexical]), ["a", "c", "b", "d"])
+
+    def test_agreement_beats_a_single_first_place(self):
+        self.assertEqual(reciprocal_rank_fusion([["x", "y"], ["z", "y"], ["w", "y"]])[0], "y")
+
+    def test_single_ranking_is_kept_and_k_changes_the_balance(self):
+        self.assertEqual(reciprocal_rank_fusion([["c", "b", "a"]]), ["c", "b", "a"])
+        self.assertEqual(reciprocal_rank_fusion([]), [])
+        # A small k favours the top of each list: one first place outweighs a second plus a third place
+        rankings = [["p", "q", "r"], ["s", "t", "q"]]
+        self.assertEqual(reciprocal_rank_fusion(rankings, k=60)[0], "q")
+        self.assertEqual(reciprocal_rank_fusion(rankings, k=0)[:2], ["p", "s"])
+
+
+if __name__ == "__main__":
+    unittest.main()
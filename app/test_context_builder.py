@@ -0,0 +1,40 @@
+import unittest
+
+from langchain_core.documents import Document as LangchainDocument
+
+from app.services.context_builder import build_context, estimate_tokens
+
+PAGE_TEXT = " ".join(f"word{i}" for i in range(120))
+
+
+def chunk(text: str, chunk_index: int, page_number: int = 0, document_id: str = "doc-1") -> LangchainDocument:
+    return LangchainDocument(
+        page_content=text,
+        metadata={"document_id": document_id, "source": "test.pdf", "page_number": page_number, "chunk_index": chunk_index},
+    )
+
+
+# Three neighbouring chunks of one page, each repeating the last 25 words of the previous one
+WORDS = PAGE_TEXT.split()
+CHUNKS = [chunk(" ".join(WORDS[start:start + 50]), i) for i, start in enumerate((0, 25, 50))]
+
+
+class TestContextBuilder(unittest.TestCase):
+    """Packing of retrieved chunks into prompt passages; pure functions, no services needed."""
+
+    def test_neighbours_are_merged_without_their_overlap(self):
+        context = build_context([CHUNKS[1], CHUNKS[0], CHUNKS[2]], token_budget=0)
+        self.assertEqual(len(context.passages), 1)
+        self.assertEqual(context.passages[0].page_content, " ".join(WORDS[:100]))
+        self.assertGreater(context.tokens_saved, 0)
+
+    def test_duplicates_are_dropped_and_budget_is_respected(self):
+        other = chunk("An unrelated passage from another document.", 0, document_id="doc-2")
+        context = build_context([CHUNKS[0], CHUNKS[0], other, CHUNKS[2]], token_budget=estimate_tokens(CHUNKS[0].page_content) + 15)
+        self.assertEqual(context.chunks_used, 2)
+        self.assertEqual([passage.metadata["document_id"] for passage in context.passages], ["doc-1", "doc-2"])
+        self.assertLessEqual(context.tokens, estimate_tokens(CHUNKS[0].page_content) + 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.services.document_loaders import (
+    UnsupportedFormatError,
+    UploadTooLargeError,
+    iter_page_records,
+    iter_text_pages,
+    sniff_format,
+    split_page_records,
+)
+
+
+class TestDocumentLoaders(unittest.TestCase):
+    """Format sniffing and the text loaders; files only, no services needed."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name: str, content: bytes) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_format_is_sniffed_from_content(self):
+        self.assertEqual(sniff_format(self.write("a.txt", b"%PDF-1.7\n...")), "pdf")
+        self.assertEqual(sniff_format(self.write("b.pdf", "Plain text, café.".encode())), "text")
+        # A multi-byte character cut off by the sniff window is still text
+        self.assertEqual(sniff_format(self.write("c.txt", b"x" * 8191 + "é".encode())), "text")
+        with self.assertRaises(UnsupportedFormatError):
+            sniff_format(self.write("d.txt", b"\x89PNG\r\n\x1a\n\x00\x00"))
+
+    def test_text_is_split_at_form_feeds_and_blank_lines(self):
+        paragraph = "word " * 20 + "\n\n"
+        path = self.write("e.txt", ("intro\n\f" + paragraph * 10).encode())
+        pages = list(iter_text_pages(path, section_chars=250))
+        self.assertEqual(pages[0], (0, "intro\n"))
+        self.assertEqual([number for number, _ in pages], list(range(len(pages))))
+        self.assertGreater(len(pages), 2)
+        self.assertEqual("".join(text for _, text in pages[1:]).split(), (paragraph * 10).split())
+
+    def test_records_are_grouped_by_document(self):
+        records = [{"doc": "a", "page": 0, "text": "one"}, {"doc": "b", "text": "two"}, {"doc": "a", "page": 1, "text": "three"}]
+        source = io.BytesIO(("\n".join(json.dumps(record) for record in records) + "\n").encode())
+        spooled = split_page_records(source, self.directory)
+        self.assertEqual(list(spooled), ["a", "b"])
+        self.assertEqual(list(iter_page_records(spooled["a"][0])), [(0, "one"), (1, "three")])
+        self.assertEqual(list(iter_page_records(spooled["b"][0])), [(0, "two")])
+
+    def test_invalid_or_oversized_records_leave_no_files(self):
+        with self.assertRaises(ValueError):
+            split_page_records(io.BytesIO(b'{"doc": "a", "text": "one"}\n{"doc": "a"}\n'), self.directory)
+        with self.assertRaises(UploadTooLargeError):
+            split_page_records(io.BytesIO(b'{"doc": "a", "text": "one"}\n' * 10), self.directory, max_bytes=64)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.main import app
+from app.models.metadata import Base, Chunk, Document, SessionLocal, engine
+from app.services import model_registry
+from app.services.ingest import create_pending_document, ingest_document, set_document_status
+from app.services.retriever import collections, retrieve_chunks
+
+TEXT = "\f".join(f"Page {i} of a manual about deleting documents from segments." for i in range(3))
+
+
+class TestDeleteDocument(unittest.TestCase):
+    """DELETE /documents/{id} hides the vectors from search and drops the rows."""
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(bind=engine)
+        model_registry.set_embeddings(DeterministicFakeEmbedding(size=32))
+
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def retrieved_from(self, document_id: str):
+        chunks = asyncio.run(retrieve_chunks(TEXT.split("\f")[0], top_k=20))
+        return [chunk for chunk in chunks if chunk.metadata["document_id"] == document_id]
+
+    def test_deleted_document_is_no_longer_retrieved(self):
+        document_id = ingest_document(TEXT.encode(), f"{uuid4()}.txt")["document_id"]
+        db = SessionLocal()
+        vector_ids = [vector_id for (vector_id,) in db.query(Chunk.vector_id).filter(Chunk.document_id == document_id)]
+        db.close()
+        self.assertEqual(len(vector_ids), 3)
+        self.assertTrue(self.retrieved_from(document_id))
+
+        response = self.client.delete(f"/documents/{document_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"document_id": document_id, "deleted_chunks": 3, "status": "deleted"})
+
+        # The vectors are tombstoned...
+        shard = collections.get(None).manager_for(document_id)
+        self.assertEqual(shard.live_vector_ids(vector_ids), set())
+        self.assertEqual(self.retrieved_from(document_id), [])
+        # ...and the rows are gone
+        db = SessionLocal()
+        self.assertIsNone(db.get(Document, document_id))
+        self.assertEqual(db.query(Chunk).filter(Chunk.document_id == document_id).count(), 0)
+        db.close()
+        self.assertEqual(self.client.delete(f"/documents/{document_id}").status_code, 404)
+
+    def test_document_being_ingested_cannot_be_deleted(self):
+        document_id = create_pending_document(f"{uuid4()}.txt")
+        for status in ("queued", "processing"):
+            set_document_status(document_id, status)
+            response = self.client.delete(f"/documents/{document_id}")
+            self.assertEqual(response.status_code, 409)
+        db = SessionLocal()
+        self.assertIsNotNone(db.get(Document, document_id))
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingCache, text_hash
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Records every text that reaches the model."""
+
+    embedded: list = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    """Repeated texts are served from disk; the cache is evicted least-recently-used at its cap."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "embedding_cache.sqlite3")
+        self.model = CountingEmbedding(size=16, embedded=[])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cached(self, cache: EmbeddingCache) -> CachedEmbeddings:
+        return CachedEmbeddings(self.model, "fake", cache)
+
+    def test_repeated_texts_do_not_reach_the_model(self):
+        cache = EmbeddingCache(self.path)
+        embeddings = self.cached(cache)
+        first = embeddings.embed_documents(["alpha", "beta", "alpha"])
+        self.assertEqual(self.model.embedded, ["alpha", "beta"])
+        second = embeddings.embed_documents(["alpha", "gamma"])
+        self.assertEqual(self.model.embedded, ["alpha", "beta", "gamma"])
+        # Cached and fresh vectors are identical, and both match the model's output in float32
+        self.assertEqual(second[0], first[0])
+        np.testing.assert_allclose(first[1], self.model.embed_query("beta"), rtol=1e-6)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 4, 3))
+
+        # Queries have their own key space, and another process sharing the file sees the entries
+        self.cached(EmbeddingCache(self.path)).embed_queries(["alpha", "alpha"])
+        self.assertEqual(self.model.embedded[-1:], ["alpha"])
+        self.model.embedded.clear()
+        self.cached(EmbeddingCache(self.path)).embed_documents(["beta", "gamma"])
+        self.assertEqual(self.model.embedded, [])
+
+    def test_least_recently_used_entries_are_evicted_at_the_cap(self):
+        cache = EmbeddingCache(self.path, max_entries=3)
+        embeddings = self.cached(cache)
+        for text in ("a", "b", "c"):
+            embeddings.embed_documents([text])
+            time.sleep(0.01)
+        embeddings.embed_documents(["a"])  # a hit makes "a" the most recently used
+        time.sleep(0.01)
+        embeddings.embed_documents(["d"])
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.stats()["entries"], 3)
+        self.assertEqual(set(cache.get_many("fake", [text_hash(text) for text in "abcd"])), {text_hash(text) for text in "acd"})
+
+    def test_entry_count_is_shared_and_kept_by_triggers(self):
+        first, second = EmbeddingCache(self.path), EmbeddingCache(self.path, max_entries=2)
+        first.put_many("fake", {text_hash(text): [0.0] * 4 for text in "abc"})
+        self.assertEqual(second.stats()["entries"], 3)
+        # Evicting in one process lowers the count every process sees
+        second.put_many("fake", {text_hash("d"): [0.0] * 4})
+        self.assertEqual((first.stats()["entries"], second.evictions), (2, 2))
+
+    def test_count_is_initialised_for_a_cache_file_without_one(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "CREATE TABLE embeddings (model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        conn.executemany("INSERT INTO embeddings VALUES ('fake', ?, x'00000000', 0)", [(text_hash(text),) for text in "ab"])
+        conn.commit()
+        conn.close()
+        self.assertEqual(EmbeddingCache(self.path).stats()["entries"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
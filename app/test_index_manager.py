@@ -0,0 +1,229 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document as LangchainDocument
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.services.ann import ANN_MIN_TRAIN_VECTORS
+from app.services.index_manager import IndexManager
+from app.services.segments import PICKLED_DOCSTORE_FILENAME, ChunkStore, Segment, read_manifest
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=32)
+
+
+def add(manager: IndexManager, vectors: np.ndarray, document_id: str = "doc"):
+    """Publishes `vectors` as one segment and returns their vector IDs."""
+    texts = [f"{document_id} chunk {i}" for i in range(len(vectors))]
+    metadatas = [{"document_id": document_id, "source": f"{document_id}.pdf", "page_number": 0, "chunk_index": i} for i in range(len(vectors))]
+    writer = manager.writer()
+    vector_ids = writer.add_embeddings(texts, vectors, metadatas)
+    writer.commit()
+    return vector_ids
+
+
+class TestSegmentLifecycle(unittest.TestCase):
+    """Segments, the manifest and tombstones through ingest, re-ingest, delete and compaction."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = IndexManager(self.directory, lambda: EMBEDDINGS)
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def search_ids(self, manager: IndexManager, k: int = 100, allow=None):
+        return {doc.id for doc in manager.similarity_search_by_vectors(self.rng.normal(size=(1, 32)).tolist(), k=k, allow=allow)[0]}
+
+    def test_reingest_delete_and_compact(self):
+        first = add(self.manager, self.rng.normal(size=(6, 32)), "a")
+        other = add(self.manager, self.rng.normal(size=(4, 32)), "b")
+        self.assertEqual(self.search_ids(self.manager), set(first + other))
+
+        # A new version is published together with the tombstones of the old one
+        writer = self.manager.writer()
+        second = writer.add_embeddings(["a v2"] * 3, self.rng.normal(size=(3, 32)), [{"document_id": "a"}] * 3)
+        writer.commit(tombstones=first)
+        manifest = read_manifest(self.directory)
+        self.assertEqual(manifest["generation"], 3)
+        self.assertEqual(len(manifest["segments"]), 3)
+        self.assertEqual(set(manifest["tombstones"]), set(first))
+        self.assertEqual(self.search_ids(self.manager), set(second + other))
+        # Only the tombstoned old version contains "a chunk"
+        self.assertEqual({doc.id for doc in self.manager.lexical_search("chunk", k=20)}, set(other))
+
+        self.manager.remove(other)
+        self.assertEqual(self.search_ids(self.manager), set(second))
+
+        # Compaction drops the tombstoned vectors; the replaced segments are only retired
+        replaced = [entry["name"] for entry in manifest["segments"][:2]]
+        self.assertEqual(self.manager.compact()["removed_vectors"], len(first) + len(other))
+        manifest = read_manifest(self.directory)
+        self.assertEqual(manifest["tombstones"], [])
+        self.assertEqual([entry["name"] for entry in manifest["retired"]], replaced)
+        self.assertTrue(all(os.path.exists(Segment.path(self.directory, name)) for name in replaced))
+        self.assertEqual(self.search_ids(self.manager), set(second))
+
+        # ...and deleted by the first manifest update after their grace period
+        with patch("app.services.index_manager.SEGMENT_RETIRE_GRACE_SECONDS", 0):
+            add(self.manager, self.rng.normal(size=(1, 32)), "c")
+        self.assertEqual(read_manifest(self.directory)["retired"], [])
+        self.assertFalse(any(os.path.exists(Segment.path(self.directory, name)) for name in replaced))
+
+    def test_other_processes_pick_up_new_generations(self):
+        reader = IndexManager(self.directory, lambda: EMBEDDINGS)
+        first = add(self.manager, self.rng.normal(size=(5, 32)), "a")
+        self.assertEqual(self.search_ids(reader), set(first))
+        resident = reader.refresh().segments[0]
+        second = add(self.manager, self.rng.normal(size=(5, 32)), "b")
+        self.manager.remove(first[:2])
+        self.assertEqual(self.search_ids(reader), set(first[2:] + second))
+        # Segments already loaded are reused, not read again
+        self.assertIs(reader.refresh().segments[0], resident)
+
+    def test_merge_keeps_segment_count_bounded(self):
+        vector_ids = []
+        for d in range(5):
+            vector_ids += add(self.manager, self.rng.normal(size=(3, 32)), f"doc{d}")
+        self.manager.remove(vector_ids[:3])
+        with patch("app.services.index_manager.SEGMENT_MAX_COUNT", 2):
+            self.assertTrue(self.manager.needs_merge())
+            result = self.manager.merge_segments()
+            while self.manager.needs_merge():
+                self.manager.merge_segments()
+        self.assertEqual(result["merged_segments"], 4)
+        self.assertLessEqual(len(self.manager.refresh().segments), 2)
+        self.assertEqual(self.search_ids(self.manager), set(vector_ids[3:]))
+
+    def test_rebuild_changes_index_type_and_keeps_vectors(self):
+        vectors = self.rng.normal(size=(20, 32)).astype(np.float32)
+        vector_ids = add(self.manager, vectors[:10], "a") + add(self.manager, vectors[10:], "b")
+        result = self.manager.rebuild("hnsw")
+        self.assertEqual((result["previous_index_type"], result["index_type"], result["num_vectors"]), ("flat", "hnsw", 20))
+        self.assertEqual([segment["index_type"] for segment in self.manager.stats()["segments"]], ["hnsw"])
+        stored = self.manager.get_vectors(vector_ids)
+        np.testing.assert_array_equal(np.vstack([stored[vector_id] for vector_id in vector_ids]), vectors)
+        # Later merges keep producing the rebuilt type
+        add(self.manager, self.rng.normal(size=(2, 32)), "c")
+        self.manager.rebuild(self.manager.refresh().index_type)
+        self.assertEqual([segment["index_type"] for segment in self.manager.stats()["segments"]], ["hnsw"])
+
+    def test_allow_list_limits_search_and_survives_pickling(self):
+        first = add(self.manager, self.rng.normal(size=(6, 32)), "a")
+        other = add(self.manager, self.rng.normal(size=(6, 32)), "b")
+        self.manager.remove(first[:2])
+        allow = self.manager.allow_list(first + other[:1] + ["not-a-vector-id"])
+        # Tombstoned and unknown IDs are left out
+        self.assertEqual(len(allow), 5)
+        self.assertEqual(self.search_ids(self.manager, allow=allow), set(first[2:] + other[:1]))
+        self.assertEqual({doc.id for doc in self.manager.lexical_search("chunk", k=20, allow=allow)}, set(first[2:] + other[:1]))
+
+        copy = pickle.loads(pickle.dumps(allow))
+        self.assertEqual(copy.generation, allow.generation)
+        self.assertEqual(self.search_ids(self.manager, allow=copy), set(first[2:] + other[:1]))
+        self.assertEqual(self.search_ids(self.manager, allow=self.manager.allow_list([])), set())
+
+
+class TestStorageFormats(unittest.TestCase):
+    """The memory-mapped chunk store and the migration of the pickle-based layout."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_chunk_store_round_trip(self):
+        docs = [
+            LangchainDocument(page_content="Café, naïve ✓", metadata={"document_id": "a", "page_number": 0, "chunk_index": 0, "producer": "x"}),
+            LangchainDocument(page_content="", metadata={"document_id": "a", "page_number": 1, "chunk_index": 0}),
+            LangchainDocument(page_content="third " * 1000, metadata={"source": "a.pdf"}),
+        ]
+        ChunkStore.write(self.directory, docs)
+        store = ChunkStore(self.directory)
+        self.assertEqual(len(store), 3)
+        for position, doc in enumerate(docs):
+            self.assertEqual(store.get(position).page_content, doc.page_content)
+        # Only the known metadata fields are stored
+        self.assertEqual(store.get(0, "id-0").metadata, {"document_id": "a", "page_number": 0, "chunk_index": 0})
+        self.assertEqual(store.get(0, "id-0").id, "id-0")
+
+        empty = os.path.join(self.directory, "empty")
+        os.makedirs(empty)
+        ChunkStore.write(empty, [])
+        self.assertEqual(len(ChunkStore(empty)), 0)
+
+    def test_legacy_index_is_migrated(self):
+        texts = ["initialization", "legacy chunk one", "legacy chunk two", "legacy chunk three"]
+        metadatas = [{}] + [{"document_id": "old", "source": "old.pdf", "page_number": 0, "chunk_index": i} for i in range(3)]
+        store = FAISS.from_texts(texts, EMBEDDINGS, metadatas=metadatas)
+        store.save_local(self.directory)
+        vector_ids = [store.index_to_docstore_id[i] for i in range(len(texts))]
+        with open(os.path.join(self.directory, "GENERATION"), "w") as f:
+            f.write("7")
+        with open(os.path.join(self.directory, "TOMBSTONES"), "w") as f:
+            json.dump([vector_ids[3]], f)
+
+        manager = IndexManager(self.directory, lambda: EMBEDDINGS)
+        snapshot = manager.refresh()
+        manifest = read_manifest(self.directory)
+        self.assertEqual(manifest["generation"], 8)
+        # The placeholder text and the old tombstones are both tombstoned
+        self.assertEqual(set(manifest["tombstones"]), {vector_ids[0], vector_ids[3]})
+        self.assertFalse(any(os.path.exists(os.path.join(self.directory, name)) for name in ("index.faiss", "index.pkl", "GENERATION", "TOMBSTONES")))
+        segment = snapshot.segments[0]
+        self.assertFalse(os.path.exists(os.path.join(Segment.path(self.directory, segment.name), PICKLED_DOCSTORE_FILENAME)))
+
+        docs = manager.similarity_search_by_vector(EMBEDDINGS.embed_query("legacy chunk one"), k=4)
+        self.assertEqual([doc.id for doc in docs][:1], [vector_ids[1]])
+        self.assertEqual({doc.id for doc in docs}, set(vector_ids[1:3]))
+        self.assertEqual(docs[0].metadata["source"], "old.pdf")
+        self.assertEqual(docs[0].page_content, "legacy chunk one")
+
+
+class TestApproximateIndexTypes(unittest.TestCase):
+    """Rebuilding and merging into trained index types."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = IndexManager(self.directory, lambda: EMBEDDINGS)
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_small_indexes_are_built_flat(self):
+        vector_ids = add(self.manager, self.rng.normal(size=(400, 32)).astype(np.float32))
+        self.manager.remove(vector_ids[5:])
+        for index_type in ("ivf_pq", "ivf_flat"):
+            self.assertEqual(self.manager.rebuild(index_type)["num_vectors"], 5)
+            self.assertEqual([segment["index_type"] for segment in self.manager.stats()["segments"]], ["flat"])
+        docs = self.manager.similarity_search_by_vectors(self.rng.normal(size=(1, 32)).tolist(), k=10)[0]
+        self.assertEqual({doc.id for doc in docs}, set(vector_ids[:5]))
+
+    def test_pq_merges_start_from_the_original_vectors(self):
+        vectors = self.rng.normal(size=(ANN_MIN_TRAIN_VECTORS + 200, 32)).astype(np.float32)
+        vector_ids = add(self.manager, vectors[:ANN_MIN_TRAIN_VECTORS], "a") + add(self.manager, vectors[ANN_MIN_TRAIN_VECTORS:], "b")
+        self.manager.rebuild("ivf_pq")
+        self.assertEqual([segment["index_type"] for segment in self.manager.stats()["segments"]], ["ivf_pq"])
+
+        # Merging the PQ segment with a new flat one must not re-quantise decoded vectors
+        extra = self.rng.normal(size=(10, 32)).astype(np.float32)
+        extra_ids = add(self.manager, extra, "c")
+        self.manager.remove(vector_ids[:100])
+        self.manager.rebuild("ivf_pq")
+        self.assertEqual([segment["index_type"] for segment in self.manager.stats()["segments"]], ["ivf_pq"])
+        stored = self.manager.get_vectors(vector_ids[100:] + extra_ids)
+        np.testing.assert_array_equal(np.vstack([stored[vector_id] for vector_id in vector_ids[100:]]), vectors[100:])
+        np.testing.assert_array_equal(np.vstack([stored[vector_id] for vector_id in extra_ids]), extra)
+
+
+if __name__ == "__main__":
+    unittest.main()
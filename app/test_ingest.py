@@ -0,0 +1,109 @@
+import unittest
+from uuid import uuid4
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.models.metadata import Base, Chunk, Document, SessionLocal, engine
+from app.services import model_registry
+from app.services.ingest import ingest_document
+from app.services.retriever import collections
+
+PARAGRAPHS = {
+    name: f"Paragraph {name} explains {topic} in a sentence of its own."
+    for name, topic in [("A", "segment merges"), ("B", "tombstones"), ("C", "query batching"), ("D", "answer caching"),
+                        ("B2", "tombstones and their compaction"), ("X", "the embedding cache")]
+}
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Records every text the model is asked to embed."""
+
+    embedded: list = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def text_document(*names: str) -> bytes:
+    """One paragraph per page; a form feed starts a new page."""
+    return "\f".join(PARAGRAPHS[name] for name in names).encode()
+
+
+class TestIncrementalReingestion(unittest.TestCase):
+    """A new version of a document re-embeds only changed text and retires what is gone."""
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(bind=engine)
+
+    def setUp(self):
+        self.embeddings = CountingEmbedding(size=32, embedded=[])
+        model_registry.set_embeddings(self.embeddings)
+        self.filename = f"{uuid4()}.txt"
+
+    def rows(self, document_id: str):
+        """Chunk text -> (vector ID, page number) of the document."""
+        db = SessionLocal()
+        try:
+            rows = db.query(Chunk).filter(Chunk.document_id == document_id)
+            return {row.chunk_text: (row.vector_id, row.page_number) for row in rows}
+        finally:
+            db.close()
+
+    def search(self, document_id: str, name: str, k: int = 10):
+        query_vector = self.embeddings.embed_query(PARAGRAPHS[name])
+        hits = collections.get(None).similarity_search_by_vectors([query_vector], k)[0]
+        return [doc.page_content for doc in hits if doc.metadata["document_id"] == document_id]
+
+    def test_only_changed_chunks_are_embedded_and_retired_ones_are_tombstoned(self):
+        first = ingest_document(text_document("A", "B", "C", "D"), self.filename)
+        document_id = first["document_id"]
+        before = self.rows(document_id)
+        self.assertEqual(len(before), 4)
+        shard = collections.get(None).manager_for(document_id)
+
+        # B is edited, D removed, X inserted in front of C, which moves to the next page
+        self.embeddings.embedded.clear()
+        second = ingest_document(text_document("A", "B2", "X", "C"), self.filename)
+        self.assertEqual((second["document_id"], second["status"], second["num_chunks"]), (document_id, "completed", 4))
+        self.assertEqual(sorted(self.embeddings.embedded), sorted([PARAGRAPHS["B2"], PARAGRAPHS["X"]]))
+
+        after = self.rows(document_id)
+        self.assertEqual(set(after), {PARAGRAPHS[name] for name in ("A", "B2", "X", "C")})
+        a, c = PARAGRAPHS["A"], PARAGRAPHS["C"]
+        # Unchanged in place: same row, same vector
+        self.assertEqual(after[a], before[a])
+        # Unchanged but moved: a copy of the stored vector with the new page number
+        self.assertNotEqual(after[c][0], before[c][0])
+        self.assertEqual(after[c][1], before[c][1] + 1)
+        np.testing.assert_allclose(shard.get_vectors([after[c][0]])[after[c][0]], self.embeddings.embed_query(c), rtol=1e-6)
+
+        retired = [before[PARAGRAPHS[name]][0] for name in ("B", "C", "D")]
+        self.assertEqual(shard.live_vector_ids(retired), set())
+        current = [vector_id for vector_id, _ in after.values()]
+        self.assertEqual(shard.live_vector_ids(current), set(current))
+
+        # Searches return the new text and nothing of the previous version
+        self.assertEqual(self.search(document_id, "B2", k=1), [PARAGRAPHS["B2"]])
+        found = self.search(document_id, "B")
+        self.assertNotIn(PARAGRAPHS["B"], found)
+        self.assertNotIn(PARAGRAPHS["D"], found)
+        self.assertEqual(found.count(c), 1)
+
+    def test_new_version_keeps_the_upload_time(self):
+        document_id = ingest_document(text_document("A", "B"), self.filename)["document_id"]
+        db = SessionLocal()
+        uploaded_at, updated_at = db.get(Document, document_id).uploaded_at, db.get(Document, document_id).updated_at
+        db.close()
+        ingest_document(text_document("A", "C"), self.filename)
+        db = SessionLocal()
+        document = db.get(Document, document_id)
+        self.assertEqual(document.uploaded_at, uploaded_at)
+        self.assertGreater(document.updated_at, updated_at)
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from uuid import uuid4
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.models.metadata import Base, Chunk, Document, IngestJobRecord, SessionLocal, engine
+from app.services import model_registry
+from app.services.document_loaders import UploadTooLargeError
+from app.services.index_manager import SegmentWriter
+from app.services.ingest import create_pending_document, ingest_document
+from app.services.jobs import IngestJobQueue
+from app.services.retriever import collections
+
+TEXT = ("A plain text upload about segment merges.\n\n" * 40).encode()
+
+
+class CountingReader(io.BytesIO):
+    """A source that records how many bytes were read from it."""
+
+    def read(self, size=-1):
+        block = super().read(size)
+        self.bytes_read = getattr(self, "bytes_read", 0) + len(block)
+        return block
+
+
+class TestIngestJobQueue(unittest.TestCase):
+    """Writer election, spooling, claiming and recovery of ingest jobs."""
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(bind=engine)
+        model_registry.set_embeddings(DeterministicFakeEmbedding(size=32))
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queues = []
+        db = SessionLocal()
+        db.query(IngestJobRecord).delete()
+        db.commit()
+        db.close()
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.shutdown()
+            if queue._lock_file is not None:
+                queue._lock_file.close()  # what the process exiting would do
+        shutil.rmtree(self.directory)
+
+    def queue(self, **kwargs) -> IngestJobQueue:
+        queue = IngestJobQueue(spool_directory=os.path.join(self.directory, "spool"), lock_directory=self.directory, **kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def add_record(self, status: str, created_at: datetime) -> str:
+        job_id = str(uuid4())
+        db = SessionLocal()
+        db.add(IngestJobRecord(id=job_id, document_id=str(uuid4()), filename="x.txt", status=status, created_at=created_at))
+        db.commit()
+        db.close()
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        db = SessionLocal()
+        try:
+            return db.get(IngestJobRecord, job_id).status
+        finally:
+            db.close()
+
+    def test_only_one_queue_becomes_the_writer(self):
+        first, second = self.queue(), self.queue()
+        self.assertTrue(first._try_become_writer())
+        self.assertFalse(second._try_become_writer())
+        self.assertEqual((first.is_writer, second.is_writer), (True, False))
+        # Once the writer's process exits, the lock is free for another worker
+        first._lock_file.close()
+        first._lock_file = None
+        self.assertTrue(second._try_become_writer())
+
+    def test_jobs_of_a_previous_writer_are_resumed(self):
+        now = datetime.utcnow()
+        interrupted = self.add_record("processing", now)
+        finished = self.add_record("completed", now)
+        self.assertTrue(self.queue()._try_become_writer())
+        self.assertEqual(self.status(interrupted), "queued")
+        self.assertEqual(self.status(finished), "completed")
+
+    def test_queued_jobs_are_claimed_oldest_first_and_only_once(self):
+        now = datetime.utcnow()
+        job_ids = [self.add_record("queued", now + timedelta(seconds=offset)) for offset in (2, 0, 1)]
+        writer = self.queue(max_workers=2)
+        claimed = writer._claim_queued()
+        self.assertEqual([job.id for job in claimed], [job_ids[1], job_ids[2]])
+        self.assertEqual([self.status(job_id) for job_id in job_ids[1:]], ["processing", "processing"])
+        # No idle threads are left
+        self.assertEqual(writer._claim_queued(), [])
+        # Another worker can only claim what is still queued
+        self.assertEqual([job.id for job in self.queue(max_workers=5)._claim_queued()], [job_ids[0]])
+
+    def test_spool_hashes_and_enforces_the_size_limit(self):
+        queue = self.queue()
+        spool_path, content_hash = queue.spool(io.BytesIO(TEXT))
+        with open(spool_path, "rb") as f:
+            self.assertEqual(f.read(), TEXT)
+        self.assertEqual(content_hash, hashlib.sha256(TEXT).hexdigest())
+        os.remove(spool_path)
+
+        source = CountingReader(b"x" * (5 * 1024 * 1024))
+        with self.assertRaises(UploadTooLargeError):
+            queue.spool(source, max_bytes=1024)
+        # Stops at the first block over the limit and leaves no file behind
+        self.assertLess(source.bytes_read, 5 * 1024 * 1024)
+        self.assertEqual(os.listdir(os.path.join(self.directory, "spool")), [])
+
+    def test_spooled_upload_is_ingested_by_the_writer(self):
+        queue = self.queue()
+        spool_path, content_hash = queue.spool(io.BytesIO(TEXT))
+        job = queue.submit_spooled(spool_path, content_hash, f"{uuid4()}.txt")
+        self.assertEqual(job.status, "queued")
+        for _ in range(200):
+            # The spool file is removed once the job has left the running set
+            if queue.get(job.id).status not in ("queued", "processing") and not queue.stats()["running_jobs"]:
+                break
+            time.sleep(0.05)
+        finished = queue.get(job.id).to_dict()
+        self.assertEqual(finished["status"], "completed", finished["detail"])
+        self.assertGreater(finished["progress"]["chunks_persisted"], 0)
+        self.assertFalse(os.path.exists(spool_path))
+        self.assertTrue(queue.stats()["ingest_writer"])
+
+        # The same content again is recognised without being queued
+        spool_path, content_hash = queue.spool(io.BytesIO(TEXT))
+        duplicate = queue.submit_spooled(spool_path, content_hash, "copy.txt")
+        self.assertEqual((duplicate.status, duplicate.document_id), ("duplicate", job.document_id))
+        self.assertFalse(os.path.exists(spool_path))
+
+
+class TestInterruptedIngestion(unittest.TestCase):
+    """A job resumed after its writer died mid-ingestion ends up fully searchable."""
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(bind=engine)
+        model_registry.set_embeddings(DeterministicFakeEmbedding(size=32))
+
+    def vector_ids(self, document_id: str):
+        db = SessionLocal()
+        try:
+            return [vector_id for (vector_id,) in db.query(Chunk.vector_id).filter(Chunk.document_id == document_id)]
+        finally:
+            db.close()
+
+    def test_chunks_that_were_never_published_are_embedded_again(self):
+        filename = f"{uuid4()}.txt"
+        text = "\n\n".join(f"Paragraph {i} about merging segments after a crash." for i in range(200)).encode()
+        document_id = create_pending_document(filename)
+        shard = collections.get(None).manager_for(document_id)
+
+        # The process exits after chunk rows were committed but before their segment was published
+        with patch.object(SegmentWriter, "flush", side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                ingest_document(text, filename, document_id=document_id)
+        orphaned = self.vector_ids(document_id)
+        self.assertTrue(orphaned)
+        self.assertEqual(shard.live_vector_ids(orphaned), set())
+
+        # What the next writer does with the job it finds left in 'processing'
+        result = ingest_document(text, filename, document_id=document_id)
+        self.assertEqual(result["status"], "completed")
+        vector_ids = self.vector_ids(document_id)
+        self.assertEqual(len(vector_ids), result["num_chunks"])
+        self.assertEqual(shard.live_vector_ids(vector_ids), set(vector_ids))
+        self.assertTrue(set(vector_ids).isdisjoint(orphaned))
+        db = SessionLocal()
+        self.assertEqual(db.get(Document, document_id).status, "completed")
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
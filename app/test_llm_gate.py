@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+
+from app.services.llm_gate import LLMGate, LLMQueueTimeout, SingleFlight
+
+
+class FlakyCall:
+    """Fails the first `failures` times it is awaited, then answers."""
+
+    def __init__(self, failures: int, error: Exception = None):
+        self.failures = failures
+        self.error = error or ConnectionError("provider unavailable")
+        self.attempts = 0
+
+    async def __call__(self) -> str:
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error
+        return "answer"
+
+
+class TestLLMGate(unittest.TestCase):
+    """Retries with backoff, configuration errors and rejection when no slot frees up."""
+
+    def gate(self, **kwargs) -> LLMGate:
+        return LLMGate(**{"max_concurrency": 2, "max_queue_wait": 1, "max_retries": 2, "retry_backoff": 0.001, **kwargs})
+
+    def test_transient_failures_are_retried(self):
+        gate, call = self.gate(), FlakyCall(failures=2)
+        self.assertEqual(asyncio.run(gate.run(call)), "answer")
+        self.assertEqual(call.attempts, 3)
+        self.assertEqual((gate.calls, gate.retries, gate.failures), (1, 2, 0))
+        self.assertEqual(gate.in_flight, 0)
+
+    def test_gives_up_after_max_retries(self):
+        gate, call = self.gate(), FlakyCall(failures=5)
+        with self.assertRaises(ConnectionError):
+            asyncio.run(gate.run(call))
+        self.assertEqual(call.attempts, 3)
+        self.assertEqual((gate.retries, gate.failures), (2, 1))
+
+    def test_configuration_errors_are_not_retried(self):
+        gate, call = self.gate(), FlakyCall(failures=1, error=ValueError("missing API key"))
+        with self.assertRaises(ValueError):
+            asyncio.run(gate.run(call))
+        self.assertEqual((call.attempts, gate.retries), (1, 0))
+
+    def test_backoff_grows_exponentially(self):
+        gate = self.gate(retry_backoff=1)
+        for attempt in range(3):
+            self.assertTrue(0.5 * 2 ** attempt <= gate.backoff_seconds(attempt) <= 1.5 * 2 ** attempt)
+
+    def test_requests_beyond_the_queue_wait_are_rejected(self):
+        gate = self.gate(max_concurrency=1, max_queue_wait=0.05)
+
+        async def run():
+            release = asyncio.Event()
+
+            async def slow() -> str:
+                await release.wait()
+                return "slow"
+
+            first = asyncio.ensure_future(gate.run(slow))
+            await asyncio.sleep(0)
+            with self.assertRaises(LLMQueueTimeout):
+                await gate.run(FlakyCall(failures=0))
+            release.set()
+            return await first
+
+        self.assertEqual(asyncio.run(run()), "slow")
+        self.assertEqual((gate.calls, gate.rejected, gate.waiting), (1, 1, 0))
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Concurrent calls with the same key share one execution of the work."""
+
+    def test_concurrent_calls_with_the_same_key_are_coalesced(self):
+        flight = SingleFlight()
+        runs = []
+
+        async def work(key: str) -> str:
+            runs.append(key)
+            await asyncio.sleep(0.01)
+            return key.upper()
+
+        async def run():
+            keys = ["a", "a", "a", "b"]
+            return await asyncio.gather(*(flight.do(key, lambda key=key: work(key)) for key in keys))
+
+        self.assertEqual(asyncio.run(run()), ["A", "A", "A", "B"])
+        self.assertEqual(runs, ["a", "b"])
+        self.assertEqual(flight.stats(), {"in_flight": 0, "leaders": 2, "coalesced": 2})
+
+        # Once the work has finished, the next call starts it again
+        self.assertEqual(asyncio.run(flight.do("a", lambda: work("a"))), "A")
+        self.assertEqual(runs, ["a", "b", "a"])
+
+    def test_every_waiting_caller_gets_the_exception(self):
+        flight = SingleFlight()
+        call = FlakyCall(failures=1)
+
+        async def run():
+            return await asyncio.gather(flight.do("key", call), flight.do("key", call), return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertEqual([type(result) for result in results], [ConnectionError, ConnectionError])
+        self.assertEqual(call.attempts, 1)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from uuid import uuid4
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.models.metadata import Base, Chunk, Document, SessionLocal, engine
+from app.services.metadata_filter import FilterCache, filter_key
+from app.services.sharding import CollectionRegistry
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=32)
+
+
+class TestFilterCache(unittest.TestCase):
+    """Allow-lists built from chunk rows are cached per collection generation."""
+
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        self.directory = tempfile.mkdtemp()
+        self.collections = CollectionRegistry(self.directory, lambda: EMBEDDINGS)
+        self.cache = FilterCache(self.collections, max_entries=2)
+        self.document_ids = []
+
+    def tearDown(self):
+        db = SessionLocal()
+        db.query(Chunk).filter(Chunk.document_id.in_(self.document_ids)).delete(synchronize_session=False)
+        db.query(Document).filter(Document.id.in_(self.document_ids)).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+        self.collections.shutdown()
+        shutil.rmtree(self.directory)
+
+    def ingest(self, filename: str, num_chunks: int = 3) -> str:
+        """Indexes a document and stores its rows, as ingestion does."""
+        document_id = str(uuid4())
+        self.document_ids.append(document_id)
+        texts = [f"{filename} chunk {c}" for c in range(num_chunks)]
+        metadatas = [{"document_id": document_id, "source": filename, "page_number": c, "chunk_index": 0} for c in range(num_chunks)]
+        writer = self.collections.default.writer(document_id)
+        vector_ids = writer.add_embeddings(texts, EMBEDDINGS.embed_documents(texts), metadatas)
+        writer.commit()
+        db = SessionLocal()
+        db.add(Document(id=document_id, filename=filename, uploaded_at=datetime.utcnow(), status="completed"))
+        db.add_all(
+            Chunk(id=str(uuid4()), document_id=document_id, chunk_text=text, page_number=c, chunk_index=0, vector_id=vector_id)
+            for c, (text, vector_id) in enumerate(zip(texts, vector_ids))
+        )
+        db.commit()
+        db.close()
+        return document_id
+
+    def test_filter_key_is_canonical(self):
+        self.assertIsNone(filter_key({"document_ids": None}))
+        self.assertEqual(filter_key({"page_to": 3, "sources": ["a"]}), filter_key({"sources": ["a"], "page_to": 3, "unknown": 1}))
+
+    def test_allow_lists_are_cached_until_the_generation_changes(self):
+        document_id = self.ingest("a.pdf")
+        self.ingest("b.pdf")
+        allow = self.cache.allow_list({"sources": ["a.pdf"], "page_from": 1})
+        self.assertEqual(len(allow), 2)
+        self.assertIs(self.cache.allow_list({"page_from": 1, "sources": ["a.pdf"]}), allow)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # A new generation (here: another upload of the same name) rebuilds the entry
+        self.ingest("a.pdf")
+        rebuilt = self.cache.allow_list({"sources": ["a.pdf"], "page_from": 1})
+        self.assertIsNot(rebuilt, allow)
+        self.assertEqual(len(rebuilt), 4)
+        self.assertEqual(len(self.cache.allow_list({"document_ids": [document_id]})), 3)
+
+        self.cache.invalidate()
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        self.assertEqual(self.cache.invalidations, 1)
+
+    def test_least_recently_used_filters_are_evicted(self):
+        self.ingest("a.pdf")
+        for page in range(3):
+            self.cache.allow_list({"page_from": page})
+        self.assertEqual(self.cache.stats()["entries"], 2)
+        self.cache.allow_list({"page_from": 2})
+        self.cache.allow_list({"page_from": 0})
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
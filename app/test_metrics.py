@@ -0,0 +1,70 @@
+import re
+import unittest
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.main import app
+from app.models.metadata import Base, engine
+from app.services import model_registry
+from app.services.ingest import ingest_document
+
+TEXT = "\f".join(f"Page {i} of a manual about timing each stage of a query." for i in range(3))
+ASK_STAGES = {"query_embed", "vector_search", "lexical_search", "prompt_build", "llm_queue_wait", "llm_total"}
+
+
+def server_timing(header: str):
+    """Stage -> duration in milliseconds of a Server-Timing header value."""
+    entries = (entry.split(";dur=") for entry in header.split(", "))
+    return {stage: float(duration) for stage, duration in entries}
+
+
+def stage_counts(metrics: str):
+    """Stage -> number of observations in the rag_stage_seconds histogram."""
+    return {
+        match.group(1): float(match.group(2))
+        for match in re.finditer(r'^rag_stage_seconds_count\{stage="(\w+)"\} (\S+)$', metrics, re.MULTILINE)
+    }
+
+
+class TestStageTimings(unittest.TestCase):
+    """POST /query/ask reports its stages in Server-Timing and in the /metrics histograms."""
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(bind=engine)
+        model_registry.set_embeddings(DeterministicFakeEmbedding(size=32))
+        ingest_document(TEXT.encode(), f"{uuid4()}.txt")
+
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def test_ask_reports_each_stage(self):
+        before = stage_counts(self.client.get("/metrics").text)
+        # A question nobody asked before, so the answer cache cannot skip the LLM
+        response = self.client.post("/query/ask", json={"query": f"How is each stage timed? {uuid4()}"})
+        self.assertEqual(response.status_code, 200)
+
+        timings = server_timing(response.headers["Server-Timing"])
+        self.assertLessEqual(ASK_STAGES, set(timings))
+        self.assertNotIn("pdf_parse", timings)
+        self.assertTrue(all(duration >= 0 for duration in timings.values()))
+        # The whole request takes at least as long as any one stage of it
+        self.assertGreaterEqual(timings["total"], max(timings[stage] for stage in ASK_STAGES))
+
+        metrics = self.client.get("/metrics")
+        self.assertEqual(metrics.status_code, 200)
+        self.assertTrue(metrics.headers["content-type"].startswith("text/plain"))
+        after = stage_counts(metrics.text)
+        for stage in ASK_STAGES:
+            self.assertGreater(after[stage], before.get(stage, 0), stage)
+        self.assertIn("rag_query_batch_size_count", metrics.text)
+
+    def test_requests_without_stages_have_no_header(self):
+        response = self.client.get("/metrics")
+        self.assertNotIn("Server-Timing", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+
+from app.main import app
+from app.services import model_registry
+from app.services.model_registry import LazyModel, warm_up
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Records every query the model is asked to embed."""
+
+    queries: list = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+class SlowFactory:
+    """Builds a model slowly enough for concurrent callers to overlap, counting the builds."""
+
+    def __init__(self, model, error: Exception = None):
+        self.model = model
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(0.05)
+        if self.error is not None:
+            raise self.error
+        return self.model
+
+
+def get_concurrently(lazy: LazyModel, callers: int = 8):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(lazy.get())) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestLazyModel(unittest.TestCase):
+    """A model is built once per process, however many callers ask for it at the same time."""
+
+    def test_concurrent_callers_share_one_load(self):
+        model = object()
+        factory = SlowFactory(model)
+        lazy = LazyModel("test model", factory)
+        self.assertEqual(lazy.stats(), {"loaded": False, "load_seconds": None, "error": None})
+
+        results = get_concurrently(lazy)
+        self.assertEqual(factory.calls, 1)
+        self.assertTrue(all(result is model for result in results))
+        self.assertIs(lazy.get(), model)
+        self.assertEqual(factory.calls, 1)
+        stats = lazy.stats()
+        self.assertTrue(stats["loaded"])
+        self.assertGreaterEqual(stats["load_seconds"], 0.05)
+
+    def test_failed_load_is_not_retried(self):
+        factory = SlowFactory(None, error=RuntimeError("no weights"))
+        lazy = LazyModel("test model", factory)
+        self.assertEqual(get_concurrently(lazy), [None] * 8)
+        self.assertIsNone(lazy.get())
+        self.assertEqual(factory.calls, 1)
+        self.assertEqual((lazy.stats()["loaded"], lazy.stats()["error"]), (False, "no weights"))
+
+        # An explicitly set model replaces the failed one
+        replacement = object()
+        lazy.set(replacement)
+        self.assertIs(lazy.get(), replacement)
+        self.assertEqual((lazy.stats()["loaded"], lazy.stats()["error"]), (True, None))
+
+
+class TestWarmUp(unittest.TestCase):
+    """warm_up loads both models ahead of the first request, and /startup reports it."""
+
+    def setUp(self):
+        self.embeddings = CountingEmbedding(size=32, queries=[])
+        self.embedding_factory = SlowFactory(self.embeddings)
+        self.chat_factory = SlowFactory(FakeListChatModel(responses=["warm"]))
+        self.patches = [
+            patch.object(model_registry, "embedding_model", LazyModel("embedding model", self.embedding_factory)),
+            patch.object(model_registry, "chat_model", LazyModel("LLM", self.chat_factory)),
+            patch.dict(model_registry._startup_seconds, clear=True),
+        ]
+        for p in self.patches:
+            p.start()
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_startup_reports_warm_up_state(self):
+        report = self.client.get("/startup").json()
+        self.assertNotIn("warm_up", report["seconds"])
+        self.assertFalse(report["models"]["embeddings"]["loaded"])
+        self.assertFalse(report["models"]["llm"]["loaded"])
+        self.assertIn("worker", report)
+
+        warm_up()
+        # One forward pass through the embedding model, and neither model is loaded again later
+        self.assertEqual(self.embeddings.queries, ["warm up"])
+        self.assertIs(model_registry.get_embeddings(), self.embeddings)
+        model_registry.get_chat_model()
+        self.assertEqual((self.embedding_factory.calls, self.chat_factory.calls), (1, 1))
+
+        report = self.client.get("/startup").json()
+        self.assertGreaterEqual(report["seconds"]["warm_up"], 0.1)
+        for name in ("embeddings", "llm"):
+            self.assertTrue(report["models"][name]["loaded"], name)
+            self.assertIsNone(report["models"][name]["error"], name)
+            self.assertGreaterEqual(report["models"][name]["load_seconds"], 0.05, name)
+
+    def test_startup_reports_a_model_that_failed_to_load(self):
+        self.chat_factory.error = ValueError("Unsupported LLM provider")
+        warm_up()
+        report = self.client.get("/startup").json()
+        self.assertTrue(report["models"]["embeddings"]["loaded"])
+        self.assertFalse(report["models"]["llm"]["loaded"])
+        self.assertEqual(report["models"]["llm"]["error"], "Unsupported LLM provider")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+from benchmarks.pipeline_throughput import write_synthetic_pdf
+from app.services import ingest
+from app.services.pdf_chunking import INGEST_PAGES_PER_TASK, count_pdf_pages, iter_pdf_chunks_parallel, shutdown_parse_pool
+from app.services.segments import CHUNK_METADATA_FIELDS
+
+NUM_PAGES = 2 * INGEST_PAGES_PER_TASK + 7
+SENTENCES = [f"Sentence {i} describes part {i % 7} of the parsing pipeline." for i in range(40)]
+
+
+def summary(chunks):
+    """What ingestion stores of each chunk: its text and metadata."""
+    return [(chunk.page_content, tuple(chunk.metadata.get(field) for field in CHUNK_METADATA_FIELDS)) for chunk in chunks]
+
+
+class TestParallelPdfChunking(unittest.TestCase):
+    """Page ranges parsed across processes come back in page order, exactly as parsed serially."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, "manual.pdf")
+        write_synthetic_pdf(cls.path, SENTENCES, NUM_PAGES, page_chars=1500, rng=random.Random(7))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown_parse_pool()
+        shutil.rmtree(cls.directory)
+
+    def test_parallel_and_serial_chunks_are_identical(self):
+        self.assertEqual(count_pdf_pages(self.path), NUM_PAGES)
+        reported = {"serial": [], "parallel": []}
+
+        def chunks_of(path_name: str, parallel_min_pages: int):
+            with patch.object(ingest, "INGEST_PARALLEL_MIN_PAGES", parallel_min_pages), patch.object(ingest, "INGEST_PARSE_PROCESSES", 2):
+                return list(ingest._iter_page_chunks(
+                    self.path, "manual.pdf", "doc-1", NUM_PAGES, lambda pages_parsed: reported[path_name].append(pages_parsed),
+                ))
+
+        serial = chunks_of("serial", NUM_PAGES + 1)
+        parallel = chunks_of("parallel", 1)
+        self.assertGreater(len(serial), NUM_PAGES)
+        self.assertEqual(summary(parallel), summary(serial))
+        # Serial reports every page, parallel every page range; both only ever move forward
+        self.assertEqual(reported["serial"], list(range(1, NUM_PAGES + 1)))
+        self.assertEqual(reported["parallel"], [INGEST_PAGES_PER_TASK, 2 * INGEST_PAGES_PER_TASK, NUM_PAGES])
+
+        pages = [chunk.metadata["page_number"] for chunk in parallel]
+        self.assertEqual(pages, sorted(pages))
+        self.assertEqual(set(pages), set(range(NUM_PAGES)))
+        for page in set(pages):
+            indexes = [chunk.metadata["chunk_index"] for chunk in parallel if chunk.metadata["page_number"] == page]
+            self.assertEqual(indexes, list(range(len(indexes))))
+
+    def test_ranges_are_yielded_in_order_with_one_in_flight(self):
+        executor = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            ranges = list(iter_pdf_chunks_parallel(self.path, "manual.pdf", "doc-1", NUM_PAGES, executor=executor, max_pending=1))
+        finally:
+            executor.shutdown()
+        self.assertEqual([end for end, _ in ranges], [INGEST_PAGES_PER_TASK, 2 * INGEST_PAGES_PER_TASK, NUM_PAGES])
+        for (end, chunks), start in zip(ranges, (0, INGEST_PAGES_PER_TASK, 2 * INGEST_PAGES_PER_TASK)):
+            self.assertEqual({chunk.metadata["page_number"] for chunk in chunks}, set(range(start, end)))
+
+
+if __name__ == "__main__":
+    unittest.main()
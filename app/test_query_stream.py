@@ -0,0 +1,116 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document as LangchainDocument
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+
+from app.main import app
+from app.services import answer_cache, llm as llm_service, model_registry
+
+FAKE_ANSWER = "Streaming works offline."
+FAKE_CHUNKS = [
+    LangchainDocument(
+        page_content="The document describes an offline test.",
+        metadata={"document_id": "doc-1", "source": "test_document.pdf", "page_number": 0, "chunk_index": 0},
+    )
+]
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestQueryStream(unittest.TestCase):
+    """Exercises POST /query/stream with the fake LLM provider; needs no network, API key or index."""
+
+    @classmethod
+    def setUpClass(cls):
+        # The answer cache embeds queries; keep the real model from being loaded
+        model_registry.set_embeddings(DeterministicFakeEmbedding(size=32))
+        answer_cache._answer_cache = None
+
+    def setUp(self):
+        async def fake_retrieve_chunks(query_text, top_k=4, nprobe=None, ef_search=None, filters=None, collection=None):
+            return FAKE_CHUNKS
+
+        async def fake_retrieve_chunks_batch(queries):
+            return [FAKE_CHUNKS for _ in queries]
+
+        fake_llm = FakeListChatModel(responses=[FAKE_ANSWER], sleep=0.005)
+        self.patches = [
+            patch("app.routes.query.retrieve_chunks", fake_retrieve_chunks),
+            patch("app.routes.query.retrieve_chunks_batch", fake_retrieve_chunks_batch),
+            patch.object(llm_service, "get_chat_model", lambda: fake_llm),
+        ]
+        for p in self.patches:
+            p.start()
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_streams_tokens_as_server_sent_events(self):
+        response = self.client.post("/query/stream", json={"query": "What is this document about?", "top_k": 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+
+        events = parse_sse(response.text)
+        self.assertEqual(events[0][0], "context")
+        self.assertEqual(events[0][1]["chunks"][0]["document_id"], "doc-1")
+
+        tokens = [data["text"] for event, data in events if event == "token"]
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual("".join(tokens), FAKE_ANSWER)
+
+        event, done = events[-1]
+        self.assertEqual(event, "done")
+        self.assertEqual(done["tokens"], len(tokens))
+        self.assertLess(done["ttft_ms"], done["total_ms"])
+
+    def test_empty_query_is_rejected(self):
+        response = self.client.post("/query/stream", json={"query": "  "})
+        self.assertEqual(response.status_code, 400)
+
+    def test_ask_reports_the_packed_context_like_stream(self):
+        response = self.client.post("/query/ask", json={"query": "What does the offline test describe?"})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["response"], FAKE_ANSWER)
+        self.assertEqual(set(body["context"]), {"retrieved_chunks", "chunks_used", "passages", "tokens", "tokens_saved"})
+        self.assertEqual(body["context"]["retrieved_chunks"], len(FAKE_CHUNKS))
+
+        events = parse_sse(self.client.post("/query/stream", json={"query": "What does the offline test describe?"}).text)
+        self.assertEqual(events[0][1]["context"], body["context"])
+
+    def test_batch_streams_one_json_line_per_query(self):
+        queries = [{"query": f"Question {i}?"} for i in range(5)] + [{"query": " "}]
+        response = self.client.post("/query/batch", json={"queries": queries, "concurrency": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("application/x-ndjson"))
+
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(sorted(line["index"] for line in lines), list(range(6)))
+        by_index = {line["index"]: line for line in lines}
+        self.assertEqual(by_index[5]["status"], 400)
+        for i in range(5):
+            self.assertEqual(by_index[i]["status"], 200)
+            self.assertEqual(by_index[i]["response"], FAKE_ANSWER)
+
+    def test_batch_retrieval_only_skips_the_llm(self):
+        with patch.object(llm_service, "get_chat_model", lambda: None):
+            response = self.client.post("/query/batch", json={"queries": [{"query": "What?"}], "retrieval_only": True})
+        line = json.loads(response.text)
+        self.assertNotIn("response", line)
+        self.assertEqual(line["chunks"][0]["content"], FAKE_CHUNKS[0].page_content)
+
+
+if __name__ == "__main__":
+    unittest.main()
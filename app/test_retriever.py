@@ -0,0 +1,78 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.services.metadata_filter import FilterCache
+from app.services.retriever import QueryBatcher
+from app.services.sharding import CollectionRegistry
+
+TOPICS = ["faiss segments", "bm25 ranking", "pdf parsing", "query batching", "answer caching", "metadata filters"]
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Counts forward passes, i.e. calls that embed a batch of texts."""
+
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return super().embed_documents(texts)
+
+
+class TestQueryBatcher(unittest.TestCase):
+    """Concurrent queries share one embedding pass and get the same results as alone."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.embeddings = CountingEmbedding(size=32)
+        self.collections = CollectionRegistry(self.directory, lambda: self.embeddings)
+        texts = [f"{topic} note {c}" for topic in TOPICS for c in range(3)]
+        metadatas = [{"document_id": "doc", "source": "doc.pdf", "page_number": 0, "chunk_index": c} for c in range(len(texts))]
+        writer = self.collections.default.writer("doc")
+        writer.add_embeddings(texts, self.embeddings.embed_documents(texts), metadatas)
+        writer.commit()
+        self.filters = FilterCache(self.collections)
+        self.embeddings.calls = 0
+
+    def tearDown(self):
+        self.collections.shutdown()
+        shutil.rmtree(self.directory)
+
+    def run_concurrently(self, batcher: QueryBatcher, queries):
+        async def run():
+            return await asyncio.gather(*(batcher.search(query, k) for query, k in queries))
+
+        return [[doc.page_content for doc in docs] for docs in asyncio.run(run())]
+
+    def test_concurrent_queries_are_batched(self):
+        queries = [(topic, k) for topic, k in zip(TOPICS, (1, 2, 3, 4, 5, 6))]
+        alone = self.run_concurrently(QueryBatcher(self.collections, self.filters, max_size=1), queries)
+        self.assertEqual(self.embeddings.calls, len(queries))
+
+        batcher = QueryBatcher(self.collections, self.filters, max_wait_ms=50, max_size=4)
+        before = batcher.stats()
+        self.embeddings.calls = 0
+        batched = self.run_concurrently(batcher, queries)
+        self.assertEqual(batched, alone)
+        self.assertEqual([len(docs) for docs in batched], [k for _, k in queries])
+        # A batch closes once it holds max_size queries; the rest wait for the timer
+        self.assertEqual(self.embeddings.calls, 2)
+        after = batcher.stats()
+        self.assertEqual(after["batches"] - before["batches"], 2)
+        self.assertEqual(after["queries"] - before["queries"], len(queries))
+        for bucket in ("<=2", "<=4"):
+            self.assertEqual(after["batch_size"]["buckets"][bucket] - before["batch_size"]["buckets"][bucket], 1)
+        self.assertEqual(after["wait_ms"]["count"] - before["wait_ms"]["count"], len(queries))
+
+    def test_search_many_is_one_batch(self):
+        batcher = QueryBatcher(self.collections, self.filters, max_size=2)
+        results = asyncio.run(batcher.search_many([(topic, 2, None, None, None, None) for topic in TOPICS]))
+        self.assertEqual(self.embeddings.calls, 1)
+        self.assertEqual([len(docs) for docs in results], [2] * len(TOPICS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.services import sharding
+from app.services.sharding import COLLECTIONS_DIRNAME, CollectionNotFoundError, CollectionRegistry, shard_of
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=32)
+TOPICS = ["faiss segments", "bm25 ranking", "pdf parsing", "query batching", "answer caching", "metadata filters"]
+
+
+class TestSharding(unittest.TestCase):
+    """A collection split over several shards must answer exactly like one unsharded index."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.collections = CollectionRegistry(self.directory, lambda: EMBEDDINGS)
+        self.sharded, _ = self.collections.create("sharded", num_shards=3)
+        self.single, _ = self.collections.create("single", num_shards=1)
+        self.vector_ids = {}
+        for index in (self.sharded, self.single):
+            for d, topic in enumerate(TOPICS):
+                document_id = f"doc-{d}"
+                texts = [f"{topic} note {c} about {TOPICS[(d + c) % len(TOPICS)]}" for c in range(4)]
+                metadatas = [{"document_id": document_id, "source": f"{d}.pdf", "page_number": 0, "chunk_index": c} for c in range(4)]
+                writer = index.writer(document_id)
+                self.vector_ids[index.name, document_id] = writer.add_embeddings(texts, EMBEDDINGS.embed_documents(texts), metadatas)
+                writer.commit()
+
+    def tearDown(self):
+        self.collections.shutdown()
+        shutil.rmtree(self.directory)
+
+    def test_documents_are_spread_over_shards(self):
+        self.assertEqual(shard_of("doc-1", 3), shard_of("doc-1", 3))
+        self.assertEqual(self.sharded.stats()["num_vectors"], 4 * len(TOPICS))
+        self.assertGreater(sum(1 for shard in self.sharded.stats()["shards"] if shard["num_vectors"]), 1)
+
+    def test_fan_out_search_matches_single_index(self):
+        vectors = EMBEDDINGS.embed_documents(["faiss segments note 1 about bm25 ranking", "pdf parsing"])
+        sharded = self.sharded.similarity_search_by_vectors(vectors, k=5)
+        single = self.single.similarity_search_by_vectors(vectors, k=5)
+        self.assertEqual([[doc.page_content for doc in docs] for docs in sharded], [[doc.page_content for doc in docs] for docs in single])
+
+        sharded = self.sharded.lexical_search("query batching caching", k=5)
+        single = self.single.lexical_search("query batching caching", k=5)
+        self.assertEqual([doc.page_content for doc in sharded], [doc.page_content for doc in single])
+
+    def test_allow_list_limits_every_shard(self):
+        allow = self.sharded.allow_list(self.vector_ids["sharded", "doc-2"])
+        self.assertEqual(len(allow), 4)
+        docs = self.sharded.lexical_search("pdf parsing note", k=10, allow=allow)
+        self.assertEqual({doc.metadata["document_id"] for doc in docs}, {"doc-2"})
+        vectors = EMBEDDINGS.embed_documents(["faiss segments"])
+        docs = self.sharded.similarity_search_by_vectors(vectors, k=10, allow=allow)[0]
+        self.assertEqual(len(docs), 4)
+        self.assertEqual({doc.metadata["document_id"] for doc in docs}, {"doc-2"})
+        self.assertEqual(self.sharded.lexical_search("pdf", k=5, allow=self.sharded.allow_list([])), [])
+
+    def test_unknown_collection(self):
+        with self.assertRaises(CollectionNotFoundError):
+            self.collections.get("missing")
+        self.assertEqual(sorted(self.collections.names()), ["default", "sharded", "single"])
+
+
+class TestConcurrentCreate(unittest.TestCase):
+    """Registries of different worker processes racing to create one collection agree on it."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registries = [CollectionRegistry(self.directory, lambda: EMBEDDINGS) for _ in range(8)]
+
+    def tearDown(self):
+        for registry in self.registries:
+            registry.shutdown()
+        shutil.rmtree(self.directory)
+
+    def test_one_creator_wins(self):
+        start = threading.Barrier(len(self.registries))
+        results = []
+
+        def create(registry, num_shards):
+            start.wait()
+            collection, created = registry.create("raced", num_shards=num_shards)
+            results.append((len(collection.managers), created))
+
+        threads = [threading.Thread(target=create, args=(registry, n + 1)) for n, registry in enumerate(self.registries)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(created for _, created in results), 1)
+        self.assertEqual(len({num_shards for num_shards, _ in results}), 1)
+        # Only the config and the shards are left behind, no temporary files
+        path = os.path.join(self.directory, COLLECTIONS_DIRNAME, "raced")
+        self.assertEqual([name for name in os.listdir(path) if name.startswith(".")], [])
+
+    def test_config_being_written_is_not_visible(self):
+        creator, reader = self.registries[:2]
+        seen = []
+        dump = json.dump
+
+        def dump_while_reading(obj, f, **kwargs):
+            # Another process looks the collection up while its config is being written
+            # (later dumps are the shard manifests)
+            if not seen:
+                try:
+                    reader.get("raced")
+                    seen.append("found")
+                except CollectionNotFoundError:
+                    seen.append("not found")
+            dump(obj, f, **kwargs)
+
+        with patch.object(sharding.json, "dump", dump_while_reading):
+            creator.create("raced", num_shards=2)
+        self.assertEqual(seen, ["not found"])
+        self.assertEqual(len(reader.get("raced").managers), 2)
+
+if __name__ == "__main__":
+    unittest.main()
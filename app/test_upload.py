@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.main import app
+from app.models.metadata import Base, engine
+from app.routes import upload
+from app.services import model_registry
+
+TEXT = ("A plain text upload about segment merges.\n\n" * 100).encode()
+
+
+class TestUploadSizeLimits(unittest.TestCase):
+    """Oversized requests are refused before their body is read, oversized files while spooled."""
+
+    def test_content_length_over_the_limit_is_rejected_before_the_body_is_read(self):
+        router = APIRouter(route_class=upload.UploadRoute)
+        bodies = []
+
+        @router.post("/limited")
+        @upload.max_request_bytes(1000)
+        async def limited(request: Request):
+            bodies.append(await request.body())
+            return {}
+
+        small = FastAPI()
+        small.include_router(router, prefix="/upload")
+        client = TestClient(small)
+        self.assertEqual(client.post("/upload/limited", content=b"x" * 1000).status_code, 200)
+        response = client.post("/upload/limited", content=b"x" * 1001)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(len(bodies), 1)
+
+    def test_file_over_the_limit_fails_while_spooled(self):
+        with patch.object(upload, "MAX_FILE_SIZE_BYTES", 1024):
+            response = TestClient(app).post("/upload/documents", files=[("files", ("big.txt", TEXT, "text/plain"))])
+        self.assertEqual(response.status_code, 200)
+        result = response.json()["results"][0]
+        self.assertEqual(result["status"], "failed")
+        self.assertIn("exceeds the maximum size", result["detail"])
+
+
+class TestUploadFormats(unittest.TestCase):
+    """Files are accepted or refused by their content, whatever their name."""
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(bind=engine)
+        # The queued job is picked up by this process as the ingest writer
+        model_registry.set_embeddings(DeterministicFakeEmbedding(size=32))
+
+    def test_format_is_sniffed_rather_than_taken_from_the_extension(self):
+        files = [("files", ("notes.md", TEXT, "text/markdown")), ("files", ("report.pdf", bytes(range(256)) * 8, "application/pdf"))]
+        results = TestClient(app).post("/upload/documents", files=files).json()["results"]
+        self.assertEqual(results[0]["status"], "queued")
+        self.assertEqual(results[1]["status"], "failed")
+        self.assertIn("report.pdf", results[1]["detail"])
+
+
+if __name__ == "__main__":
+    unittest.main()
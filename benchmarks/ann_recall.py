@@ -0,0 +1,123 @@
+"""
+Recall@k and query latency of the approximate index types against the exact flat baseline.
+
+By default it uses a synthetic clustered corpus shaped like sentence-transformer output
+(unit-norm, 384 dims). `--index-dir` uses the vectors of an existing segmented index
+instead, e.g. `vector_db_data/faiss_index`, with a sample of them as queries.
+
+    python -m benchmarks.ann_recall --vectors 50000 --queries 200 --output ann_report.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+from app.services.ann import build_index, reconstruct_all, search_parameters
+
+
+def synthetic_corpus(num_vectors: int, dimension: int, num_clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dimension)).astype(np.float32)
+    assignments = rng.integers(0, num_clusters, size=num_vectors)
+    vectors = centers[assignments] + 0.6 * rng.normal(size=(num_vectors, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_index_vectors(index_dir: str) -> np.ndarray:
+    """Collects the stored vectors of every segment in an index directory."""
+    paths = sorted(glob.glob(os.path.join(index_dir, "segments", "*", "index.faiss")))
+    if not paths:
+        # Index saved before segments were introduced
+        paths = [os.path.join(index_dir, "index.faiss")]
+    return np.vstack([reconstruct_all(faiss.read_index(path)) for path in paths])
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).size)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, truth: np.ndarray, params) -> dict:
+    latencies = []
+    found = []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query[None, :], k, params=params)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append(ids[0])
+    recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+    latencies = np.array(latencies)
+    return {
+        "recall_at_k": round(recall, 4),
+        "latency_ms_mean": round(float(latencies.mean()), 4),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 4),
+    }
+
+
+def run(vectors: np.ndarray, num_queries: int, k: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed + 1)
+    query_rows = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    # Perturb the sampled vectors so queries are near, not identical to, stored vectors
+    queries = vectors[query_rows] + 0.05 * rng.normal(size=(len(query_rows), vectors.shape[1])).astype(np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+    report = {"num_vectors": int(len(vectors)), "dimension": int(vectors.shape[1]), "queries": int(len(queries)), "k": k, "results": []}
+
+    sweeps = {
+        "flat": [{}],
+        "ivf_flat": [{"nprobe": n} for n in (1, 4, 8, 16, 32)],
+        "ivf_pq": [{"nprobe": n} for n in (1, 4, 8, 16, 32)],
+        "hnsw": [{"ef_search": e} for e in (16, 32, 64, 128)],
+    }
+    truth = None
+    for index_type, settings in sweeps.items():
+        started = time.perf_counter()
+        index = build_index(index_type, vectors)
+        build_seconds = time.perf_counter() - started
+        if truth is None:
+            _, truth = index.search(queries, k)
+        for setting in settings:
+            params = search_parameters(index, **setting)
+            result = {"index_type": index_type, **setting, "build_seconds": round(build_seconds, 2),
+                      "memory_bytes": index_memory_bytes(index)}
+            result.update(measure(index, queries, k, truth, params))
+            report["results"].append(result)
+            print(json.dumps(result), file=sys.stderr)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", help="use the vectors of this FAISS index directory")
+    parser.add_argument("--vectors", type=int, default=50000, help="synthetic corpus size")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.index_dir:
+        vectors = load_index_vectors(args.index_dir)
+    else:
+        vectors = synthetic_corpus(args.vectors, args.dimension, args.clusters, args.seed)
+
+    report = run(vectors, args.queries, args.k, args.seed)
+    report["benchmark"] = "ann_recall"
+    report["source"] = args.index_dir or "synthetic"
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
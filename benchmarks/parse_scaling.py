@@ -0,0 +1,88 @@
+"""
+Measures PDF parse + chunk throughput (pages/sec) against the number of parse processes.
+
+`test_document.pdf` is replicated to a large page count and then extracted, cleaned and
+chunked with the same code ingestion uses, once sequentially in-process and once per
+pool size. No embedding model or database is needed.
+
+    python -m benchmarks.parse_scaling --pages 1000 --processes 1 2 4 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from pypdf import PdfReader, PdfWriter
+
+from app.services.pdf_chunking import chunk_page_range, chunk_pdf_parallel
+
+DEFAULT_SOURCE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_document.pdf")
+
+
+def build_replicated_pdf(source_pdf: str, num_pages: int, output_path: str) -> None:
+    source_pages = PdfReader(source_pdf).pages
+    writer = PdfWriter()
+    for i in range(num_pages):
+        writer.add_page(source_pages[i % len(source_pages)])
+    with open(output_path, "wb") as f:
+        writer.write(f)
+
+
+def run(source_pdf: str, num_pages: int, process_counts):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "replicated.pdf")
+        build_replicated_pdf(source_pdf, num_pages, pdf_path)
+
+        results = []
+
+        started = time.perf_counter()
+        chunks = chunk_page_range(pdf_path, 0, num_pages, "replicated.pdf", "bench")
+        elapsed = time.perf_counter() - started
+        results.append({"mode": "sequential", "processes": 1, "seconds": round(elapsed, 3),
+                        "pages_per_sec": round(num_pages / elapsed, 1), "chunks": len(chunks)})
+
+        for processes in process_counts:
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+                # Warm the workers up so spawn cost is not counted against parsing
+                list(pool.map(chunk_page_range, [pdf_path] * processes, [0] * processes, [1] * processes,
+                              ["warmup"] * processes, ["warmup"] * processes))
+                started = time.perf_counter()
+                chunks = chunk_pdf_parallel(pdf_path, "replicated.pdf", "bench", num_pages, executor=pool)
+                elapsed = time.perf_counter() - started
+            results.append({"mode": "parallel", "processes": processes, "seconds": round(elapsed, 3),
+                            "pages_per_sec": round(num_pages / elapsed, 1), "chunks": len(chunks)})
+
+    return {
+        "benchmark": "parse_scaling",
+        "source_pdf": os.path.basename(source_pdf),
+        "pages": num_pages,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=DEFAULT_SOURCE_PDF, help="PDF to replicate")
+    parser.add_argument("--pages", type=int, default=1000, help="page count of the replicated PDF")
+    parser.add_argument("--processes", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}), help="pool sizes to measure")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.source, args.pages, args.processes)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""
+End-to-end ingest and query throughput of the RAG pipeline, fully offline.
+
+Every external dependency is replaced by a deterministic stand-in: a hashing embedder
+instead of HuggingFaceEmbeddings, the fake chat model (`LLM_PROVIDER=fake`) instead of
+Gemini / OpenAI, and a throwaway SQLite database and index directory instead of
+`DATABASE_URL` and `vector_db_data`. The corpus is `--documents` PDFs of `--pages` pages
+each, written from sentences of `test_document.pdf` reshuffled per page, so that every
+chunk is distinct text with the vocabulary of the real document.
+
+Ingestion reports pages/sec, chunks/sec and the per-stage time split; the index its size
+on disk and in memory; queries their latency percentiles and throughput per concurrency
+level, both for retrieval alone and for `POST /query/ask` through the API.
+
+    python -m benchmarks.pipeline_throughput --documents 20 --pages 50 --concurrency 1 4 16 64 --output pipeline.json
+
+Other settings (`INDEX_TYPE`, `RETRIEVAL_MODE`, `QUERY_BATCH_MAX_SIZE`, ...) are read from
+the environment as usual, so two runs can compare configurations as well as commits.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SOURCE_PDF = os.path.join(REPO_ROOT, "test_document.pdf")
+QUERY_MODES = ("retrieve", "ask")
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Feature-hashed bag of words, L2-normalised. Deterministic and instant, and texts
+    sharing words get similar vectors, so search behaves like it does on real embeddings.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimension] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def source_sentences(source_pdf: str) -> List[str]:
+    text = " ".join(page.extract_text() or "" for page in PdfReader(source_pdf).pages)
+    return [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+", " ".join(text.split())) if sentence.strip()]
+
+
+def _escape(line: str) -> bytes:
+    line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return line.encode("latin-1", "replace")
+
+
+def write_synthetic_pdf(path: str, sentences: List[str], num_pages: int, page_chars: int, rng: random.Random) -> None:
+    """Writes `num_pages` pages of Helvetica text, each a fresh shuffle of `sentences`."""
+    writer = PdfWriter()
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    for _ in range(num_pages):
+        page_sentences: List[str] = []
+        while sum(len(sentence) + 1 for sentence in page_sentences) < page_chars:
+            page_sentences.extend(rng.sample(sentences, len(sentences)))
+        lines = textwrap.wrap(" ".join(page_sentences)[:page_chars], 95)
+        content = DecodedStreamObject()
+        content.set_data(b"BT /F1 9 Tf 11 TL 40 760 Td " + b" T* ".join(b"(" + _escape(line) + b") Tj" for line in lines) + b" ET")
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        page.replace_contents(content)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def build_corpus(source_pdf: str, directory: str, num_documents: int, num_pages: int, seed: int) -> List[str]:
+    sentences = source_sentences(source_pdf)
+    page_chars = sum(len(page.extract_text() or "") for page in PdfReader(source_pdf).pages) // len(PdfReader(source_pdf).pages)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(num_documents):
+        path = os.path.join(directory, f"synthetic-{i:04d}.pdf")
+        write_synthetic_pdf(path, sentences, num_pages, page_chars, rng)
+        paths.append(path)
+    return paths
+
+
+def build_queries(source_pdf: str, num_queries: int, seed: int) -> List[str]:
+    """Word windows of the source text, so most queries have lexical and semantic matches."""
+    words = " ".join(source_sentences(source_pdf)).split()
+    rng = random.Random(seed + 1)
+    windows = [" ".join(words[start:start + 8]) for start in range(0, max(len(words) - 8, 1), 3)]
+    queries: List[str] = []
+    while len(queries) < num_queries:
+        queries.extend(rng.sample(windows, len(windows)))
+    return queries[:num_queries]
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the peak, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def stage_totals() -> Dict[str, Dict[str, float]]:
+    from prometheus_client import REGISTRY
+
+    from app.services.metrics import INGEST_STAGES, QUERY_STAGES
+
+    totals = {}
+    for stage in QUERY_STAGES + INGEST_STAGES:
+        count = REGISTRY.get_sample_value("rag_stage_seconds_count", {"stage": stage}) or 0.0
+        seconds = REGISTRY.get_sample_value("rag_stage_seconds_sum", {"stage": stage}) or 0.0
+        totals[stage] = {"count": count, "seconds": seconds}
+    return totals
+
+
+def stage_delta(before: Dict, after: Dict) -> Dict[str, Dict[str, float]]:
+    delta = {}
+    for stage, totals in after.items():
+        count = totals["count"] - before[stage]["count"]
+        if count:
+            delta[stage] = {"count": int(count), "seconds": round(totals["seconds"] - before[stage]["seconds"], 4)}
+    return delta
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_ingest(paths: List[str]) -> Dict:
+    from app.services.ingest import ingest_document
+
+    pages = sum(len(PdfReader(path).pages) for path in paths)
+    chunks = 0
+    before = stage_totals()
+    started = time.perf_counter()
+    for path in paths:
+        chunks += ingest_document(None, os.path.basename(path), file_path=path)["num_chunks"]
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": len(paths),
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 2),
+        "chunks_per_sec": round(chunks / elapsed, 2),
+        "stages": stage_delta(before, stage_totals()),
+    }
+
+
+def index_report(vector_db_directory: str) -> Dict:
+    import faiss
+
+    from app.services.retriever import index_manager
+
+    snapshot = index_manager.refresh()
+    stats = index_manager.stats()
+    return {
+        "index_type": stats["index_type"],
+        "num_vectors": stats["num_vectors"],
+        "num_segments": stats["num_segments"],
+        "disk_bytes": directory_size(vector_db_directory),
+        # FAISS indexes are resident; chunk stores and BM25 postings are memory-mapped
+        "faiss_memory_bytes": sum(int(faiss.serialize_index(segment.index).size) for segment in snapshot.segments),
+        "process_rss_bytes": rss_bytes(),
+    }
+
+
+async def run_queries(mode: str, queries: List[str], concurrency: int, top_k: int) -> Dict:
+    import httpx
+
+    from app.main import app
+    from app.services.retriever import retrieve_chunks
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None)
+    pending = iter(queries)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(query: str) -> bool:
+        if mode == "retrieve":
+            await retrieve_chunks(query, top_k)
+            return True
+        response = await client.post("/query/ask", json={"query": query, "top_k": top_k})
+        return response.status_code == 200
+
+    async def worker() -> None:
+        nonlocal errors
+        for query in pending:
+            started = time.perf_counter()
+            try:
+                ok = await one(query)
+            except Exception:
+                ok = False
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += not ok
+
+    async with client:
+        # Warm-up: first calls pay for lazy initialisation that later ones do not
+        for query in queries[:min(len(queries), 5)]:
+            await one(query)
+        before = stage_totals()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    measured = np.array(latencies)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            "mean": round(float(measured.mean()), 3),
+            "p50": round(float(np.percentile(measured, 50)), 3),
+            "p95": round(float(np.percentile(measured, 95)), 3),
+            "p99": round(float(np.percentile(measured, 99)), 3),
+            "max": round(float(measured.max()), 3),
+        },
+        "stages": stage_delta(before, stage_totals()),
+    }
+
+
+def run(args, work_dir: str) -> Dict:
+    # The stand-ins must be configured before any app module reads its settings
+    vector_db_directory = os.path.join(work_dir, "faiss_index")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'metadata.db')}",
+        "VECTOR_DB_DIRECTORY": vector_db_directory,
+        "LLM_PROVIDER": "fake",
+        "EMBEDDING_CACHE_ENABLED": "false",
+        "ANSWER_CACHE_ENABLED": "false",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from app.main import app  # noqa: F401  (configures logging and the routes used below)
+    from app.models.metadata import Base, engine
+    from app.services.model_registry import set_embeddings
+
+    set_embeddings(HashingEmbeddings(args.dimension))
+    Base.metadata.create_all(bind=engine)
+
+    corpus_dir = os.path.join(work_dir, "corpus")
+    os.makedirs(corpus_dir)
+    paths = build_corpus(args.source, corpus_dir, args.documents, args.pages, args.seed)
+    queries = build_queries(args.source, args.queries, args.seed)
+
+    report = {
+        "benchmark": "pipeline_throughput",
+        "git_commit": git_commit(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "documents": args.documents,
+            "pages_per_document": args.pages,
+            "queries_per_level": args.queries,
+            "top_k": args.top_k,
+            "dimension": args.dimension,
+            "seed": args.seed,
+            "index_type": os.getenv("INDEX_TYPE", "flat"),
+            "retrieval_mode": os.getenv("RETRIEVAL_MODE", "hybrid"),
+        },
+        "ingest": run_ingest(paths),
+        "index": index_report(vector_db_directory),
+        "query": [],
+    }
+    for mode in args.modes:
+        for concurrency in args.concurrency:
+            result = asyncio.run(run_queries(mode, queries, concurrency, args.top_k))
+            report["query"].append(result)
+            print(json.dumps({key: result[key] for key in ("mode", "concurrency", "requests_per_sec", "latency_ms")}), file=sys.stderr)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=DEFAULT_SOURCE_PDF, help="PDF whose sentences make up the corpus")
+    parser.add_argument("--documents", type=int, default=10, help="number of synthetic PDFs to ingest")
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic PDF")
+    parser.add_argument("--queries", type=int, default=200, help="requests per mode and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--modes", nargs="+", choices=QUERY_MODES, default=list(QUERY_MODES))
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--dimension", type=int, default=384, help="hashing embedder dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The app prints progress to stdout; keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run(args, work_dir)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Cold-start cost of an API worker: how long `import app.main` takes, how long the model
+warm-up takes, and the resident memory after each. Every run is a fresh interpreter, so
+nothing is shared between runs; the median is reported.
+
+    python -m benchmarks.startup_time --runs 5 --top-imports 15 --output startup.json
+
+The worker's environment is used as is (`LLM_PROVIDER`, `EMBEDDING_MODEL_NAME`, ...);
+`DATABASE_URL` defaults to an in-memory SQLite database since nothing is queried.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line on the last line of stdout
+CHILD_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from app.services.model_registry import rss_bytes, startup_report, warm_up
+rss_after_import = rss_bytes()
+warm_up()
+report = startup_report()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "warm_up_seconds": report["seconds"]["warm_up"],
+    "rss_after_import_bytes": rss_after_import,
+    "rss_after_warm_up_bytes": report["rss_bytes"],
+    "models": report["models"],
+}))
+"""
+
+
+def child_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    return env
+
+
+def measure_once() -> Dict:
+    result = subprocess.run([sys.executable, "-c", CHILD_SCRIPT], cwd=REPO_ROOT, env=child_env(),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit: int) -> List[Dict]:
+    """The packages that cost `import app.main` the most, from `python -X importtime`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=REPO_ROOT,
+                            env=child_env(), capture_output=True, text=True, check=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if line.startswith("import time:") and len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2].rstrip()
+            entries.append(((len(name) - len(name.lstrip())) // 2, int(parts[1]), name.strip().split(".")[0]))
+
+    # Imports are listed children first; walking them backwards visits each parent before
+    # its children. A package is charged once, where it is first entered from another package.
+    packages: Dict[str, int] = {}
+    ancestors: List[tuple] = []
+    for depth, cumulative, package in reversed(entries):
+        while ancestors and ancestors[-1][0] >= depth:
+            ancestors.pop()
+        if package != "app" and package not in {ancestor for _, ancestor in ancestors}:
+            packages[package] = packages.get(package, 0) + cumulative
+        ancestors.append((depth, package))
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{"package": package, "seconds": round(micros / 1e6, 4)} for package, micros in slowest]
+
+
+def run(num_runs: int, num_top_imports: int) -> Dict:
+    runs = [measure_once() for _ in range(num_runs)]
+    for i, result in enumerate(runs):
+        print(json.dumps({"run": i, "import_seconds": round(result["import_seconds"], 3),
+                          "warm_up_seconds": round(result["warm_up_seconds"], 3)}), file=sys.stderr)
+
+    def median(key: str):
+        values = [result[key] for result in runs if result[key] is not None]
+        return round(statistics.median(values), 4) if values else None
+
+    report = {
+        "benchmark": "startup_time",
+        "runs": num_runs,
+        "llm_provider": os.getenv("LLM_PROVIDER", "gemini"),
+        "import_seconds": median("import_seconds"),
+        "warm_up_seconds": median("warm_up_seconds"),
+        "rss_after_import_bytes": median("rss_after_import_bytes"),
+        "rss_after_warm_up_bytes": median("rss_after_warm_up_bytes"),
+        "models": runs[-1]["models"],
+    }
+    if num_top_imports:
+        report["top_imports"] = top_imports(num_top_imports)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top-imports", type=int, default=10, help="list the N slowest imported packages (0 to skip)")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.runs, args.top_imports)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())